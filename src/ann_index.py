@@ -0,0 +1,313 @@
+# src/ann_index.py
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+from instrumentation import tracer
+
+# faiss is imported by the functions that use it, so that importing the search
+# parameters does not load it
+
+logger = logging.getLogger("rag.search")
+
+# Searches run from several threads; the first IVF brute force builds the direct map
+_direct_map_lock = threading.Lock()
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+INDEX_PARAMS = {
+    "index_type": "flat",
+    "nlist": None,          # IVF lists; None picks 4 * sqrt(n)
+    "hnsw_m": 32,
+    "ef_construction": 200,
+    "pq_m": 48,             # PQ sub-quantizers; must divide the embedding dimension
+    "pq_nbits": 8,
+    "max_train_points": 100000
+}
+
+SEARCH_PARAMS = {
+    "nprobe": 16,
+    "ef_search": 64
+}
+
+
+def create_index(
+        dim : int,
+        num_vectors : int,
+        index_params : dict = INDEX_PARAMS
+    ):
+    """
+    Create an empty index of the configured type that stores vectors under explicit IDs.
+    """
+    params = dict(INDEX_PARAMS, **index_params)
+    index_type = params["index_type"]
+    assert index_type in INDEX_TYPES, f"index_type must be one of {INDEX_TYPES}"
+    import faiss
+
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, params["hnsw_m"])
+        hnsw.hnsw.efConstruction = params["ef_construction"]
+        return faiss.IndexIDMap2(hnsw)
+
+    # IVF indexes store IDs in their inverted lists and support removal natively
+    nlist = params["nlist"] or max(1, int(4 * np.sqrt(num_vectors)))
+    quantizer = faiss.IndexFlatL2(dim)
+    if index_type == "ivf":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist)
+    return faiss.IndexIVFPQ(quantizer, dim, nlist, params["pq_m"], params["pq_nbits"])
+
+
+def read_index(
+        index_path : str,
+        mmap_index : bool = True
+    ):
+    """
+    Read an index, memory-mapped where FAISS supports it so processes share its pages.
+    """
+    import faiss
+
+    if mmap_index:
+        try:
+            return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # This index type cannot be memory-mapped by FAISS
+            pass
+    return faiss.read_index(index_path)
+
+
+def inner_index(index):
+    """
+    Return the index wrapped by an ID map, or the index itself.
+    """
+    import faiss
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def supports_remove(index):
+    """
+    HNSW graphs cannot remove vectors; they are rebuilt on compaction instead.
+    """
+    import faiss
+    return not isinstance(inner_index(index), faiss.IndexHNSW)
+
+
+def train_index(
+        index,
+        vectors,
+        max_train_points : int = INDEX_PARAMS["max_train_points"],
+        seed : int = 0
+    ):
+    """
+    Train the index on a random sample of the vectors if it needs training.
+    """
+    if index.is_trained:
+        return
+    if len(vectors) > max_train_points:
+        sample = np.random.default_rng(seed).choice(len(vectors), max_train_points, replace=False)
+        vectors = vectors[np.sort(sample)]
+    index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+
+
+def set_search_params(
+        index,
+        nprobe : int = SEARCH_PARAMS["nprobe"],
+        ef_search : int = SEARCH_PARAMS["ef_search"]
+    ):
+    """
+    Apply the search-time parameters that match the index type.
+    """
+    import faiss
+    inner = inner_index(index)
+    if isinstance(inner, faiss.IndexIVF) and nprobe is not None:
+        inner.nprobe = nprobe
+    if isinstance(inner, faiss.IndexHNSW) and ef_search is not None:
+        inner.hnsw.efSearch = ef_search
+
+
+def search_parameters(
+        index,
+        selector=None,
+        nprobe : int = None,
+        ef_search : int = None
+    ):
+    """
+    SearchParameters of the index type carrying an ID selector. nprobe and efSearch default
+    to the index's own, since parameters passed to a search replace them.
+    """
+    import faiss
+
+    inner = inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = nprobe or inner.nprobe
+    elif isinstance(inner, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = ef_search or inner.hnsw.efSearch
+    else:
+        params = faiss.SearchParameters()
+    params.sel = selector
+    return params
+
+
+def reconstruct_ids(index, ids):
+    """
+    Stored vectors of the given IDs. IVF indexes get a hash table from ID to list entry
+    the first time, built once per loaded index.
+    """
+    import faiss
+
+    inner = inner_index(index)
+    if isinstance(inner, faiss.IndexIVF) and inner.direct_map.type == faiss.DirectMap.NoMap:
+        with _direct_map_lock:
+            if inner.direct_map.type == faiss.DirectMap.NoMap:
+                inner.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index.reconstruct_batch(ids)
+
+
+def search_filtered(
+        index,
+        queries,
+        k : int,
+        id_mask,
+        exact_fallback_max : int = 50000,
+        ef_search_factor : int = 4
+    ):
+    """
+    Search only the vectors whose ID is set in id_mask, a boolean array indexed by ID.
+    The mask goes into FAISS as an IDSelectorBitmap, so the search costs about as much
+    as an unfiltered one. Queries that come back with fewer than min(k, selected) hits,
+    because IVF probed too few lists or the filter cut the HNSW graph, are searched
+    again: HNSW retries with ef_search_factor times its efSearch; IVF doubles nprobe
+    while the vectors it scans outnumber the selected ones. Both then fall back to brute
+    force over the selected vectors, fetched with one reconstruct_batch call, when there
+    are at most exact_fallback_max of them.
+    Queries still short after that are logged and counted as filtered_short_results.
+    Returns (distances, ids) like index.search.
+    """
+    import faiss
+
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    # Bit i of byte i // 8, lowest bit first, as IDSelectorBitmap reads it
+    bitmap = np.packbits(id_mask, bitorder='little')
+    selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    distances, ids = index.search(queries, k, params=search_parameters(index, selector))
+
+    num_selected = int(np.count_nonzero(id_mask))
+    expected = min(k, num_selected)
+
+    def short_rows():
+        return np.flatnonzero((ids >= 0).sum(axis=1) < expected)
+
+    short = short_rows()
+    if not len(short):
+        return distances, ids
+
+    inner = inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        # Each probed list holds about ntotal / nlist vectors; once a search would scan
+        # more vectors than are selected, brute force over the selection is cheaper
+        nprobe = inner.nprobe
+        list_size = max(1, inner.ntotal // inner.nlist)
+        while len(short) and nprobe < inner.nlist:
+            nprobe = min(2 * nprobe, inner.nlist)
+            if num_selected <= exact_fallback_max and nprobe * list_size >= num_selected:
+                break
+            params = search_parameters(index, selector, nprobe=nprobe)
+            distances[short], ids[short] = index.search(queries[short], k, params=params)
+            short = short_rows()
+    elif isinstance(inner, faiss.IndexHNSW):
+        ef_search = max(inner.hnsw.efSearch * ef_search_factor, 2 * k)
+        params = search_parameters(index, selector, ef_search=ef_search)
+        distances[short], ids[short] = index.search(queries[short], k, params=params)
+        short = short_rows()
+    if len(short) and num_selected <= exact_fallback_max:
+        selected = np.flatnonzero(id_mask).astype(np.int64)
+        vectors = reconstruct_ids(index, selected)
+        exact_distances, rows = faiss.knn(queries[short], vectors, k)
+        distances[short] = exact_distances
+        ids[short] = np.where(rows >= 0, selected[np.maximum(rows, 0)], -1)
+
+    short = short_rows()
+    if len(short):
+        tracer.count("filtered_short_results", len(short))
+        logger.warning(
+            f"{len(short)} of {len(queries)} filtered queries returned fewer than {expected} hits "
+            f"({num_selected} vectors selected, exact fallback limited to {exact_fallback_max})"
+        )
+    return distances, ids
+
+
+def sample_queries(
+        vectors,
+        num_queries : int = 1000,
+        seed : int = 0
+    ):
+    """
+    Pick indexed vectors to use as recall queries.
+    """
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(vectors), min(num_queries, len(vectors)), replace=False))
+    return np.ascontiguousarray(vectors[rows], dtype=np.float32)
+
+
+def exact_neighbours(vectors, ids, queries, k):
+    """
+    Ground-truth IDs of the k nearest vectors of each query, by brute force.
+    """
+    import faiss
+    exact = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+    exact.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), np.asarray(ids, dtype=np.int64))
+    _, expected = exact.search(queries, k)
+    return expected
+
+
+def recall_at_k(index, queries, expected):
+    """
+    Recall@k of the index against the exact neighbours of the queries.
+    Returns (recall, queries per second of the index).
+    """
+    k = expected.shape[1]
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    elapsed = time.perf_counter() - start
+
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return hits / (len(queries) * k), len(queries) / elapsed
+
+
+def recall_report(
+        index,
+        vectors,
+        ids,
+        k : int = 10
+    ):
+    """
+    Recall@k and throughput across a sweep of the index's search parameter.
+    """
+    import faiss
+    inner = inner_index(index)
+    if isinstance(inner, faiss.IndexIVF):
+        name, values = "nprobe", [v for v in (1, 4, 8, 16, 32, 64, 128) if v <= inner.nlist]
+        apply = lambda v: set_search_params(index, nprobe=v, ef_search=None)
+    elif isinstance(inner, faiss.IndexHNSW):
+        name, values = "efSearch", [16, 32, 64, 128, 256]
+        apply = lambda v: set_search_params(index, nprobe=None, ef_search=v)
+    else:
+        return f"exact index: recall@{k} = 1.000"
+
+    queries = sample_queries(vectors)
+    expected = exact_neighbours(vectors, ids, queries, k)
+
+    lines = []
+    for value in values:
+        apply(value)
+        recall, qps = recall_at_k(index, queries, expected)
+        lines.append(f"{name}={value}: recall@{k} = {recall:.3f}, {qps:.0f} queries/s")
+    return '\n'.join(lines)
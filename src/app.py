@@ -1,22 +1,62 @@
 # src/app.py
 #streamlit run src/app.py
 
+import time
 import streamlit as st
 from rag_system import RAGSystem
+from generator import GENERATION_PROFILES, DEFAULT_PROFILE
+
+# Run a dummy question when the models are first loaded
+WARM_UP = True
+# Stream answers token by token, decoded greedily with the profile's limits, instead of waiting for beam search
+STREAM_ANSWERS = True
+# Seconds after which decoding stops and the best answer so far is shown; None waits
+ANSWER_TIMEOUT_SECONDS = None
+
+
+@st.cache_resource(show_spinner="Loading models and index...")
+def load_rag_system():
+    """
+    Load the RAG system once per server process; every session shares it.
+    Returns the system with its load and warm-up times in seconds.
+    """
+    start = time.perf_counter()
+    rag = RAGSystem()
+    load_time = time.perf_counter() - start
+
+    warm_up_time = rag.warm_up() if WARM_UP else 0.0
+    return rag, load_time, warm_up_time
+
 
 def main():
     st.title("Legal Question Answering System")
     st.write("Ask any legal question, and the system will provide an answer based on relevant legal cases.")
 
+    # Loaded at startup of the first session, then reused
+    rag, load_time, warm_up_time = load_rag_system()
+    st.caption(f"Models and index loaded in {load_time:.1f}s (warm-up {warm_up_time:.1f}s), shared across sessions.")
+
     question = st.text_input("Enter your legal question:")
+    profiles = list(GENERATION_PROFILES)
+    profile = st.sidebar.selectbox("Generation profile", profiles, index=profiles.index(DEFAULT_PROFILE))
 
     if st.button("Get Answer"):
         if question:
-            rag = RAGSystem()
-            with st.spinner('Fetching answer...'):
-                answer = rag.answer_question(question, top_k=5)
             st.success("Answer:")
-            st.write(answer)
+            if STREAM_ANSWERS:
+                # Partial answers are rendered as tokens arrive
+                stream = rag.answer_question_stream(question, top_k=5, timeout=ANSWER_TIMEOUT_SECONDS, profile=profile)
+                st.write_stream(stream)
+                st.caption(f"First token after {stream.time_to_first_token:.2f}s, answered in {stream.total_time:.2f}s")
+            else:
+                with st.spinner('Fetching answer...'):
+                    start = time.perf_counter()
+                    answer = rag.answer_question(question, top_k=5, profile=profile, timeout=ANSWER_TIMEOUT_SECONDS)
+                    answer_time = time.perf_counter() - start
+                st.write(answer)
+                st.caption(f"Answered in {answer_time:.2f}s")
+            st.sidebar.subheader("Cache")
+            st.sidebar.json(rag.cache_stats())
         else:
             st.warning("Please enter a question.")
 
@@ -0,0 +1,168 @@
+# src/benchmark_backends.py
+#python src/benchmark_backends.py --backends torch int8 onnx onnx-int8
+
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmark_batch import SAMPLE_QUESTIONS
+from inference_backend import BACKENDS, MODELS_DIR
+from retriever import Retriever, MODEL_NAME_RETRIEVER
+from generator import MODEL_NAME_GENERATOR
+
+
+def rss_mb():
+    """
+    Resident set size of this process in MB.
+    """
+    with open("/proc/self/statm", 'r') as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def token_f1(answer, reference):
+    """
+    Token overlap F1 between an answer and the fp32 reference answer.
+    """
+    a, b = answer.lower().split(), reference.lower().split()
+    common = sum(min(a.count(t), b.count(t)) for t in set(a))
+    if not a or not b or not common:
+        return float(a == b)
+    precision, recall = common / len(a), common / len(b)
+    return 2 * precision * recall / (precision + recall)
+
+
+def percentile_ms(latencies, q):
+    return 1000 * float(np.percentile(latencies, q))
+
+
+def run_encoder(backend, model_name, models_dir, queries, repeat):
+    """
+    Load the embedding model with one backend and time query encoding. Runs in a fresh process
+    so that memory is measured for this backend alone.
+    """
+    from inference_backend import load_sentence_model
+
+    base = rss_mb()
+    start = time.perf_counter()
+    model = load_sentence_model(model_name, backend, models_dir)
+    load_time = time.perf_counter() - start
+    model.encode(queries[:1])
+
+    latencies = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            model.encode([query], convert_to_numpy=True)
+            latencies.append(time.perf_counter() - start)
+    embeddings = model.encode(queries, convert_to_numpy=True)
+    return {
+        "load_time": load_time,
+        "memory_mb": rss_mb() - base,
+        "peak_mb": peak_rss_mb(),
+        "latencies": latencies,
+        "embeddings": embeddings
+    }
+
+
+def run_generator(backend, model_name, models_dir, questions, contexts, repeat):
+    """
+    Load the generator with one backend and time answer generation in a fresh process.
+    """
+    from generator import Generator
+
+    base = rss_mb()
+    start = time.perf_counter()
+    generator = Generator(model_name, backend=backend, models_dir=models_dir, encoder_cache_params=None)
+    load_time = time.perf_counter() - start
+    generator.generate_answer(questions[0], contexts[0])
+
+    latencies, answers = [], []
+    for _ in range(repeat):
+        answers = []
+        for question, context in zip(questions, contexts):
+            start = time.perf_counter()
+            answers.append(generator.generate_answer(question, context))
+            latencies.append(time.perf_counter() - start)
+    return {
+        "load_time": load_time,
+        "memory_mb": rss_mb() - base,
+        "peak_mb": peak_rss_mb(),
+        "latencies": latencies,
+        "answers": answers
+    }
+
+
+def in_fresh_process(function, *args):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, *args).result()
+
+
+def report(backend, result, agreement):
+    latencies = result["latencies"]
+    print(f"{backend:>10}: load {result['load_time']:.1f}s, "
+          f"+{result['memory_mb']:.0f} MB (peak {result['peak_mb']:.0f} MB), "
+          f"p50 {percentile_ms(latencies, 50):.1f} ms, p95 {percentile_ms(latencies, 95):.1f} ms, "
+          f"{agreement}")
+
+
+def main():
+    """
+    Compare the inference backends of the retriever and generator models against fp32 PyTorch.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark latency, memory and agreement of the inference backends.")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--component", choices=("retriever", "generator", "both"), default="both")
+    parser.add_argument("--models-dir", default=MODELS_DIR, help="Directory for exported models")
+    parser.add_argument("--repeat", type=int, default=3, help="Times each question is timed")
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    # The fp32 baseline always runs first
+    backends = ["torch"] + [backend for backend in args.backends if backend != "torch"]
+    questions = SAMPLE_QUESTIONS
+
+    print("Loading fp32 retriever...")
+    retriever = Retriever()
+    baseline_results = retriever.retrieve_batch(questions, top_k=args.top_k, return_ids=True)
+
+    if args.component in ("retriever", "both"):
+        print(f"\nQuery encoder ({MODEL_NAME_RETRIEVER}), top_k={args.top_k}")
+        baseline = None
+        for backend in backends:
+            result = in_fresh_process(run_encoder, backend, MODEL_NAME_RETRIEVER, args.models_dir, questions, args.repeat)
+            if baseline is None:
+                baseline = result["embeddings"]
+            cosine = np.sum(result["embeddings"] * baseline, axis=1) / (
+                np.linalg.norm(result["embeddings"], axis=1) * np.linalg.norm(baseline, axis=1))
+            found = retriever.retrieve_batch(questions, top_k=args.top_k, query_embeddings=result["embeddings"], return_ids=True)
+            overlap = np.mean([
+                len(set(ids) & set(expected)) / max(len(expected), 1)
+                for (ids, _, _), (expected, _, _) in zip(found, baseline_results)
+            ])
+            report(backend, result, f"cosine {cosine.min():.4f} min, top-{args.top_k} overlap {100 * overlap:.1f}%")
+
+    if args.component in ("generator", "both"):
+        print(f"\nGenerator ({MODEL_NAME_GENERATOR})")
+        contexts = [' '.join(chunks) for _, chunks, _ in baseline_results]
+        baseline = None
+        for backend in backends:
+            result = in_fresh_process(run_generator, backend, MODEL_NAME_GENERATOR, args.models_dir, questions, contexts, args.repeat)
+            if baseline is None:
+                baseline = result["answers"]
+            identical = np.mean([a == b for a, b in zip(result["answers"], baseline)])
+            f1 = np.mean([token_f1(a, b) for a, b in zip(result["answers"], baseline)])
+            report(backend, result, f"{100 * identical:.0f}% identical answers, token F1 {f1:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# src/benchmark_batch.py
+#python src/benchmark_batch.py --repeat 4 --batch-size 8
+
+import argparse
+import time
+
+from rag_system import RAGSystem
+from generator import GENERATOR_BATCH_SIZE
+
+SAMPLE_QUESTIONS = [
+    "What criteria are used to assess apparent bias in judicial decisions?",
+    "Under what circumstances can a court issue cost orders without proceeding to trial?",
+    "When are indemnity costs awarded instead of party and party costs in court proceedings?",
+    "How does intellectual property law protect inventions?",
+    "What is the process for filing a lawsuit in civil court?"
+]
+
+
+def time_call(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """
+    Compare answering questions one at a time with the batched API.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark RAGSystem.answer_questions against answer_question in a loop.")
+    parser.add_argument("--repeat", type=int, default=4, help="Times the sample questions are repeated")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=GENERATOR_BATCH_SIZE)
+    args = parser.parse_args()
+
+    questions = SAMPLE_QUESTIONS * args.repeat
+
+    print("Loading RAG System...")
+    # Without the result cache, so repeated questions are really answered each time
+    rag = RAGSystem(cache_params=None, encoder_cache_params=None)
+    rag.warm_up()
+
+    # Retrieval only
+    _, loop_time = time_call(lambda: [rag.retriever.retrieve(q, top_k=args.top_k) for q in questions])
+    _, batch_time = time_call(rag.retriever.retrieve_batch, questions, top_k=args.top_k)
+    print(f"Retrieval: loop {len(questions) / loop_time:.1f} q/s, "
+          f"batch {len(questions) / batch_time:.1f} q/s ({loop_time / batch_time:.2f}x)")
+
+    # End to end
+    loop_answers, loop_time = time_call(lambda: [rag.answer_question(q, top_k=args.top_k) for q in questions])
+    batch_answers, batch_time = time_call(rag.answer_questions, questions, top_k=args.top_k, batch_size=args.batch_size)
+    agreement = sum(a == b for a, b in zip(loop_answers, batch_answers)) / len(questions)
+    print(f"End to end: loop {len(questions) / loop_time:.2f} q/s, "
+          f"batch {len(questions) / batch_time:.2f} q/s ({loop_time / batch_time:.2f}x), "
+          f"{100 * agreement:.0f}% identical answers")
+
+
+if __name__ == "__main__":
+    main()
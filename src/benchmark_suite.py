@@ -0,0 +1,447 @@
+# src/benchmark_suite.py
+#python src/benchmark_suite.py --output results/base.json
+#python src/benchmark_suite.py --compare results/base.json results/new.json
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from ann_index import INDEX_PARAMS, INDEX_TYPES, create_index, exact_neighbours, recall_at_k, sample_queries, train_index
+from case_store import CaseStore
+from generator import GENERATION_PROFILES, Generator
+from index_store import DocumentStore, write_manifest
+from preprocessing import split_into_chunks
+
+BENCHMARK_PARAMS = {
+    "cases": 300,
+    "queries": 50,
+    "top_k": 5,
+    "chunk_max_length": 128,
+    "profile": "fast",
+    "concurrency": [1, 4, 8],
+    "seed": 0,
+    # Relative change beyond which compare mode reports a regression
+    "threshold": 0.10
+}
+STUB_EMBEDDING_DIM = 384
+
+LEGAL_TERMS = (
+    "appeal applicant respondent tribunal court judgment order costs indemnity party evidence "
+    "hearing bias apprehension discretion jurisdiction statute section act contract breach damages "
+    "liability negligence duty care trial proceeding application affidavit submission counsel "
+    "judge justice principle authority precedent reasoning finding fact law error review decision "
+    "minister visa migration tax commissioner assessment penalty settlement offer claim relief "
+    "injunction declaration estoppel equity trust fiduciary company director shareholder insolvency"
+).split()
+COMPANY_NAMES = ("alpine hardwood", "colgate palmolive", "aust home investment", "cussons", "hardys", "johnson", "spencer")
+OUTCOMES = ("cited", "referred to", "applied", "followed", "considered", "discussed", "distinguished")
+
+
+def synthetic_cases(
+        num_cases : int,
+        seed : int = 0,
+        words_per_case : int = 600
+    ):
+    """
+    Generate a legal-like corpus in the layout of the preprocessed dataframe: titles naming
+    parties, and lowercase text drawn from legal vocabulary with repeated phrases.
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for case_id in range(num_cases):
+        first, second = rng.choice(len(COMPANY_NAMES), 2, replace=False)
+        title = f"{COMPANY_NAMES[first]} pty ltd v {COMPANY_NAMES[second]} [{2000 + case_id % 24}] fca {case_id}"
+        # Zipf-like term frequencies make some terms common and others rare
+        weights = 1.0 / np.arange(1, len(LEGAL_TERMS) + 1)
+        words = rng.choice(LEGAL_TERMS, words_per_case, p=weights / weights.sum())
+        text = ' '.join(words)
+        rows.append({
+            "case_id": case_id,
+            "case_outcome": OUTCOMES[case_id % len(OUTCOMES)],
+            "case_title": title,
+            "case_text": text,
+            "cleaned_title": title,
+            "cleaned_text": f"{title} {text}"
+        })
+    return pd.DataFrame(rows)
+
+
+def synthetic_queries(chunks, num_queries, seed=0, words=12):
+    """
+    Queries made of word windows taken from random chunks, so each has a known source.
+    """
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for row in rng.choice(len(chunks), num_queries, replace=len(chunks) < num_queries):
+        tokens = chunks[row].split()
+        start = int(rng.integers(0, max(1, len(tokens) - words)))
+        queries.append(' '.join(tokens[start:start + words]))
+    return queries
+
+
+class HashingEncoder:
+    def __init__(self, dim : int = STUB_EMBEDDING_DIM):
+        """
+        Offline stand-in for the sentence embedding model: signed feature hashing of the
+        words, L2-normalized. Exposes the SentenceTransformer methods the pipeline uses.
+        """
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, batch_size=64, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in text.lower().split():
+                h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+                embeddings[row, h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+
+def tiny_generator(texts, seed=0):
+    """
+    Offline stand-in for BART: a word-level tokenizer trained on the corpus and a randomly
+    initialized two-layer BART. Decoding runs the real generate() path, so the cost of each
+    stage keeps its shape even though the answers are meaningless.
+    """
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers, trainers
+    from transformers import BartConfig, BartForConditionalGeneration, PreTrainedTokenizerFast
+
+    word_level = Tokenizer(models.WordLevel(unk_token="<unk>"))
+    word_level.pre_tokenizer = pre_tokenizers.Whitespace()
+    word_level.train_from_iterator(texts, trainers.WordLevelTrainer(special_tokens=["<s>", "<pad>", "</s>", "<unk>"]))
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=word_level,
+        bos_token="<s>",
+        pad_token="<pad>",
+        eos_token="</s>",
+        unk_token="<unk>"
+    )
+
+    torch.manual_seed(seed)
+    config = BartConfig(
+        vocab_size=len(tokenizer),
+        d_model=64,
+        encoder_layers=2,
+        decoder_layers=2,
+        encoder_attention_heads=4,
+        decoder_attention_heads=4,
+        encoder_ffn_dim=128,
+        decoder_ffn_dim=128,
+        max_position_embeddings=1024,
+        bos_token_id=0,
+        pad_token_id=1,
+        eos_token_id=2,
+        decoder_start_token_id=2,
+        forced_eos_token_id=2
+    )
+    return BartForConditionalGeneration(config).eval(), tokenizer
+
+
+def build_corpus(
+        work_dir : str,
+        df,
+        encoder,
+        chunk_max_length : int,
+        index_params : dict
+    ):
+    """
+    Write the index, chunk store and case store of a corpus the way build_index.py lays them out.
+    Returns (paths, chunks, embeddings, ids).
+    """
+    chunks, doc_ids = [], []
+    for case_id, text in zip(df['case_id'], df['cleaned_text']):
+        for chunk in split_into_chunks(text, chunk_max_length):
+            chunks.append(chunk)
+            doc_ids.append(case_id)
+    embeddings = encoder.encode(chunks, convert_to_numpy=True).astype(np.float32)
+    ids = np.arange(len(chunks), dtype=np.int64)
+
+    paths = {
+        "index": os.path.join(work_dir, "faiss_index.index"),
+        "docs": os.path.join(work_dir, "documents"),
+        "cases": os.path.join(work_dir, "cases.sqlite")
+    }
+    index = create_index(embeddings.shape[1], len(embeddings), index_params)
+    train_index(index, embeddings, index_params.get("max_train_points", INDEX_PARAMS["max_train_points"]))
+    index.add_with_ids(embeddings, ids)
+    faiss.write_index(index, paths["index"])
+    DocumentStore.write(paths["docs"], ids, chunks, doc_ids)
+    cases = CaseStore(paths["cases"], read_only=False)
+    cases.upsert(df)
+    cases.close()
+    write_manifest(paths["index"], {"generation": 1, "next_id": len(chunks), "index_params": index_params})
+    return paths, chunks, embeddings, ids
+
+
+def summarize(latencies, prefix):
+    """
+    Latency percentiles in milliseconds, keyed '<prefix>.p50_ms' and so on.
+    """
+    latencies = 1000 * np.asarray(latencies)
+    return {
+        f"{prefix}.mean_ms": float(latencies.mean()),
+        f"{prefix}.p50_ms": float(np.percentile(latencies, 50)),
+        f"{prefix}.p90_ms": float(np.percentile(latencies, 90)),
+        f"{prefix}.p99_ms": float(np.percentile(latencies, 99))
+    }
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def measure_stages(rag, queries, top_k, profile):
+    """
+    Time every stage of answer_question separately, query by query.
+    """
+    retriever, generator = rag.retriever, rag.generator
+    stages = {name: [] for name in ("encode", "search", "context", "tokenize", "generate", "end_to_end")}
+    for query in queries:
+        embedding, elapsed = timed(retriever.encode, [query])
+        stages["encode"].append(elapsed)
+
+        (_, ids), elapsed = timed(retriever.index.search, embedding, top_k)
+        stages["search"].append(elapsed)
+
+        def assemble():
+            chunk_ids, chunks, doc_ids = retriever._lookup(retriever.store, ids[0], top_k)
+            return rag.packer.pack(query, chunks, chunk_ids, doc_ids).text
+        context, elapsed = timed(assemble)
+        stages["context"].append(elapsed)
+
+        _, elapsed = timed(generator.tokenizer, generator.build_prompt(query, context))
+        stages["tokenize"].append(elapsed)
+
+        _, elapsed = timed(generator.generate_answer, query, context, profile=profile)
+        stages["generate"].append(elapsed)
+
+        _, elapsed = timed(rag.answer_question, query, top_k=top_k, profile=profile)
+        stages["end_to_end"].append(elapsed)
+
+    metrics = {}
+    for name, latencies in stages.items():
+        metrics.update(summarize(latencies, f"stage.{name}"))
+    return metrics
+
+
+async def _serve_concurrently(rag, queries, top_k, profile, concurrency):
+    from server import RAGServer
+
+    server = RAGServer({"workers": 2}, rag_factory=lambda: rag)
+    server.rag = rag
+    server.retrieval.start()
+    server.generation.start()
+    pending = iter(queries)
+    latencies = []
+
+    async def client():
+        for query in pending:
+            start = time.perf_counter()
+            retrieval = await server.retrieval.submit((query, top_k))
+            await server.generation.submit((query, retrieval, profile, None))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await server.retrieval.stop()
+    await server.generation.stop()
+    server.executor.shutdown()
+    return latencies, elapsed, server.generation.stats()["mean_batch_size"]
+
+
+def measure_throughput(rag, queries, top_k, profile, levels):
+    """
+    Throughput and tail latency with concurrent clients going through the server's micro-batchers.
+    """
+    metrics = {}
+    for concurrency in levels:
+        latencies, elapsed, batch_size = asyncio.run(_serve_concurrently(rag, queries, top_k, profile, concurrency))
+        metrics[f"throughput.c{concurrency}.qps"] = len(latencies) / elapsed
+        metrics[f"throughput.c{concurrency}.p99_ms"] = float(1000 * np.percentile(latencies, 99))
+        metrics[f"throughput.c{concurrency}.mean_batch_size"] = batch_size
+    return metrics
+
+
+def measure_recall(rag, embeddings, ids, queries, top_k):
+    """
+    Recall@k of the index against exact search, for sampled corpus vectors and for the queries.
+    """
+    index = rag.retriever.index
+    sampled = sample_queries(embeddings)
+    recall, _ = recall_at_k(index, sampled, exact_neighbours(embeddings, ids, sampled, top_k))
+    query_embeddings = rag.retriever.encode(queries)
+    query_recall, _ = recall_at_k(index, query_embeddings, exact_neighbours(embeddings, ids, query_embeddings, top_k))
+    return {
+        f"recall.vectors_at_{top_k}": recall,
+        f"recall.queries_at_{top_k}": query_recall
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    from rag_system import RAGSystem
+    from retriever import Retriever
+
+    config = {
+        "cases": args.cases,
+        "queries": args.queries,
+        "top_k": args.top_k,
+        "chunk_max_length": args.chunk_max_length,
+        "profile": args.profile,
+        "concurrency": args.concurrency,
+        "index_type": args.index_type,
+        "models": args.models,
+        "seed": args.seed
+    }
+    metrics = {}
+    df = synthetic_cases(args.cases, args.seed)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.models == "stub":
+            encoder, elapsed = timed(HashingEncoder)
+        else:
+            from inference_backend import load_sentence_model
+            from retriever import MODEL_NAME_RETRIEVER
+            encoder, elapsed = timed(load_sentence_model, MODEL_NAME_RETRIEVER)
+        metrics["cold_start.encoder_ms"] = 1000 * elapsed
+
+        (paths, chunks, embeddings, ids), elapsed = timed(
+            build_corpus, work_dir, df, encoder, args.chunk_max_length, {"index_type": args.index_type}
+        )
+        metrics["build.corpus_ms"] = 1000 * elapsed
+        print(f"Corpus: {len(df)} cases, {len(chunks)} chunks")
+
+        # Cold start: loading the index, chunk store and generator
+        retriever, elapsed = timed(Retriever, paths["index"], paths["docs"], model=encoder)
+        metrics["cold_start.retriever_ms"] = 1000 * elapsed
+
+        def load_generator():
+            if args.models == "stub":
+                model, tokenizer = tiny_generator(chunks, args.seed)
+                return Generator(model=model, tokenizer=tokenizer, encoder_cache_params=None)
+            return Generator(encoder_cache_params=None)
+        generator, elapsed = timed(load_generator)
+        metrics["cold_start.generator_ms"] = 1000 * elapsed
+
+        rag = RAGSystem(paths["index"], paths["docs"], paths["cases"], cache_params=None, retriever=retriever, generator=generator)
+        queries = synthetic_queries(chunks, args.queries, args.seed)
+        _, elapsed = timed(rag.answer_question, queries[0], top_k=args.top_k, profile=args.profile)
+        metrics["cold_start.first_answer_ms"] = 1000 * elapsed
+
+        metrics.update(measure_stages(rag, queries, args.top_k, args.profile))
+        metrics.update(measure_throughput(rag, queries, args.top_k, args.profile, args.concurrency))
+        metrics.update(measure_recall(rag, embeddings, ids, queries, args.top_k))
+        rag.cases.close()
+        retriever.store.close()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "config": config,
+        "metrics": metrics
+    }
+
+
+def higher_is_better(name):
+    return name.endswith(".qps") or name.startswith("recall.")
+
+
+def informational(name):
+    """
+    Metrics reported for context only, never flagged.
+    """
+    return name.endswith(".mean_batch_size") or name.startswith("build.")
+
+
+def compare(base, new, threshold):
+    """
+    Compare the metrics of two runs. Returns the report lines and the names of the
+    metrics that got worse by more than 'threshold' (relative).
+    """
+    lines, regressions = [], []
+    if base["config"] != new["config"]:
+        lines.append("warning: the runs used different configurations")
+    for name in sorted(set(base["metrics"]) & set(new["metrics"])):
+        old, value = base["metrics"][name], new["metrics"][name]
+        change = (value - old) / old if old else 0.0
+        worse = -change if higher_is_better(name) else change
+        flag = ""
+        if informational(name):
+            pass
+        elif worse > threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif worse < -threshold:
+            flag = "improved"
+        lines.append(f"{name:<40} {old:>12.3f} {value:>12.3f} {100 * change:>+8.1f}% {flag}")
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline performance benchmark of the RAG pipeline on a synthetic corpus.")
+    parser.add_argument("--output", default=None, help="JSON file for the results")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Compare two result files instead of running")
+    parser.add_argument("--threshold", type=float, default=BENCHMARK_PARAMS["threshold"], help="Relative change flagged as a regression")
+    parser.add_argument("--models", choices=("stub", "real"), default="stub", help="Offline stand-ins or the configured models")
+    parser.add_argument("--cases", type=int, default=BENCHMARK_PARAMS["cases"])
+    parser.add_argument("--queries", type=int, default=BENCHMARK_PARAMS["queries"])
+    parser.add_argument("--top-k", type=int, default=BENCHMARK_PARAMS["top_k"])
+    parser.add_argument("--chunk-max-length", type=int, default=BENCHMARK_PARAMS["chunk_max_length"])
+    parser.add_argument("--profile", choices=list(GENERATION_PROFILES), default=BENCHMARK_PARAMS["profile"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=BENCHMARK_PARAMS["concurrency"])
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--seed", type=int, default=BENCHMARK_PARAMS["seed"])
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], 'r') as f:
+            base = json.load(f)
+        with open(args.compare[1], 'r') as f:
+            new = json.load(f)
+        lines, regressions = compare(base, new, args.threshold)
+        print(f"{'metric':<40} {'base':>12} {'new':>12} {'change':>9}")
+        print('\n'.join(lines))
+        print(f"{len(regressions)} regressions beyond {100 * args.threshold:.0f}%")
+        sys.exit(1 if regressions else 0)
+
+    results = run_suite(args)
+    for name, value in results["metrics"].items():
+        print(f"{name:<40} {value:>12.3f}")
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+# src/build_index.py
+#python src/build_index.py --csv data/legal_documents/legal_text_classification.csv
+
+import argparse
+import json
+import os
+import pickle
+import shutil
+import time
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from ann_index import (
+    INDEX_PARAMS,
+    INDEX_TYPES,
+    create_index,
+    recall_report,
+    train_index
+)
+from case_store import CaseStore
+from embedding_cache import CachedEmbedder, EMBEDDING_CACHE_DIR
+from inference_backend import BACKENDS
+from index_store import DocumentStore, read_manifest, write_manifest
+from lexical_index import LexicalIndex
+from preprocessing import (
+    CHUNK_MAX_LENGTH,
+    CHUNK_PARAMS,
+    CHUNKING_MODES,
+    ParallelCleaner,
+    TokenChunker,
+    download_nltk_data,
+    prepare_cases,
+    preprocess_texts,
+    split_into_chunks
+)
+from retriever import (
+    DATA_DIR,
+    INDEX_FILE,
+    DOCS_FILE,
+    PREPROCESSED_CSV_FILE,
+    CASES_DB_FILE,
+    LEXICAL_INDEX_DIR,
+    MODEL_NAME_RETRIEVER
+)
+
+RAW_CSV_FILE = os.path.join(DATA_DIR, "legal_text_classification.csv")
+CHECKPOINT_DIR = os.path.join(DATA_DIR, "build_checkpoint")
+STATE_FILE_NAME = "state.json"
+ADD_BATCH_SIZE = 65536
+
+BUILD_PARAMS = {
+    "rows_per_part": 500,
+    "chunking": "tokens",
+    "chunk_max_length": CHUNK_MAX_LENGTH,
+    "chunk_max_tokens": CHUNK_PARAMS["max_tokens"],
+    "chunk_overlap": CHUNK_PARAMS["overlap"],
+    "batch_size": 64,
+    "workers": os.cpu_count()
+}
+
+
+class StageStats:
+    def __init__(self):
+        """
+        Accumulate wall time and item counts for each pipeline stage.
+        """
+        self.stages = {}
+
+    def add(
+            self,
+            stage : str,
+            seconds : float,
+            items : int,
+            unit : str = "items"
+        ):
+        """
+        Record that a stage processed 'items' units in 'seconds'.
+        """
+        total_seconds, total_items, _ = self.stages.get(stage, (0.0, 0, unit))
+        self.stages[stage] = (total_seconds + seconds, total_items + items, unit)
+
+    def report(self):
+        """
+        Return one line per stage with its total time and throughput.
+        """
+        lines = []
+        for stage, (seconds, items, unit) in self.stages.items():
+            rate = items / seconds if seconds > 0 else float('inf')
+            lines.append(f"{stage:>10}: {items} {unit} in {seconds:.1f}s ({rate:.1f} {unit}/s)")
+        return '\n'.join(lines)
+
+
+class IndexBuilder:
+    def __init__(
+            self,
+            csv_path : str = RAW_CSV_FILE,
+            index_path : str = INDEX_FILE,
+            docs_path : str = DOCS_FILE,
+            preprocessed_csv_path : str = PREPROCESSED_CSV_FILE,
+            cases_path : str = CASES_DB_FILE,
+            checkpoint_dir : str = CHECKPOINT_DIR,
+            model_name : str = MODEL_NAME_RETRIEVER,
+            rows_per_part : int = BUILD_PARAMS["rows_per_part"],
+            chunking : str = BUILD_PARAMS["chunking"],
+            chunk_max_length : int = BUILD_PARAMS["chunk_max_length"],
+            chunk_max_tokens : int = BUILD_PARAMS["chunk_max_tokens"],
+            chunk_overlap : int = BUILD_PARAMS["chunk_overlap"],
+            batch_size : int = BUILD_PARAMS["batch_size"],
+            cache_dir : str = EMBEDDING_CACHE_DIR,
+            use_cache : bool = True,
+            backend : str = "torch",
+            bucket_by_length : bool = True,
+            workers : int = BUILD_PARAMS["workers"],
+            index_params : dict = INDEX_PARAMS,
+            report_recall : bool = True,
+            lexical_path : str = LEXICAL_INDEX_DIR
+        ):
+        """
+        Initialize the builder that turns the raw CSV into the artifacts loaded by Retriever.
+        Pass lexical_path=None to skip the BM25 index.
+        chunking 'tokens' cuts chunks of chunk_max_tokens word pieces of the embedding model,
+        overlapping by chunk_overlap; 'words' cuts chunk_max_length-word chunks.
+        """
+        assert isinstance(csv_path, str), "CSV path must be a string"
+        assert os.path.exists(csv_path), f"CSV file not found at {csv_path}"
+        assert isinstance(rows_per_part, int) and rows_per_part > 0, "rows_per_part must be a positive integer"
+        assert chunking in CHUNKING_MODES, f"chunking must be one of {CHUNKING_MODES}"
+        assert isinstance(chunk_max_length, int) and chunk_max_length > 0, "chunk_max_length must be a positive integer"
+        assert isinstance(batch_size, int) and batch_size > 0, "batch_size must be a positive integer"
+
+        self.csv_path = csv_path
+        self.index_path = index_path
+        self.docs_path = docs_path
+        self.preprocessed_csv_path = preprocessed_csv_path
+        self.cases_path = cases_path
+        self.checkpoint_dir = checkpoint_dir
+        self.model_name = model_name
+        self.rows_per_part = rows_per_part
+        self.chunking = chunking
+        self.chunk_max_length = chunk_max_length
+        self.chunk_max_tokens = chunk_max_tokens
+        self.chunk_overlap = chunk_overlap
+        self.chunker = None
+        self.batch_size = batch_size
+
+        self.stats = StageStats()
+        self.backend = backend
+        self.embedder = CachedEmbedder(model_name, cache_dir, batch_size, use_cache, backend, bucket_by_length=bucket_by_length)
+        self.workers = workers
+        self.cleaner = None
+        self.index_params = dict(INDEX_PARAMS, **index_params)
+        self.report_recall = report_recall
+        self.lexical_path = lexical_path
+        self.state = None
+
+    def _config(self):
+        """
+        Settings that must not change between a checkpoint and its resumption.
+        """
+        return {
+            "csv_path": os.path.abspath(self.csv_path),
+            "model_name": self.model_name,
+            "backend": self.backend,
+            "rows_per_part": self.rows_per_part,
+            "chunk_params": self.chunk_params()
+        }
+
+    def chunk_params(self):
+        """
+        How chunks were cut, recorded in the manifest so updates cut new cases the same way.
+        """
+        if self.chunking == "words":
+            return {"chunking": "words", "max_length": self.chunk_max_length}
+        return {"chunking": "tokens", "max_tokens": self.chunk_max_tokens, "overlap": self.chunk_overlap}
+
+    def _state_path(self):
+        return os.path.join(self.checkpoint_dir, STATE_FILE_NAME)
+
+    def _part_path(self, part, suffix):
+        return os.path.join(self.checkpoint_dir, f"part_{part:05d}{suffix}")
+
+    def _load_state(self, restart):
+        """
+        Load the checkpoint state, or start a new one.
+        """
+        if restart and os.path.exists(self.checkpoint_dir):
+            shutil.rmtree(self.checkpoint_dir)
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+        if os.path.exists(self._state_path()):
+            with open(self._state_path(), 'r') as f:
+                state = json.load(f)
+            if state["config"] != self._config():
+                raise ValueError(
+                    f"Checkpoint in {self.checkpoint_dir} was created with different settings "
+                    f"{state['config']}; rerun with --restart to discard it"
+                )
+        else:
+            state = {"config": self._config(), "completed_parts": 0, "num_chunks": 0}
+        self.state = state
+
+    def _save_state(self):
+        tmp_path = self._state_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self._state_path())
+
+    def embed(self, chunks, lengths=None):
+        """
+        Embed the chunks in batches of 'batch_size', skipping chunks found in the embedding cache.
+        """
+        start = time.perf_counter()
+        embeddings = self.embedder.embed(chunks, lengths)
+        self.stats.add("embed", time.perf_counter() - start, len(chunks), "chunks")
+        return embeddings
+
+    def process_part(self, part, df):
+        """
+        Clean, chunk and embed one slice of the CSV, writing its checkpoint files.
+        """
+        # Clean
+        start = time.perf_counter()
+        df = preprocess_texts(prepare_cases(df), self.cleaner)
+        self.stats.add("clean", time.perf_counter() - start, len(df), "cases")
+
+        # Chunk
+        start = time.perf_counter()
+        chunks, doc_ids, lengths = [], [], None
+        if self.chunker is None:
+            for case_id, text in zip(df['case_id'], df['cleaned_text']):
+                case_chunks = split_into_chunks(text, self.chunk_max_length)
+                chunks.extend(case_chunks)
+                doc_ids.extend([int(case_id)] * len(case_chunks))
+        else:
+            # Token counts come with the chunks and let the embedder batch them by length
+            lengths = []
+            case_chunks, case_lengths = self.chunker.split_many(df['cleaned_text'].tolist())
+            for case_id, chunks_of_case, lengths_of_case in zip(df['case_id'], case_chunks, case_lengths):
+                chunks.extend(chunks_of_case)
+                lengths.extend(lengths_of_case)
+                doc_ids.extend([int(case_id)] * len(chunks_of_case))
+        self.stats.add("chunk", time.perf_counter() - start, len(chunks), "chunks")
+
+        # Embed
+        embeddings = self.embed(chunks, lengths)
+
+        # Write the part files before marking the part as done
+        start = time.perf_counter()
+        with open(self._part_path(part, '.npy.tmp'), 'wb') as f:
+            np.save(f, embeddings)
+        with open(self._part_path(part, '.pkl.tmp'), 'wb') as f:
+            pickle.dump({'chunks': chunks, 'doc_ids': doc_ids}, f)
+        df.to_csv(self._part_path(part, '.csv.tmp'), index=False)
+        for suffix in ('.npy', '.pkl', '.csv'):
+            os.replace(self._part_path(part, suffix + '.tmp'), self._part_path(part, suffix))
+        self.stats.add("checkpoint", time.perf_counter() - start, 1, "parts")
+
+        self.state["completed_parts"] = part + 1
+        self.state["num_chunks"] += len(chunks)
+        self._save_state()
+
+    def finalize(self):
+        """
+        Merge the checkpointed parts into the FAISS index, the chunk store and the preprocessed CSV.
+        """
+        num_parts = self.state["completed_parts"]
+        assert self.state["num_chunks"] > 0, "No chunks were produced from the CSV"
+
+        start = time.perf_counter()
+        part_embeddings = []
+        all_chunks, all_doc_ids = [], []
+        csv_tmp_path = self.preprocessed_csv_path + '.tmp'
+        with open(csv_tmp_path, 'w', newline='') as csv_out:
+            for part in range(num_parts):
+                part_embeddings.append(np.load(self._part_path(part, '.npy')))
+
+                with open(self._part_path(part, '.pkl'), 'rb') as f:
+                    data = pickle.load(f)
+                all_chunks.extend(data['chunks'])
+                all_doc_ids.extend(data['doc_ids'])
+
+                # Concatenate the part CSVs, keeping only the first header
+                with open(self._part_path(part, '.csv'), 'r', newline='') as csv_in:
+                    header = csv_in.readline()
+                    if part == 0:
+                        csv_out.write(header)
+                    shutil.copyfileobj(csv_in, csv_out)
+        embeddings = np.concatenate(part_embeddings)
+        ids = np.arange(len(embeddings), dtype=np.int64)
+        self.stats.add("merge", time.perf_counter() - start, len(all_chunks), "chunks")
+
+        # Vectors are keyed by stable chunk IDs so incremental updates can add and remove them
+        start = time.perf_counter()
+        index = create_index(embeddings.shape[1], len(embeddings), self.index_params)
+        train_index(index, embeddings, self.index_params["max_train_points"])
+        for first in range(0, len(embeddings), ADD_BATCH_SIZE):
+            index.add_with_ids(embeddings[first:first + ADD_BATCH_SIZE], ids[first:first + ADD_BATCH_SIZE])
+        self.stats.add("index", time.perf_counter() - start, len(embeddings), "chunks")
+
+        if self.report_recall:
+            start = time.perf_counter()
+            print(recall_report(index, embeddings, ids))
+            self.stats.add("recall", time.perf_counter() - start, 1, "sweeps")
+
+        start = time.perf_counter()
+        index_tmp_path = self.index_path + '.tmp'
+        faiss.write_index(index, index_tmp_path)
+        os.replace(index_tmp_path, self.index_path)
+        DocumentStore.write(self.docs_path, ids, all_chunks, all_doc_ids)
+        if self.lexical_path is not None:
+            num_terms = LexicalIndex.write(self.lexical_path, ids, all_chunks)
+            print(f"Lexical index with {num_terms} terms saved to {self.lexical_path}")
+        os.replace(csv_tmp_path, self.preprocessed_csv_path)
+        CaseStore.build_from_csv(self.preprocessed_csv_path, self.cases_path)
+
+        # A full build starts a new generation so running Retrievers pick it up
+        generation = read_manifest(self.index_path)["generation"] + 1
+        write_manifest(self.index_path, {
+            "generation": generation,
+            "next_id": len(all_chunks),
+            "index_params": self.index_params,
+            "chunk_params": self.chunk_params()
+        })
+        self.stats.add("write", time.perf_counter() - start, len(all_chunks), "chunks")
+
+    def run(
+            self,
+            restart : bool = False,
+            keep_checkpoint : bool = False
+        ):
+        """
+        Run the build, resuming from the last completed part if a checkpoint exists.
+        """
+        self._load_state(restart)
+        download_nltk_data()
+
+        if self.state["completed_parts"]:
+            print(f"Resuming after {self.state['completed_parts']} completed parts "
+                  f"({self.state['num_chunks']} chunks)")
+
+        self.cleaner = ParallelCleaner(workers=self.workers)
+        if self.chunking == "tokens":
+            self.chunker = TokenChunker(self.model_name, self.chunk_max_tokens, self.chunk_overlap)
+        try:
+            reader = pd.read_csv(self.csv_path, chunksize=self.rows_per_part)
+            part = 0
+            while True:
+                start = time.perf_counter()
+                df = next(reader, None)
+                if df is None:
+                    break
+                self.stats.add("read", time.perf_counter() - start, len(df), "rows")
+
+                # Parts finished by a previous run are read but not processed again
+                if part >= self.state["completed_parts"]:
+                    self.process_part(part, df)
+                    print(f"Part {part} done, {self.state['num_chunks']} chunks so far")
+                part += 1
+        finally:
+            self.cleaner.close()
+
+        self.finalize()
+        print(f"FAISS index saved to {self.index_path}")
+        print(f"Documents saved to {self.docs_path}")
+        print(f"Preprocessed data saved to {self.preprocessed_csv_path}")
+        print(f"Case store saved to {self.cases_path}")
+        print(self.stats.report())
+        print(self.embedder.report())
+        if self.embedder.cache is not None:
+            print(self.embedder.cache.report())
+
+        if not keep_checkpoint:
+            shutil.rmtree(self.checkpoint_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the FAISS index and documents.pkl from the raw legal CSV.")
+    parser.add_argument("--csv", default=RAW_CSV_FILE, help="Raw legal_text_classification.csv")
+    parser.add_argument("--index", default=INDEX_FILE, help="Output FAISS index path")
+    parser.add_argument("--docs", default=DOCS_FILE, help="Output chunk store directory")
+    parser.add_argument("--preprocessed-csv", default=PREPROCESSED_CSV_FILE, help="Output preprocessed CSV path")
+    parser.add_argument("--cases", default=CASES_DB_FILE, help="Output case store path")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="Directory for resumable progress")
+    parser.add_argument("--model", default=MODEL_NAME_RETRIEVER, help="Sentence embedding model")
+    parser.add_argument("--rows-per-part", type=int, default=BUILD_PARAMS["rows_per_part"])
+    parser.add_argument("--chunking", choices=CHUNKING_MODES, default=BUILD_PARAMS["chunking"], help="Cut chunks by embedding model tokens or by words")
+    parser.add_argument("--chunk-max-length", type=int, default=BUILD_PARAMS["chunk_max_length"], help="Words per chunk with --chunking words")
+    parser.add_argument("--chunk-max-tokens", type=int, default=BUILD_PARAMS["chunk_max_tokens"], help="Word pieces per chunk, special tokens included")
+    parser.add_argument("--chunk-overlap", type=int, default=BUILD_PARAMS["chunk_overlap"], help="Word pieces shared by consecutive chunks")
+    parser.add_argument("--no-bucketing", action="store_true", help="Embed chunks in input order instead of batching them by length")
+    parser.add_argument("--batch-size", type=int, default=BUILD_PARAMS["batch_size"])
+    parser.add_argument("--workers", type=int, default=BUILD_PARAMS["workers"], help="Processes used for text cleaning")
+    parser.add_argument("--cache-dir", default=EMBEDDING_CACHE_DIR, help="Embedding cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="Embed every chunk without the embedding cache")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="Inference backend of the embedding model")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_PARAMS["index_type"])
+    parser.add_argument("--nlist", type=int, default=INDEX_PARAMS["nlist"], help="IVF lists (default 4 * sqrt(n))")
+    parser.add_argument("--hnsw-m", type=int, default=INDEX_PARAMS["hnsw_m"])
+    parser.add_argument("--ef-construction", type=int, default=INDEX_PARAMS["ef_construction"])
+    parser.add_argument("--pq-m", type=int, default=INDEX_PARAMS["pq_m"])
+    parser.add_argument("--pq-nbits", type=int, default=INDEX_PARAMS["pq_nbits"])
+    parser.add_argument("--no-recall", action="store_true", help="Skip the recall@k report against exact search")
+    parser.add_argument("--lexical", default=LEXICAL_INDEX_DIR, help="Output BM25 index directory")
+    parser.add_argument("--no-lexical", action="store_true", help="Skip the BM25 index")
+    parser.add_argument("--restart", action="store_true", help="Discard any existing checkpoint")
+    parser.add_argument("--keep-checkpoint", action="store_true", help="Keep part files after a successful build")
+    args = parser.parse_args()
+
+    builder = IndexBuilder(
+        csv_path=args.csv,
+        index_path=args.index,
+        docs_path=args.docs,
+        preprocessed_csv_path=args.preprocessed_csv,
+        cases_path=args.cases,
+        checkpoint_dir=args.checkpoint_dir,
+        model_name=args.model,
+        rows_per_part=args.rows_per_part,
+        chunking=args.chunking,
+        chunk_max_length=args.chunk_max_length,
+        chunk_max_tokens=args.chunk_max_tokens,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        cache_dir=args.cache_dir,
+        use_cache=not args.no_cache,
+        backend=args.backend,
+        bucket_by_length=not args.no_bucketing,
+        workers=args.workers,
+        index_params={
+            "index_type": args.index_type,
+            "nlist": args.nlist,
+            "hnsw_m": args.hnsw_m,
+            "ef_construction": args.ef_construction,
+            "pq_m": args.pq_m,
+            "pq_nbits": args.pq_nbits
+        },
+        report_recall=not args.no_recall,
+        lexical_path=None if args.no_lexical else args.lexical
+    )
+    builder.run(restart=args.restart, keep_checkpoint=args.keep_checkpoint)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# src/case_store.py
+#python src/case_store.py --csv data/legal_documents/preprocessed_dataframe.csv
+
+import argparse
+import os
+import sqlite3
+import threading
+
+from retriever import CASES_DB_FILE, PREPROCESSED_CSV_FILE
+
+CASE_COLUMNS = ("case_id", "case_outcome", "case_title", "case_text", "cleaned_title", "cleaned_text")
+CSV_READ_CHUNKSIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    case_id INTEGER PRIMARY KEY,
+    case_outcome TEXT,
+    case_title TEXT,
+    case_text TEXT,
+    cleaned_title TEXT,
+    cleaned_text TEXT
+)
+"""
+
+
+class CaseStore:
+    def __init__(
+            self,
+            db_path : str = CASES_DB_FILE,
+            read_only : bool = True
+        ):
+        """
+        Open the SQLite case store, keyed by case_id.
+        Lookups go through the primary key, so only the requested cases are read from disk.
+        """
+        assert isinstance(db_path, str), "DB path must be a string"
+        if read_only:
+            assert os.path.exists(db_path), f"Case store not found at {db_path}"
+
+        self.db_path = db_path
+        uri = f"file:{os.path.abspath(db_path)}" + ("?mode=ro" if read_only else "")
+        self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.lock = threading.Lock()
+        if not read_only:
+            self.connection.execute(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def get_cases(
+            self,
+            case_ids,
+            columns=("case_title",)
+        ):
+        """
+        Return {case_id: {column: value}} for the cases that exist.
+        """
+        assert all(column in CASE_COLUMNS for column in columns), f"Columns must be among {CASE_COLUMNS}"
+
+        unique_ids = list(dict.fromkeys(int(case_id) for case_id in case_ids))
+        if not unique_ids:
+            return {}
+        placeholders = ','.join('?' * len(unique_ids))
+        query = f"SELECT case_id, {', '.join(columns)} FROM cases WHERE case_id IN ({placeholders})"
+        with self.lock:
+            rows = self.connection.execute(query, unique_ids).fetchall()
+        return {row[0]: dict(zip(columns, row[1:])) for row in rows}
+
+    def get_column(
+            self,
+            case_ids,
+            column : str,
+            default=None
+        ):
+        """
+        Return one value of 'column' per case ID, in the order given.
+        """
+        cases = self.get_cases(case_ids, columns=(column,))
+        return [cases.get(int(case_id), {}).get(column, default) for case_id in case_ids]
+
+    def get_titles(self, case_ids, default="N/A"):
+        return self.get_column(case_ids, "case_title", default)
+
+    def get_outcomes(self, case_ids, default=None):
+        return self.get_column(case_ids, "case_outcome", default)
+
+    def all_outcomes(self):
+        """
+        Return {case_id: case_outcome} for every case.
+        """
+        with self.lock:
+            return dict(self.connection.execute("SELECT case_id, case_outcome FROM cases").fetchall())
+
+    def get_cleaned_texts(self, case_ids, default=""):
+        return self.get_column(case_ids, "cleaned_text", default)
+
+    def iter_column(
+            self,
+            column : str,
+            batch_size : int = CSV_READ_CHUNKSIZE
+        ):
+        """
+        Yield lists of (case_id, value) pairs covering every case, in case_id order,
+        reading batch_size cases at a time.
+        """
+        assert column in CASE_COLUMNS, f"Column must be among {CASE_COLUMNS}"
+        last_id = None
+        while True:
+            with self.lock:
+                if last_id is None:
+                    rows = self.connection.execute(
+                        f"SELECT case_id, {column} FROM cases ORDER BY case_id LIMIT ?", (batch_size,)
+                    ).fetchall()
+                else:
+                    rows = self.connection.execute(
+                        f"SELECT case_id, {column} FROM cases WHERE case_id > ? ORDER BY case_id LIMIT ?", (last_id, batch_size)
+                    ).fetchall()
+            if not rows:
+                return
+            yield rows
+            last_id = rows[-1][0]
+
+    def upsert(self, df):
+        """
+        Insert or replace the cases of a preprocessed dataframe.
+        """
+        df = df.reindex(columns=list(CASE_COLUMNS))
+        df = df.astype(object).where(df.notna(), None)
+        rows = [tuple(row) for row in df.itertuples(index=False, name=None)]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO cases ({', '.join(CASE_COLUMNS)}) VALUES ({','.join('?' * len(CASE_COLUMNS))})",
+                rows
+            )
+        return len(rows)
+
+    def delete(self, case_ids):
+        with self.lock, self.connection:
+            self.connection.executemany("DELETE FROM cases WHERE case_id = ?", [(int(case_id),) for case_id in case_ids])
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM cases").fetchone()[0]
+
+    @staticmethod
+    def build_from_csv(
+            csv_path : str = PREPROCESSED_CSV_FILE,
+            db_path : str = CASES_DB_FILE,
+            chunksize : int = CSV_READ_CHUNKSIZE
+        ):
+        """
+        Stream a preprocessed CSV into a new case store, replacing any existing one atomically.
+        Returns the number of cases written.
+        """
+        import pandas as pd
+
+        tmp_path = db_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        store = CaseStore(tmp_path, read_only=False)
+        count = 0
+        for df in pd.read_csv(csv_path, chunksize=chunksize):
+            count += store.upsert(df)
+        store.close()
+
+        os.replace(tmp_path, db_path)
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the SQLite case store from the preprocessed CSV.")
+    parser.add_argument("--csv", default=PREPROCESSED_CSV_FILE, help="Preprocessed CSV path")
+    parser.add_argument("--db", default=CASES_DB_FILE, help="Output case store path")
+    args = parser.parse_args()
+
+    count = CaseStore.build_from_csv(args.csv, args.db)
+    print(f"{count} cases written to {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# src/context_packer.py
+
+from collections import namedtuple
+
+from generator import Generator, MAX_INPUT_TOKENS
+from instrumentation import tracer
+
+CONTEXT_PARAMS = {
+    # Tokens available to the context; None fills whatever the prompt leaves of MAX_INPUT_TOKENS
+    "max_context_tokens": None,
+    # Word-shingle Jaccard similarity above which a chunk counts as a near-duplicate
+    "near_duplicate_threshold": 0.8,
+    "shingle_size": 5,
+    # A chunk that does not fit is cut to the remaining budget only if at least this many tokens remain
+    "min_partial_tokens": 32
+}
+# Slack for tokens merged or added where chunks are joined
+JOIN_SLACK_TOKENS = 8
+
+PackedContext = namedtuple("PackedContext", ["text", "chunk_ids", "doc_ids", "token_count", "dropped_ids"])
+
+
+def shingles(text, size):
+    words = text.split()
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextPacker:
+    def __init__(
+            self,
+            tokenizer,
+            max_context_tokens : int = CONTEXT_PARAMS["max_context_tokens"],
+            near_duplicate_threshold : float = CONTEXT_PARAMS["near_duplicate_threshold"],
+            shingle_size : int = CONTEXT_PARAMS["shingle_size"],
+            min_partial_tokens : int = CONTEXT_PARAMS["min_partial_tokens"]
+        ):
+        """
+        Assemble the generator context from ranked chunks within a token budget measured
+        with the generator tokenizer, skipping duplicate and near-duplicate chunks.
+        """
+        self.tokenizer = tokenizer
+        self.max_context_tokens = max_context_tokens
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.shingle_size = shingle_size
+        self.min_partial_tokens = min_partial_tokens
+
+    def budget(self, question):
+        """
+        Context tokens left once the prompt around it and the special tokens are counted.
+        """
+        prompt_tokens = len(self.tokenizer(Generator.build_prompt(question, ""))['input_ids'])
+        available = MAX_INPUT_TOKENS - prompt_tokens - JOIN_SLACK_TOKENS
+        if self.max_context_tokens is not None:
+            available = min(available, self.max_context_tokens)
+        return max(available, 0)
+
+    def deduplicate(self, chunks):
+        """
+        Positions of the chunks kept, in rank order: exact and near-duplicates of a
+        higher-ranked chunk are dropped.
+        """
+        kept, kept_shingles, seen = [], [], set()
+        for position, chunk in enumerate(chunks):
+            if chunk in seen:
+                continue
+            chunk_shingles = shingles(chunk, self.shingle_size)
+            if any(jaccard(chunk_shingles, other) >= self.near_duplicate_threshold for other in kept_shingles):
+                continue
+            seen.add(chunk)
+            kept.append(position)
+            kept_shingles.append(chunk_shingles)
+        return kept
+
+    def pack(
+            self,
+            question : str,
+            chunks : list,
+            chunk_ids : list = None,
+            doc_ids : list = None,
+            order_keys : list = None
+        ):
+        """
+        Fill the token budget with chunks in rank order.
+        Returns a PackedContext with the context text, the IDs of the chunks that made it
+        in, its token count and the IDs of the chunks left out.
+        With order_keys, one sortable key per chunk, the chunks that made it in are joined
+        in key order rather than rank order, e.g. sentences in the order of their case.
+        """
+        if chunk_ids is None:
+            chunk_ids = list(range(len(chunks)))
+        if doc_ids is None:
+            doc_ids = [None] * len(chunks)
+
+        remaining = self.budget(question)
+        kept = self.deduplicate(chunks)
+
+        # Measure every candidate in one batched tokenizer call
+        token_ids = self.tokenizer([chunks[p] for p in kept], add_special_tokens=False)['input_ids'] if kept else []
+
+        parts, included, token_count, cut = [], [], 0, 0
+        for position, ids in zip(kept, token_ids):
+            if remaining <= 0:
+                break
+            if len(ids) <= remaining:
+                parts.append(chunks[position])
+                used = len(ids)
+            elif remaining >= self.min_partial_tokens:
+                # The last chunk is cut at the budget instead of being truncated blindly by the generator
+                parts.append(self.tokenizer.decode(ids[:remaining], skip_special_tokens=True))
+                used = remaining
+                cut += 1
+            else:
+                break
+            included.append(position)
+            token_count += used
+            remaining -= used + 1
+
+        if order_keys is not None:
+            ordered = sorted(range(len(included)), key=lambda i: order_keys[included[i]])
+            parts = [parts[i] for i in ordered]
+            included = [included[i] for i in ordered]
+
+        included_ids = [chunk_ids[p] for p in included]
+        included_set = set(included)
+        dropped_ids = [chunk_id for p, chunk_id in enumerate(chunk_ids) if p not in included_set]
+        if tracer.enabled:
+            tracer.count("context_tokens", token_count)
+            tracer.count("context_chunks_dropped", len(dropped_ids))
+            tracer.count("context_chunks_cut", cut)
+        return PackedContext(
+            text=' '.join(parts),
+            chunk_ids=included_ids,
+            doc_ids=[doc_ids[p] for p in included],
+            token_count=token_count,
+            dropped_ids=dropped_ids
+        )
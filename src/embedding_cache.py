@@ -0,0 +1,253 @@
+# src/embedding_cache.py
+
+import hashlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from retriever import DATA_DIR, MODEL_NAME_RETRIEVER
+from inference_backend import MODELS_DIR, load_sentence_model
+
+EMBEDDING_CACHE_DIR = os.path.join(DATA_DIR, "embedding_cache")
+DIGEST_SIZE = 16
+
+
+def chunk_digest(chunk):
+    """
+    Content hash of a chunk, used as its cache key.
+    """
+    return hashlib.blake2b(chunk.encode('utf-8'), digest_size=DIGEST_SIZE).digest()
+
+
+class EmbeddingCache:
+    def __init__(
+            self,
+            cache_dir : str = EMBEDDING_CACHE_DIR,
+            model_name : str = MODEL_NAME_RETRIEVER
+        ):
+        """
+        Open the on-disk embedding cache of one model.
+        Embeddings live in an append-only float32 file read through a memory map; a parallel
+        file holds the chunk digest of every row.
+        """
+        assert isinstance(cache_dir, str), "Cache dir must be a string"
+        assert isinstance(model_name, str), "Model name must be a string"
+
+        self.model_name = model_name
+        self.dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model_name))
+        os.makedirs(self.dir, exist_ok=True)
+
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self.vectors_path = os.path.join(self.dir, "embeddings.f32")
+        self.keys_path = os.path.join(self.dir, "keys.bin")
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            assert meta["model_name"] == model_name, f"Cache in {self.dir} belongs to {meta['model_name']}"
+            self.dim, self.rows = meta["dim"], meta["rows"]
+        else:
+            self.dim, self.rows = None, 0
+
+        # Rows past the committed count come from an interrupted append and are discarded
+        self._truncate_uncommitted()
+        self.row_of = {}
+        if self.rows:
+            with open(self.keys_path, 'rb') as f:
+                keys = f.read()
+            for row in range(self.rows):
+                self.row_of[keys[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE]] = row
+        self._vectors = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def _truncate_uncommitted(self):
+        for path, row_bytes in ((self.keys_path, DIGEST_SIZE), (self.vectors_path, 4 * (self.dim or 0))):
+            if os.path.exists(path) and os.path.getsize(path) > self.rows * row_bytes:
+                with open(path, 'r+b') as f:
+                    f.truncate(self.rows * row_bytes)
+
+    def _write_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({"model_name": self.model_name, "dim": self.dim, "rows": self.rows}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def vectors(self):
+        """
+        Memory-mapped view of every cached embedding.
+        """
+        if self._vectors is None or len(self._vectors) != self.rows:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(self.rows, self.dim))
+        return self._vectors
+
+    def lookup(self, digests):
+        """
+        Return the cache row of each digest, or -1 when it is not cached.
+        """
+        rows = np.array([self.row_of.get(digest, -1) for digest in digests], dtype=np.int64)
+        hits = int((rows >= 0).sum())
+        self.hits += hits
+        self.misses += len(rows) - hits
+        return rows
+
+    def add(self, digests, embeddings):
+        """
+        Append new embeddings. Data is flushed before the row count is committed.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        assert embeddings.shape[1] == self.dim, f"Expected embeddings of dimension {self.dim}"
+
+        with open(self.vectors_path, 'ab') as f:
+            f.write(embeddings.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.keys_path, 'ab') as f:
+            f.write(b''.join(digests))
+            f.flush()
+            os.fsync(f.fileno())
+
+        for digest in digests:
+            self.row_of[digest] = self.rows
+            self.rows += 1
+        self._write_meta()
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self):
+        return f"embedding cache: {self.hits} hits, {self.misses} misses ({100 * self.hit_rate():.1f}% hit rate), {self.rows} cached"
+
+
+class CachedEmbedder:
+    def __init__(
+            self,
+            model_name : str = MODEL_NAME_RETRIEVER,
+            cache_dir : str = EMBEDDING_CACHE_DIR,
+            batch_size : int = 64,
+            use_cache : bool = True,
+            backend : str = "torch",
+            models_dir : str = MODELS_DIR,
+            bucket_by_length : bool = True
+        ):
+        """
+        Embed chunks with the sentence embedding model, reusing cached embeddings of identical chunks.
+        The model is only loaded when a chunk is missing from the cache.
+        Embeddings of other backends differ slightly from fp32, so they are cached separately.
+        With bucket_by_length, chunks are sorted by token count and batched with chunks of
+        similar length, so batches are padded to little more than their longest chunk.
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.backend = backend
+        self.models_dir = models_dir
+        self.bucket_by_length = bucket_by_length
+        cache_key = model_name if backend == "torch" else f"{model_name}@{backend}"
+        self.cache = EmbeddingCache(cache_dir, cache_key) if use_cache else None
+        self.model = None
+
+        # Word pieces fed to the encoder, with and without the padding of their batch
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.encode_seconds = 0.0
+
+    def _load_model(self):
+        if self.model is None:
+            self.model = load_sentence_model(self.model_name, self.backend, self.models_dir)
+        return self.model
+
+    def dimension(self):
+        if self.cache is not None and self.cache.dim is not None:
+            return self.cache.dim
+        return self._load_model().get_sentence_embedding_dimension()
+
+    def token_lengths(self, chunks):
+        """
+        Number of word pieces the encoder sees for each chunk, special tokens included.
+        """
+        model = self._load_model()
+        encoded = model.tokenizer(
+            chunks,
+            truncation=True,
+            max_length=model.max_seq_length,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )
+        return np.array([len(ids) for ids in encoded["input_ids"]], dtype=np.int64)
+
+    def _encode(self, chunks, lengths=None):
+        """
+        Encode the chunks in batches of batch_size, grouped by token count when bucketing.
+        """
+        model = self._load_model()
+        lengths = self.token_lengths(chunks) if lengths is None else np.minimum(lengths, model.max_seq_length)
+        if self.bucket_by_length:
+            order = np.argsort(lengths, kind='stable')
+        else:
+            order = np.arange(len(chunks))
+
+        start = time.perf_counter()
+        embeddings = None
+        for first in range(0, len(order), self.batch_size):
+            batch = order[first:first + self.batch_size]
+            batch_embeddings = model.encode(
+                [chunks[i] for i in batch],
+                batch_size=len(batch),
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
+            if embeddings is None:
+                embeddings = np.empty((len(chunks), batch_embeddings.shape[1]), dtype=np.float32)
+            embeddings[batch] = batch_embeddings
+            # Every chunk of a batch is padded to its longest one
+            self.padded_tokens += int(lengths[batch].max()) * len(batch)
+        self.encode_seconds += time.perf_counter() - start
+        self.tokens += int(lengths.sum())
+        return embeddings
+
+    def padding_ratio(self):
+        """
+        Fraction of the encoded positions that were padding.
+        """
+        return 1.0 - self.tokens / self.padded_tokens if self.padded_tokens else 0.0
+
+    def report(self):
+        rate = self.tokens / self.encode_seconds if self.encode_seconds > 0 else 0.0
+        return (f"encoder: {self.tokens} tokens in {self.encode_seconds:.1f}s ({rate:.0f} tokens/s), "
+                f"{100 * self.padding_ratio():.1f}% padding")
+
+    def embed(self, chunks, lengths=None):
+        """
+        Return a float32 array with one embedding per chunk, encoding only unseen chunks.
+        lengths, the token count of each chunk if the caller knows it, saves tokenizing
+        the chunks again to batch them by length.
+        """
+        if not chunks:
+            return np.zeros((0, self.dimension()), dtype=np.float32)
+        if lengths is not None:
+            lengths = np.asarray(lengths, dtype=np.int64)
+        if self.cache is None:
+            return self._encode(chunks, lengths)
+
+        digests = [chunk_digest(chunk) for chunk in chunks]
+        rows = self.cache.lookup(digests)
+
+        # Encode each distinct missing chunk once
+        missing = {}
+        for position in np.flatnonzero(rows < 0):
+            missing.setdefault(digests[position], int(position))
+        if missing:
+            new_digests = list(missing)
+            positions = [missing[digest] for digest in new_digests]
+            new_lengths = lengths[positions] if lengths is not None else None
+            self.cache.add(new_digests, self._encode([chunks[position] for position in positions], new_lengths))
+            rows = np.array([self.cache.row_of[digest] for digest in digests], dtype=np.int64)
+
+        return np.array(self.cache.vectors()[rows])
@@ -1,6 +1,12 @@
 # src/generator.py
 
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+
+from inference_backend import INFERENCE_BACKENDS, MODELS_DIR, load_seq2seq_model
+from instrumentation import tracer
 
 MODEL_NAME_GENERATOR = "facebook/bart-large-cnn"
 
@@ -10,54 +16,425 @@ GENERATOR_PARAMS = {
     "no_repeat_ngram_size": 3,
     "num_beams": 4
 }
+# Named decoding settings that callers pick per request; 'quality' is GENERATOR_PARAMS
+GENERATION_PROFILES = {
+    "fast": {
+        "max_length": 80,
+        "no_repeat_ngram_size": 3,
+        "num_beams": 1
+    },
+    "balanced": {
+        "max_length": 150,
+        "early_stopping": True,
+        "no_repeat_ngram_size": 3,
+        "num_beams": 2
+    },
+    "quality": GENERATOR_PARAMS
+}
+DEFAULT_PROFILE = "quality"
+# Streamers cannot follow beam search, so streaming decodes a profile greedily without these
+BEAM_ONLY_PARAMS = ("early_stopping", "length_penalty", "num_beam_groups", "diversity_penalty")
+STREAM_TIMEOUT_SECONDS = 120
+GENERATOR_BATCH_SIZE = 8
+MAX_INPUT_TOKENS = 1024
+ENCODER_CACHE_PARAMS = {
+    # A full 1024-token prompt of bart-large-cnn holds 4 MB of fp32 encoder states
+    "max_bytes": 256 * 2**20
+}
+
+
+class AnswerStream:
+    def __init__(self, pieces, start=None):
+        """
+        Iterable over the text pieces of an answer that records time to first token
+        and total latency, measured from 'start' (default: now).
+        """
+        self.pieces = pieces
+        self.start = time.perf_counter() if start is None else start
+        self.time_to_first_token = None
+        self.total_time = None
+        self.text = ""
+
+    def __iter__(self):
+        for piece in self.pieces:
+            if self.time_to_first_token is None and piece:
+                self.time_to_first_token = time.perf_counter() - self.start
+            self.text += piece
+            yield piece
+        self.total_time = time.perf_counter() - self.start
+        if self.time_to_first_token is None:
+            self.time_to_first_token = self.total_time
+
+
+def generation_params(
+        profile : str = DEFAULT_PROFILE,
+        max_length : int = None
+    ):
+    """
+    Decoding settings of a profile, with max_length overriding the profile's when given.
+    """
+    assert profile in GENERATION_PROFILES, f"Profile must be one of {tuple(GENERATION_PROFILES)}"
+    params = dict(GENERATION_PROFILES[profile])
+    if max_length is not None:
+        assert isinstance(max_length, int) and max_length > 0, "max_length must be a positive integer"
+        params["max_length"] = max_length
+    return params
+
+
+def stream_params(
+        profile : str = DEFAULT_PROFILE,
+        max_length : int = None
+    ):
+    """
+    Decoding settings of a profile for streaming: its length and repetition limits, decoded greedily.
+    """
+    params = {name: value for name, value in generation_params(profile, max_length).items() if name not in BEAM_ONLY_PARAMS}
+    params["num_beams"] = 1
+    return params
+
+
+class DeadlineCriteria:
+    def __init__(self, deadline):
+        """
+        Stopping criterion for model.generate: stop decoding once time.perf_counter()
+        passes 'deadline'. Beam search then returns its best hypothesis so far.
+        generate only calls it, so it does not subclass transformers' StoppingCriteria
+        and this module can be imported without loading transformers.
+        """
+        self.deadline = deadline
+        self.timed_out = False
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if time.perf_counter() >= self.deadline:
+            self.timed_out = True
+        # One flag per sequence, on the device of input_ids
+        return input_ids.new_full((input_ids.shape[0],), self.timed_out).bool()
+
+
+class EncoderCache:
+    def __init__(
+            self,
+            max_bytes : int = ENCODER_CACHE_PARAMS["max_bytes"]
+        ):
+        """
+        Thread-safe LRU of encoder hidden states keyed by the prompt's input token IDs,
+        holding at most max_bytes of tensors.
+        """
+        assert isinstance(max_bytes, int) and max_bytes > 0, "max_bytes must be a positive integer"
+
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, input_ids):
+        with self.lock:
+            state = self.entries.get(input_ids)
+            if state is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(input_ids)
+            self.hits += 1
+            return state
+
+    def put(self, input_ids, state):
+        size = state.element_size() * state.nelement()
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(input_ids, None)
+            if previous is not None:
+                self.bytes -= previous.element_size() * previous.nelement()
+            self.entries[input_ids] = state
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.element_size() * evicted.nelement()
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
 
 
 class Generator:
     def __init__(
             self,
-            model_name : str = MODEL_NAME_GENERATOR
+            model_name : str = MODEL_NAME_GENERATOR,
+            backend : str = INFERENCE_BACKENDS["generator"],
+            models_dir : str = MODELS_DIR,
+            encoder_cache_params : dict = ENCODER_CACHE_PARAMS,
+            model=None,
+            tokenizer=None
         ):
         """
         Initialize the Generator by loading the language model and tokenizer.
+        backend selects fp32 PyTorch ('torch'), int8 PyTorch ('int8') or ONNX Runtime
+        ('onnx', 'onnx-int8'); ONNX graphs are exported to models_dir on first use.
+        encoder_cache_params sizes the cache of encoder states reused when the same prompt
+        comes back; pass None to disable it. ONNX models run their encoder inside generate,
+        so they are never cached.
+        A preloaded model and tokenizer replace model_name and backend.
         """
         assert isinstance(model_name, str), "Model name must be a string"
+        assert (model is None) == (tokenizer is None), "Pass both model and tokenizer, or neither"
+        import torch
+        from transformers import AutoTokenizer
 
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+        self.backend = backend
+        self.tokenizer = tokenizer if tokenizer is not None else AutoTokenizer.from_pretrained(model_name)
+        self.model = model if model is not None else load_seq2seq_model(model_name, backend, models_dir)
+        if encoder_cache_params is not None and isinstance(self.model, torch.nn.Module):
+            self.encoder_cache = EncoderCache(**dict(ENCODER_CACHE_PARAMS, **encoder_cache_params))
+        else:
+            self.encoder_cache = None
     
+    @staticmethod
+    def build_prompt(question, context):
+        return f"Question: {question}\nContext: {context}\nAnswer:"
+
+    def _generate(self, inputs, params, deadline=None, **kwargs):
+        """
+        Run model.generate, stopping at the deadline if one is given.
+        Returns (outputs, timed_out).
+        """
+        from transformers import StoppingCriteriaList
+
+        criteria = DeadlineCriteria(deadline) if deadline is not None else None
+        with tracer.span("generate"):
+            outputs = self.model.generate(
+                **inputs,
+                stopping_criteria=StoppingCriteriaList([criteria]) if criteria is not None else None,
+                **params,
+                **kwargs
+            )
+        timed_out = criteria is not None and criteria.timed_out
+        if timed_out:
+            tracer.count("deadline_timeouts")
+        return outputs, timed_out
+
+    def _encoder_state(self, input_ids):
+        """
+        Encoder hidden states of one prompt, a list of token IDs, from the cache or computed
+        alone and unpadded, as generate computes them for a single prompt.
+        """
+        key = tuple(input_ids)
+        state = self.encoder_cache.get(key)
+        if state is not None:
+            tracer.count("encoder_cache_hits")
+            return state
+
+        import torch
+        ids = torch.tensor([input_ids])
+        with tracer.span("encode_prompt"), torch.no_grad():
+            state = self.model.get_encoder()(
+                input_ids=ids,
+                attention_mask=torch.ones_like(ids),
+                return_dict=True
+            ).last_hidden_state
+        self.encoder_cache.put(key, state)
+        return state
+
+    def _encoded_inputs(self, input_ids):
+        """
+        generate() inputs for one prompt given as a token ID list, carrying its encoder
+        states so generate runs the decoder only.
+        """
+        import torch
+        from transformers.modeling_outputs import BaseModelOutput
+
+        hidden = self._encoder_state(input_ids)
+        return {
+            'input_ids': torch.tensor([input_ids]),
+            'attention_mask': torch.ones((1, len(input_ids)), dtype=torch.long),
+            'encoder_outputs': BaseModelOutput(last_hidden_state=hidden)
+        }
+
+    def _count_tokens(self, input_lengths, outputs=None):
+        """
+        Report prompt and answer token counts to the tracer. Prompts that reached
+        MAX_INPUT_TOKENS count as truncated; the decoder start token is not counted.
+        """
+        tracer.count("input_tokens", sum(input_lengths))
+        tracer.count("input_truncations", sum(length >= MAX_INPUT_TOKENS for length in input_lengths))
+        if outputs is not None:
+            tracer.count("output_tokens", int((outputs != self.tokenizer.pad_token_id).sum()) - outputs.shape[0])
+
     def generate_answer(
             self,
             question : str,
             context : str,
-            max_length : int = GENERATOR_PARAMS["max_length"]
+            max_length : int = None,
+            profile : str = DEFAULT_PROFILE,
+            deadline : float = None,
+            return_timed_out : bool = False
         ):
         """
         Generate an answer based on the question and context.
+        profile names the decoding settings in GENERATION_PROFILES; max_length overrides its length.
+        deadline is a time.perf_counter() timestamp after which decoding stops and the best
+        hypothesis so far is returned. With return_timed_out, returns (answer, timed_out).
         """
         assert isinstance(question, str), "Question must be a string"
         assert isinstance(context, str), "Context must be a string"
-        assert isinstance(max_length, int), "max_length must be an integer"
+        params = generation_params(profile, max_length)
 
         # Prepare the input text
-        input_text = f"Question: {question}\nContext: {context}\nAnswer:"
+        input_text = self.build_prompt(question, context)
         
         # Tokenize and encode the input text
-        inputs = self.tokenizer.encode(
-            input_text,
-            return_tensors='pt',
-            truncation=True,
-            max_length=1024
-        )
+        with tracer.span("tokenize"):
+            inputs = self.tokenizer.encode(
+                input_text,
+                return_tensors='pt',
+                truncation=True,
+                max_length=MAX_INPUT_TOKENS
+            )
         
-        # Generate the output
-        outputs = self.model.generate(
-            inputs, 
-            max_length=GENERATOR_PARAMS["max_length"],
-            early_stopping=GENERATOR_PARAMS["early_stopping"],
-            no_repeat_ngram_size=GENERATOR_PARAMS["no_repeat_ngram_size"],
-            num_beams=GENERATOR_PARAMS["num_beams"]
-        )
+        # Generate the output, reusing the encoder states of a prompt seen before
+        if self.encoder_cache is not None:
+            model_inputs = self._encoded_inputs(inputs[0].tolist())
+        else:
+            model_inputs = {'input_ids': inputs}
+        outputs, timed_out = self._generate(model_inputs, params, deadline)
+        if tracer.enabled:
+            self._count_tokens([inputs.shape[1]], outputs)
         
         # Decode the generated answer
-        answer = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        return answer.strip()
+        with tracer.span("decode"):
+            answer = self.tokenizer.decode(outputs[0], skip_special_tokens=True).strip()
+        if return_timed_out:
+            return answer, timed_out
+        return answer
+
+    def generate_answers(
+            self,
+            questions : list,
+            contexts : list,
+            batch_size : int = GENERATOR_BATCH_SIZE,
+            max_length : int = None,
+            profile : str = DEFAULT_PROFILE,
+            deadline : float = None,
+            return_timed_out : bool = False
+        ):
+        """
+        Generate answers for several question/context pairs in padded mini-batches.
+        Prompts of similar length are batched together to limit padding; answers are
+        returned in input order. Mini-batches still running at the deadline return their
+        best hypotheses so far. With return_timed_out, returns (answers, timed_out flags).
+        Mini-batches of one prompt reuse the encoder cache. Larger ones always encode the
+        padded mini-batch: states of prompts encoded alone differ from those in floating-point
+        rounding, and answers must not depend on the cache.
+        """
+        assert isinstance(questions, list), "Questions must be a list"
+        assert isinstance(contexts, list), "Contexts must be a list"
+        assert len(questions) == len(contexts), "Need one context per question"
+        assert isinstance(batch_size, int) and batch_size > 0, "batch_size must be a positive integer"
+        params = generation_params(profile, max_length)
+
+        # Tokenize every prompt once, without padding
+        prompts = [self.build_prompt(question, context) for question, context in zip(questions, contexts)]
+        with tracer.span("tokenize"):
+            encoded = self.tokenizer(prompts, truncation=True, max_length=MAX_INPUT_TOKENS)['input_ids']
+
+        # Sort by length so each mini-batch pads to a similar size
+        order = sorted(range(len(prompts)), key=lambda i: len(encoded[i]))
+        answers = [None] * len(prompts)
+        timed_out = [False] * len(prompts)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            if self.encoder_cache is not None and len(batch) == 1:
+                inputs = self._encoded_inputs(encoded[batch[0]])
+            else:
+                inputs = self.tokenizer.pad(
+                    {'input_ids': [encoded[i] for i in batch]},
+                    return_tensors='pt'
+                )
+            outputs, batch_timed_out = self._generate(inputs, params, deadline)
+            if tracer.enabled:
+                self._count_tokens([len(encoded[i]) for i in batch], outputs)
+            with tracer.span("decode"):
+                decoded = self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
+            for i, answer in zip(batch, decoded):
+                answers[i] = answer.strip()
+                timed_out[i] = batch_timed_out
+        if return_timed_out:
+            return answers, timed_out
+        return answers
+
+    def generate_answer_stream(
+            self,
+            question : str,
+            context : str,
+            max_length : int = None,
+            deadline : float = None,
+            profile : str = DEFAULT_PROFILE
+        ):
+        """
+        Generate an answer greedily, yielding decoded text as tokens are produced.
+        profile sets the length and repetition limits; its beam search, if any, is not used.
+        The stream ends early once time.perf_counter() passes the deadline.
+        """
+        assert isinstance(question, str), "Question must be a string"
+        assert isinstance(context, str), "Context must be a string"
+        from transformers import TextIteratorStreamer
+
+        with tracer.span("tokenize"):
+            inputs = self.tokenizer.encode(
+                self.build_prompt(question, context),
+                return_tensors='pt',
+                truncation=True,
+                max_length=MAX_INPUT_TOKENS
+            )
+        if tracer.enabled:
+            self._count_tokens([inputs.shape[1]])
+        streamer = TextIteratorStreamer(
+            self.tokenizer,
+            skip_special_tokens=True,
+            timeout=STREAM_TIMEOUT_SECONDS
+        )
+
+        params = stream_params(profile, max_length)
+        if self.encoder_cache is not None:
+            model_inputs = self._encoded_inputs(inputs[0].tolist())
+        else:
+            model_inputs = {'input_ids': inputs}
+
+        # model.generate runs in a worker thread and pushes text into the streamer;
+        # it runs in a copy of this context so its spans join the current trace
+        errors = []
+        def run():
+            try:
+                self._generate(model_inputs, params, deadline, streamer=streamer)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+        thread.start()
+        first = True
+        for piece in streamer:
+            # The answer is stripped like generate_answer's output
+            if first:
+                piece = piece.lstrip()
+                first = not piece
+            yield piece
+        thread.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,358 @@
+# src/index_store.py
+#python src/index_store.py --convert data/legal_documents/documents.pkl data/legal_documents/documents
+
+import argparse
+import json
+import mmap
+import os
+import pickle
+import shutil
+import uuid
+
+import numpy as np
+
+CURRENT_FILE_NAME = "CURRENT"
+ADD_CASE, DELETE_CASE = 1, -1
+
+
+def manifest_path_for(index_path):
+    """
+    Path of the manifest that records the generation of an index.
+    """
+    return os.path.splitext(index_path)[0] + ".manifest.json"
+
+
+def read_manifest(index_path):
+    """
+    Read the manifest of an index, or a generation 0 manifest if none was written.
+    """
+    path = manifest_path_for(index_path)
+    if not os.path.exists(path):
+        return {"generation": 0, "next_id": None}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(index_path, manifest):
+    """
+    Atomically replace the manifest of an index.
+    """
+    path = manifest_path_for(index_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _append(path, data):
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _truncate(path, size):
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+
+def current_base_dir(root):
+    """
+    Path of the base directory that an on-disk index or store currently points at.
+    """
+    with open(os.path.join(root, CURRENT_FILE_NAME), 'r') as f:
+        return os.path.join(root, f.read().strip())
+
+
+def new_base_dir(root):
+    """
+    Create an empty base directory under root. Returns (name, path).
+    """
+    os.makedirs(root, exist_ok=True)
+    name = f"base-{uuid.uuid4().hex}"
+    base_dir = os.path.join(root, name)
+    os.makedirs(base_dir)
+    return name, base_dir
+
+
+def switch_current(root, name):
+    """
+    Atomically point root at a base, then remove the others; processes that still map
+    them keep reading the unlinked files.
+    """
+    current_path = os.path.join(root, CURRENT_FILE_NAME)
+    with open(current_path + '.tmp', 'w') as f:
+        f.write(name)
+    os.replace(current_path + '.tmp', current_path)
+
+    for old in os.listdir(root):
+        if old.startswith("base-") and old != name:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+
+def _map_array(path, count, dtype=np.int64):
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+class DocumentStore:
+    def __init__(
+            self,
+            docs_path : str
+        ):
+        """
+        Open the chunk store: a directory holding one text blob with an offsets array,
+        and packed arrays of chunk IDs and case IDs, all memory-mapped.
+        Chunk IDs are appended in increasing order, so a chunk is found by binary search
+        and only the chunks asked for are decoded.
+        Adds and deletes append to the files in place and take effect when commit() writes
+        the new row counts; readers map only the committed rows.
+        """
+        assert isinstance(docs_path, str), "Docs path must be a string"
+        assert os.path.isdir(docs_path), f"Docs store not found at {docs_path}"
+
+        self.docs_path = docs_path
+
+        # A concurrent compaction may remove the base between reading CURRENT and opening it
+        for attempt in range(3):
+            try:
+                self._open()
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+
+    def _path(self, name):
+        return os.path.join(self.base_dir, name)
+
+    def _open(self):
+        self.base_dir = current_base_dir(self.docs_path)
+        with open(self._path("meta.json"), 'r') as f:
+            meta = json.load(f)
+        self.rows, self.num_deleted, self.num_case_events = meta["rows"], meta["deleted"], meta["case_events"]
+        self.deleted = set(np.fromfile(self._path("deleted.i64"), dtype=np.int64, count=self.num_deleted).tolist())
+        self._map()
+
+    def _map(self):
+        self.offsets = _map_array(self._path("offsets.i64"), self.rows + 1)
+        self.ids = _map_array(self._path("ids.i64"), self.rows)
+        self.doc_ids = _map_array(self._path("doc_ids.i64"), self.rows)
+
+        with open(self._path("chunks.bin"), 'rb') as f:
+            blob_size = int(self.offsets[-1])
+            self.blob = mmap.mmap(f.fileno(), blob_size, access=mmap.ACCESS_READ) if blob_size else b''
+
+    def close(self):
+        if isinstance(self.blob, mmap.mmap):
+            self.blob.close()
+
+    def commit(self):
+        """
+        Atomically record the row counts of every add and delete so far, making them visible
+        to stores opened from now on.
+        """
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump({"rows": self.rows, "deleted": self.num_deleted, "case_events": self.num_case_events}, f)
+        os.replace(tmp_path, self._path("meta.json"))
+
+    def __len__(self):
+        return self.rows
+
+    def row_of(self, chunk_id):
+        """
+        Row of a chunk ID, found by binary search over the sorted ID array, or None.
+        """
+        row = int(np.searchsorted(self.ids, chunk_id))
+        if row < self.rows and self.ids[row] == chunk_id:
+            return row
+        return None
+
+    def chunk(self, row):
+        """
+        Decode the text of one chunk from the blob.
+        """
+        return self.blob[int(self.offsets[row]):int(self.offsets[row + 1])].decode('utf-8')
+
+    def get(self, chunk_id):
+        """
+        Return the (chunk, case ID) pair for a live chunk ID, or None.
+        """
+        if chunk_id in self.deleted:
+            return None
+        row = self.row_of(chunk_id)
+        if row is None:
+            return None
+        return self.chunk(row), int(self.doc_ids[row])
+
+    def position_in_case(self, chunk_id):
+        """
+        Relative position of a live chunk among the live chunks of its case, from 0 for
+        the first to 1 for the last, or None. The chunks of a case are one run of rows,
+        so only that run is read.
+        """
+        row = self.row_of(chunk_id)
+        if row is None or chunk_id in self.deleted:
+            return None
+        case_id = self.doc_ids[row]
+        start, end = row, row + 1
+        while start > 0 and self.doc_ids[start - 1] == case_id:
+            start -= 1
+        while end < self.rows and self.doc_ids[end] == case_id:
+            end += 1
+        run = [i for i in self.ids[start:end].tolist() if i not in self.deleted]
+        return run.index(chunk_id) / max(1, len(run) - 1)
+
+    def ids_for_cases(self, case_ids):
+        """
+        Return the live chunk IDs belonging to the given cases.
+        """
+        rows = np.flatnonzero(np.isin(self.doc_ids, np.asarray(list(case_ids), dtype=np.int64)))
+        return [chunk_id for chunk_id in self.ids[rows].tolist() if chunk_id not in self.deleted]
+
+    def live_ids(self):
+        """
+        Sorted IDs of every chunk that is not deleted.
+        """
+        return np.array([chunk_id for chunk_id in self.ids.tolist() if chunk_id not in self.deleted], dtype=np.int64)
+
+    def max_id(self):
+        return int(self.ids[-1]) if self.rows else -1
+
+    @property
+    def deleted_case_ids(self):
+        """
+        Cases deleted and not added back since the last compaction.
+        """
+        events = np.fromfile(self._path("case_events.i64"), dtype=np.int64, count=2 * self.num_case_events)
+        deleted = set()
+        for case_id, event in events.reshape(-1, 2).tolist():
+            if event == DELETE_CASE:
+                deleted.add(case_id)
+            else:
+                deleted.discard(case_id)
+        return deleted
+
+    def _truncate_uncommitted(self):
+        """
+        Drop bytes left by an append that never committed; staged appends of this store are kept.
+        """
+        _truncate(self._path("chunks.bin"), int(self.offsets[-1]))
+        _truncate(self._path("offsets.i64"), 8 * (self.rows + 1))
+        _truncate(self._path("ids.i64"), 8 * self.rows)
+        _truncate(self._path("doc_ids.i64"), 8 * self.rows)
+        _truncate(self._path("deleted.i64"), 8 * self.num_deleted)
+        _truncate(self._path("case_events.i64"), 16 * self.num_case_events)
+
+    def add(self, ids, chunks, doc_ids, case_ids, commit : bool = True):
+        """
+        Append chunks to the files of the current base. Only the appended bytes are written,
+        and they stay invisible to readers until the row count is committed, so an
+        interrupted append leaves the store unchanged. With commit=False the add is staged:
+        this store sees it at once, and a later commit() publishes it.
+        """
+        assert not len(ids) or ids[0] > self.max_id(), "Chunk IDs must be appended in increasing order"
+
+        encoded = [chunk.encode('utf-8') for chunk in chunks]
+        offsets = int(self.offsets[-1]) + np.cumsum([len(data) for data in encoded], dtype=np.int64)
+        events = np.array([(case_id, ADD_CASE) for case_id in case_ids], dtype=np.int64)
+
+        self._truncate_uncommitted()
+        _append(self._path("chunks.bin"), b''.join(encoded))
+        _append(self._path("offsets.i64"), offsets.tobytes())
+        _append(self._path("ids.i64"), np.asarray(ids, dtype=np.int64).tobytes())
+        _append(self._path("doc_ids.i64"), np.asarray(doc_ids, dtype=np.int64).tobytes())
+        _append(self._path("case_events.i64"), events.tobytes())
+
+        self.rows += len(ids)
+        self.num_case_events += len(case_ids)
+        if commit:
+            self.commit()
+
+        # The arrays grew, so map them again
+        self.close()
+        self._map()
+
+    def delete(self, ids, case_ids, commit : bool = True):
+        """
+        Record chunk IDs as deleted; they stay in the files until compact() runs.
+        With commit=False the delete is staged like an add.
+        """
+        events = np.array([(case_id, DELETE_CASE) for case_id in case_ids], dtype=np.int64)
+
+        self._truncate_uncommitted()
+        _append(self._path("deleted.i64"), np.asarray(ids, dtype=np.int64).tobytes())
+        _append(self._path("case_events.i64"), events.tobytes())
+
+        self.num_deleted += len(ids)
+        self.num_case_events += len(case_ids)
+        if commit:
+            self.commit()
+        self.deleted.update(ids)
+
+    def compact(self):
+        """
+        Write a new base without deleted chunks and switch the store to it; staged adds
+        and deletes are committed with it.
+        """
+        rows = np.array([row for row, chunk_id in enumerate(self.ids.tolist()) if chunk_id not in self.deleted], dtype=np.int64)
+        ids = np.array(self.ids[rows])
+        doc_ids = np.array(self.doc_ids[rows])
+        DocumentStore.write(self.docs_path, ids, (self.chunk(row) for row in rows.tolist()), doc_ids)
+
+        self.close()
+        self._open()
+
+    @staticmethod
+    def write(docs_path, ids, chunks, doc_ids):
+        """
+        Write a new base directory and atomically point the store at it.
+        Bases that are no longer current are removed; processes that still map them keep
+        reading the unlinked files.
+        """
+        name, base_dir = new_base_dir(docs_path)
+
+        offsets = [0]
+        with open(os.path.join(base_dir, "chunks.bin"), 'wb') as f:
+            for chunk in chunks:
+                data = chunk.encode('utf-8')
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+
+        ids = np.asarray(ids, dtype=np.int64)
+        assert len(ids) == len(offsets) - 1, "Need one ID per chunk"
+        assert np.all(np.diff(ids) > 0), "Chunk IDs must be increasing"
+
+        np.asarray(offsets, dtype=np.int64).tofile(os.path.join(base_dir, "offsets.i64"))
+        ids.tofile(os.path.join(base_dir, "ids.i64"))
+        np.asarray(doc_ids, dtype=np.int64).tofile(os.path.join(base_dir, "doc_ids.i64"))
+        for empty in ("deleted.i64", "case_events.i64"):
+            open(os.path.join(base_dir, empty), 'wb').close()
+        with open(os.path.join(base_dir, "meta.json"), 'w') as f:
+            json.dump({"rows": len(ids), "deleted": 0, "case_events": 0}, f)
+        switch_current(docs_path, name)
+
+
+def convert_pickle(pkl_path, docs_path):
+    """
+    Convert a documents.pkl written by testing.py into a chunk store.
+    """
+    with open(pkl_path, 'rb') as f:
+        data = pickle.load(f)
+    ids = data.get('ids', range(len(data['chunks'])))
+    DocumentStore.write(docs_path, ids, data['chunks'], data['doc_ids'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert documents.pkl into the memory-mapped chunk store.")
+    parser.add_argument("--convert", nargs=2, metavar=("PKL", "STORE_DIR"), required=True)
+    args = parser.parse_args()
+
+    convert_pickle(*args.convert)
+    print(f"Chunk store written to {args.convert[1]}")
+
+
+if __name__ == "__main__":
+    main()
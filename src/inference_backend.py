@@ -0,0 +1,187 @@
+# src/inference_backend.py
+#python src/inference_backend.py --export generator --backend onnx-int8
+
+import argparse
+import glob
+import os
+import re
+
+# torch, transformers and sentence_transformers are imported by the functions that need
+# them, so importing this module (and the modules built on it) stays cheap
+
+# torch: stock fp32 PyTorch
+# int8: PyTorch with nn.Linear layers dynamically quantized to int8 at load time
+# onnx: graphs exported to ONNX Runtime
+# onnx-int8: ONNX graphs with dynamically quantized int8 weights
+BACKENDS = ("torch", "int8", "onnx", "onnx-int8")
+INFERENCE_BACKENDS = {
+    "generator": "torch",
+    "retriever": "torch"
+}
+MODELS_DIR = os.path.join("data", "models")
+# Instruction set targeted by ONNX int8 kernels; 'avx512_vnni' is faster where the CPU supports it
+ONNX_QUANTIZATION_TARGET = "avx2"
+
+
+def export_path(
+        model_name : str,
+        backend : str,
+        models_dir : str = MODELS_DIR
+    ):
+    """
+    Directory holding the exported graphs of a model for one backend.
+    """
+    return os.path.join(models_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model_name), backend)
+
+
+def quantize_dynamic(model):
+    """
+    Replace the nn.Linear layers of a model with dynamically quantized int8 layers.
+    """
+    import torch
+
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _optimum():
+    try:
+        from optimum import onnxruntime
+    except ImportError as e:
+        raise ImportError("The onnx backends need optimum[onnxruntime]: pip install 'optimum[onnxruntime]'") from e
+    return onnxruntime
+
+
+def export_seq2seq(
+        model_name : str,
+        backend : str,
+        models_dir : str = MODELS_DIR
+    ):
+    """
+    Export a seq2seq model to ONNX, quantizing every graph for onnx-int8.
+    Returns the export directory; an existing export is reused.
+    """
+    assert backend in ("onnx", "onnx-int8"), "Only the onnx backends are exported"
+    path = export_path(model_name, backend, models_dir)
+    if glob.glob(os.path.join(path, "*.onnx")):
+        return path
+
+    from transformers import AutoTokenizer
+
+    ort = _optimum()
+    onnx_path = export_path(model_name, "onnx", models_dir)
+    if not glob.glob(os.path.join(onnx_path, "*.onnx")):
+        model = ort.ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+        model.save_pretrained(onnx_path)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(onnx_path)
+    if backend == "onnx":
+        return onnx_path
+
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    config = getattr(AutoQuantizationConfig, ONNX_QUANTIZATION_TARGET)(is_static=False, per_channel=False)
+    # Encoder and decoder graphs are quantized separately
+    for file_path in sorted(glob.glob(os.path.join(onnx_path, "*.onnx"))):
+        quantizer = ort.ORTQuantizer.from_pretrained(onnx_path, file_name=os.path.basename(file_path))
+        quantizer.quantize(save_dir=path, quantization_config=config)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(path)
+    return path
+
+
+def export_sentence_model(
+        model_name : str,
+        backend : str,
+        models_dir : str = MODELS_DIR
+    ):
+    """
+    Export a sentence embedding model to ONNX, with a quantized graph for onnx-int8.
+    Returns the export directory; an existing export is reused.
+    """
+    assert backend in ("onnx", "onnx-int8"), "Only the onnx backends are exported"
+    from sentence_transformers import SentenceTransformer
+
+    path = export_path(model_name, "onnx", models_dir)
+    if not os.path.exists(os.path.join(path, "onnx", "model.onnx")):
+        SentenceTransformer(model_name, backend="onnx").save(path)
+
+    quantized = os.path.join(path, "onnx", f"model_qint8_{ONNX_QUANTIZATION_TARGET}.onnx")
+    if backend == "onnx-int8" and not os.path.exists(quantized):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        export_dynamic_quantized_onnx_model(SentenceTransformer(path, backend="onnx"), ONNX_QUANTIZATION_TARGET, path)
+    return path
+
+
+def load_seq2seq_model(
+        model_name : str,
+        backend : str = INFERENCE_BACKENDS["generator"],
+        models_dir : str = MODELS_DIR
+    ):
+    """
+    Load a seq2seq model for the backend; every backend supports model.generate.
+    """
+    assert backend in BACKENDS, f"Backend must be one of {BACKENDS}"
+
+    if backend in ("torch", "int8"):
+        from transformers import AutoModelForSeq2SeqLM
+        model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+        return quantize_dynamic(model) if backend == "int8" else model.eval()
+
+    path = export_seq2seq(model_name, backend, models_dir)
+    if backend == "onnx":
+        return _optimum().ORTModelForSeq2SeqLM.from_pretrained(path)
+
+    # Quantized graphs are saved with a '_quantized' suffix
+    files = {os.path.basename(f).replace("_quantized.onnx", ""): os.path.basename(f) for f in glob.glob(os.path.join(path, "*_quantized.onnx"))}
+    kwargs = {"encoder_file_name": files["encoder_model"], "decoder_file_name": files["decoder_model"]}
+    if "decoder_with_past_model" in files:
+        kwargs["decoder_with_past_file_name"] = files["decoder_with_past_model"]
+    else:
+        kwargs["use_cache"] = False
+    return _optimum().ORTModelForSeq2SeqLM.from_pretrained(path, **kwargs)
+
+
+def load_sentence_model(
+        model_name : str,
+        backend : str = INFERENCE_BACKENDS["retriever"],
+        models_dir : str = MODELS_DIR
+    ):
+    """
+    Load a SentenceTransformer for the backend; every backend supports model.encode.
+    """
+    assert backend in BACKENDS, f"Backend must be one of {BACKENDS}"
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "int8":
+        return quantize_dynamic(SentenceTransformer(model_name))
+
+    path = export_sentence_model(model_name, backend, models_dir)
+    if backend == "onnx":
+        return SentenceTransformer(path, backend="onnx")
+    return SentenceTransformer(
+        path,
+        backend="onnx",
+        model_kwargs={"file_name": f"onnx/model_qint8_{ONNX_QUANTIZATION_TARGET}.onnx"}
+    )
+
+
+def main():
+    from generator import MODEL_NAME_GENERATOR
+    from retriever import MODEL_NAME_RETRIEVER
+
+    parser = argparse.ArgumentParser(description="Export and cache the ONNX graphs of the generator or retriever model.")
+    parser.add_argument("--export", choices=("generator", "retriever"), required=True)
+    parser.add_argument("--backend", choices=("onnx", "onnx-int8"), default="onnx")
+    parser.add_argument("--model", default=None, help="Model name (default: the one used by the component)")
+    parser.add_argument("--models-dir", default=MODELS_DIR, help="Directory for exported models")
+    args = parser.parse_args()
+
+    if args.export == "generator":
+        path = export_seq2seq(args.model or MODEL_NAME_GENERATOR, args.backend, args.models_dir)
+    else:
+        path = export_sentence_model(args.model or MODEL_NAME_RETRIEVER, args.backend, args.models_dir)
+    print(f"{args.backend} {args.export} model exported to {path}")
+
+
+if __name__ == "__main__":
+    main()
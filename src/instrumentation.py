@@ -0,0 +1,363 @@
+# src/instrumentation.py
+
+import bisect
+import contextvars
+import cProfile
+import logging
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histogram buckets of stage and request durations, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_PORT = 9100
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class _NullSpan:
+    """
+    Shared no-op context manager returned while instrumentation is disabled.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "start")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer._end_span(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Trace:
+    def __init__(self, name, attributes):
+        """
+        One request: its spans as (name, start offset, seconds), its counters and attributes.
+        thread_id is the native ID that py-spy and top show, to match samples to requests.
+        """
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.thread_id = threading.get_native_id()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.counters = {}
+
+    def stage_times(self):
+        """
+        Total seconds per span name.
+        """
+        totals = {}
+        for name, _, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def summary(self):
+        stages = ' '.join(f"{name}={1000 * seconds:.1f}ms" for name, seconds in self.stage_times().items())
+        counters = ' '.join(f"{name}={value}" for name, value in self.counters.items())
+        attributes = ' '.join(f"{name}={value}" for name, value in self.attributes.items())
+        return (f"{self.name} {1000 * self.duration:.1f}ms trace={self.trace_id} tid={self.thread_id} "
+                f"{attributes} | {stages} | {counters}").strip()
+
+
+class _TraceScope:
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.trace = Trace(name, attributes)
+        self.token = None
+
+    def __enter__(self):
+        # A trace nested in another one only adds its spans to the outer trace
+        if _current_trace.get() is not None:
+            return self
+        self.token = _current_trace.set(self.trace)
+        for sink in self.tracer.sinks:
+            sink.on_trace_start(self.trace)
+        return self
+
+    def __exit__(self, *exc):
+        if self.token is None:
+            return False
+        self.trace.duration = time.perf_counter() - self.trace.start
+        _current_trace.reset(self.token)
+        for sink in self.tracer.sinks:
+            sink.on_trace(self.trace)
+        return False
+
+
+class Tracer:
+    def __init__(self):
+        """
+        Records timing spans and counters and hands them to sinks.
+        While disabled, span() and trace() return a shared no-op object and count()
+        returns at once, so instrumented code pays one attribute check per call.
+        """
+        self.enabled = False
+        self.sinks = []
+
+    def configure(self, enabled : bool = True, sinks : list = None):
+        self.sinks = list(sinks or [])
+        self.enabled = enabled and bool(self.sinks)
+
+    def span(self, name):
+        """
+        Time a stage: 'with tracer.span("encode"): ...'.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def trace(self, name, **attributes):
+        """
+        Group the spans and counters of one request; sinks receive the finished Trace.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return _TraceScope(self, name, attributes)
+
+    def trace_iter(self, name, iterator, **attributes):
+        """
+        Trace a lazily consumed iterator, e.g. a streamed answer: every step runs in a
+        context of its own that holds the trace, so its spans attach to the trace although
+        the caller resumes the iterator between steps. Threads the steps start should run
+        in contextvars.copy_context() to attach theirs too.
+        """
+        if not self.enabled:
+            return iterator
+        return _traced(iterator, _TraceScope(self, name, attributes))
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.counters[name] = trace.counters.get(name, 0) + value
+        for sink in self.sinks:
+            sink.on_count(name, value)
+
+    def _end_span(self, name, start, end):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.spans.append((name, start - trace.start, end - start))
+        for sink in self.sinks:
+            sink.on_span(name, end - start)
+
+
+def _traced(iterator, scope):
+    context = contextvars.copy_context()
+    context.run(scope.__enter__)
+    try:
+        while True:
+            try:
+                item = context.run(next, iterator)
+            except StopIteration:
+                return
+            yield item
+    finally:
+        context.run(scope.__exit__, None, None, None)
+
+
+# Process-wide tracer used by RAGSystem, Retriever, Generator and ContextPacker
+tracer = Tracer()
+
+
+class Sink:
+    """
+    Base class of sinks; every callback is optional.
+    """
+    def on_trace_start(self, trace):
+        pass
+
+    def on_span(self, name, seconds):
+        pass
+
+    def on_count(self, name, value):
+        pass
+
+    def on_trace(self, trace):
+        pass
+
+
+class LogSink(Sink):
+    def __init__(
+            self,
+            logger : logging.Logger = None,
+            level : int = logging.INFO,
+            slow_ms : float = None
+        ):
+        """
+        Log one line per finished request with its stage times and counters.
+        With slow_ms, only requests slower than that are logged, at WARNING level.
+        """
+        self.logger = logger or logging.getLogger("rag.trace")
+        self.level = level
+        self.slow_ms = slow_ms
+
+    def on_trace(self, trace):
+        if self.slow_ms is None:
+            self.logger.log(self.level, trace.summary())
+        elif 1000 * trace.duration >= self.slow_ms:
+            self.logger.warning("slow request: %s", trace.summary())
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        # Counts are per bucket here and made cumulative when rendered
+        position = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        if position < len(self.buckets):
+            self.buckets[position] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+class PrometheusSink(Sink):
+    def __init__(self, prefix : str = "rag"):
+        """
+        Aggregate stage and request durations into histograms and counters, rendered in the
+        Prometheus text format by render() or served over HTTP by serve().
+        """
+        self.prefix = prefix
+        self.stages = {}
+        self.requests = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.http_server = None
+
+    def on_span(self, name, seconds):
+        with self.lock:
+            self.stages.setdefault(name, _Histogram()).observe(seconds)
+
+    def on_count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def on_trace(self, trace):
+        with self.lock:
+            self.requests.setdefault(trace.name, _Histogram()).observe(trace.duration)
+
+    def _render_histogram(self, lines, metric, label, histograms):
+        for key, histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{label}="{key}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{metric}_sum{{{label}="{key}"}} {histogram.sum}')
+            lines.append(f'{metric}_count{{{label}="{key}"}} {histogram.count}')
+
+    def render(self):
+        with self.lock:
+            lines = [
+                f"# HELP {self.prefix}_stage_seconds Time spent in each pipeline stage",
+                f"# TYPE {self.prefix}_stage_seconds histogram"
+            ]
+            self._render_histogram(lines, f"{self.prefix}_stage_seconds", "stage", self.stages)
+            lines += [
+                f"# HELP {self.prefix}_request_seconds End-to-end time of traced requests",
+                f"# TYPE {self.prefix}_request_seconds histogram"
+            ]
+            self._render_histogram(lines, f"{self.prefix}_request_seconds", "request", self.requests)
+            lines += [
+                f"# HELP {self.prefix}_events_total Token counts, truncations, cache hits and other events",
+                f"# TYPE {self.prefix}_events_total counter"
+            ]
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{self.prefix}_events_total{{event="{name}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port : int = METRICS_PORT, host : str = "0.0.0.0"):
+        """
+        Serve /metrics from a daemon thread, for processes without an HTTP server of their own.
+        """
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        return self.http_server
+
+
+class ProfileSink(Sink):
+    def __init__(
+            self,
+            output_dir : str,
+            slow_ms : float = 1000.0,
+            sample_every : int = 1
+        ):
+        """
+        Run cProfile on one request out of every sample_every and keep the profile
+        (as <output_dir>/<name>-<trace id>.prof) only if the request took at least slow_ms.
+        cProfile sees the thread the request ran on; for native frames and other threads,
+        attach py-spy to the process and match the thread ID logged with the trace.
+        """
+        assert isinstance(sample_every, int) and sample_every > 0, "sample_every must be a positive integer"
+
+        self.output_dir = output_dir
+        self.slow_ms = slow_ms
+        self.sample_every = sample_every
+        self.seen = 0
+        self.saved = 0
+        self.lock = threading.Lock()
+        self.profiles = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    def on_trace_start(self, trace):
+        with self.lock:
+            self.seen += 1
+            if (self.seen - 1) % self.sample_every:
+                return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return
+        self.profiles[trace.trace_id] = profile
+
+    def on_trace(self, trace):
+        profile = self.profiles.pop(trace.trace_id, None)
+        if profile is None:
+            return
+        profile.disable()
+        if 1000 * trace.duration >= self.slow_ms:
+            profile.dump_stats(os.path.join(self.output_dir, f"{trace.name}-{trace.trace_id}.prof"))
+            with self.lock:
+                self.saved += 1
@@ -0,0 +1,246 @@
+# src/lexical_index.py
+#python src/lexical_index.py --build
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from index_store import DocumentStore, current_base_dir, new_base_dir, switch_current
+from preprocessing import clean_text
+
+BM25_PARAMS = {
+    "k1": 1.2,
+    "b": 0.75
+}
+
+
+def varint_encode(values):
+    """
+    LEB128-encode non-negative integers: 7 bits per byte, high bit set on all but the last byte.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in (7, 14, 21, 28, 35):
+        num_bytes += values >= (1 << shift)
+    starts = np.cumsum(num_bytes) - num_bytes
+
+    out = np.zeros(int(num_bytes.sum()), dtype=np.uint8)
+    for j in range(int(num_bytes.max()) if len(values) else 0):
+        mask = num_bytes > j
+        byte = (values[mask] >> np.uint64(7 * j)) & np.uint64(0x7f)
+        more = (num_bytes[mask] - 1 > j).astype(np.uint64) << np.uint64(7)
+        out[starts[mask] + j] = (byte | more).astype(np.uint8)
+    return out, num_bytes
+
+
+def varint_decode(data):
+    """
+    Decode a LEB128 byte array into int64 values.
+    """
+    data = np.asarray(data, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.int64)
+    last = data < 0x80
+    # Index of the value each byte belongs to, and its position within that value
+    value_of = np.concatenate(([0], np.cumsum(last[:-1])))
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    position = np.arange(len(data)) - starts[value_of]
+    parts = (data & 0x7f).astype(np.int64) << (7 * position)
+    return np.bincount(value_of, weights=parts).astype(np.int64)
+
+
+def tokenize_query(query):
+    """
+    Clean a query with the pipeline applied to the chunks, so terms match.
+    """
+    return clean_text(query).split()
+
+
+class LexicalIndex:
+    def __init__(
+            self,
+            index_dir : str
+        ):
+        """
+        Open a BM25 inverted index. Posting lists are stored as varint-encoded
+        (row delta, term frequency) pairs in one byte array, and every array is
+        memory-mapped, so only the lists of the query terms are read and decoded.
+        """
+        assert isinstance(index_dir, str), "Index dir must be a string"
+        assert os.path.isdir(index_dir), f"Lexical index not found at {index_dir}"
+
+        self.base_dir = current_base_dir(index_dir)
+        with open(self._path("meta.json"), 'r') as f:
+            meta = json.load(f)
+        self.rows, self.num_terms, self.avgdl = meta["rows"], meta["terms"], meta["avgdl"]
+        self.k1, self.b = meta["k1"], meta["b"]
+
+        with open(self._path("terms.txt"), 'r', encoding='utf-8') as f:
+            self.term_ids = {term: i for i, term in enumerate(f.read().split('\n')) if term}
+        self.term_offsets = self._map("term_offsets.i64", np.int64, self.num_terms + 1)
+        self.doc_freqs = self._map("doc_freqs.i32", np.int32, self.num_terms)
+        self.ids = self._map("ids.i64", np.int64, self.rows)
+        self.doc_lens = self._map("doc_lens.i32", np.int32, self.rows)
+        self.postings = self._map("postings.u8", np.uint8, int(self.term_offsets[-1]) if self.num_terms else 0)
+
+    def _path(self, name):
+        return os.path.join(self.base_dir, name)
+
+    def _map(self, name, dtype, count):
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._path(name), dtype=dtype, mode='r', shape=(count,))
+
+    def __len__(self):
+        return self.rows
+
+    def postings_of(self, term_id):
+        """
+        Decode the posting list of a term into (rows, term frequencies).
+        """
+        start, end = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+        values = varint_decode(self.postings[start:end])
+        return np.cumsum(values[0::2]), values[1::2]
+
+    def search_terms(
+            self,
+            terms : list,
+            top_k : int = 5,
+            id_mask=None
+        ):
+        """
+        Score the rows containing any of the terms with BM25.
+        Returns (chunk IDs, scores) of the top_k rows, best first.
+        id_mask is a boolean array indexed by chunk ID; rows whose chunk is not set are skipped.
+        """
+        rows, contributions = [], []
+        for term in set(terms):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            term_rows, tfs = self.postings_of(term_id)
+            df = int(self.doc_freqs[term_id])
+            idf = np.log(1 + (self.rows - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lens[term_rows] / self.avgdl)
+            rows.append(term_rows)
+            contributions.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+        if not rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        # Sum the contributions of every term per row
+        candidates, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions))
+        if id_mask is not None:
+            candidate_ids = np.asarray(self.ids[candidates])
+            allowed = candidate_ids < len(id_mask)
+            allowed[allowed] = id_mask[candidate_ids[allowed]]
+            candidates, scores = candidates[allowed], scores[allowed]
+        if len(scores) > top_k:
+            best = np.argpartition(-scores, top_k)[:top_k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return np.asarray(self.ids[candidates[best]]), scores[best].astype(np.float32)
+
+    def search(
+            self,
+            query : str,
+            top_k : int = 5,
+            id_mask=None
+        ):
+        return self.search_terms(tokenize_query(query), top_k, id_mask)
+
+    @staticmethod
+    def write(
+            index_dir,
+            ids,
+            chunks,
+            k1 : float = BM25_PARAMS["k1"],
+            b : float = BM25_PARAMS["b"]
+        ):
+        """
+        Build the index of cleaned chunks, write it to a new base directory and atomically
+        point index_dir at it. Returns the number of distinct terms.
+        """
+        vocabulary = {}
+        term_parts, tf_parts, doc_lens = [], [], []
+        for chunk in chunks:
+            tokens = chunk.split()
+            doc_lens.append(len(tokens))
+            term_ids = np.fromiter((vocabulary.setdefault(token, len(vocabulary)) for token in tokens), dtype=np.int64, count=len(tokens))
+            unique, counts = np.unique(term_ids, return_counts=True)
+            term_parts.append(unique)
+            tf_parts.append(counts)
+        ids = np.asarray(ids, dtype=np.int64)
+        assert len(ids) == len(doc_lens), "Need one ID per chunk"
+
+        # Terms are stored in sorted order
+        terms = sorted(vocabulary)
+        remap = np.empty(len(vocabulary), dtype=np.int64)
+        remap[[vocabulary[term] for term in terms]] = np.arange(len(terms))
+
+        term_ids = remap[np.concatenate(term_parts)] if term_parts else np.zeros(0, dtype=np.int64)
+        tfs = np.concatenate(tf_parts) if tf_parts else np.zeros(0, dtype=np.int64)
+        rows = np.repeat(np.arange(len(doc_lens), dtype=np.int64), [len(part) for part in term_parts])
+
+        # Group the postings by term; rows stay increasing within a term
+        order = np.argsort(term_ids, kind='stable')
+        term_ids, rows, tfs = term_ids[order], rows[order], tfs[order]
+        first = np.concatenate(([True], term_ids[1:] != term_ids[:-1])) if len(term_ids) else np.zeros(0, dtype=bool)
+        deltas = np.where(first, rows, np.diff(rows, prepend=0))
+
+        pairs = np.empty(2 * len(rows), dtype=np.int64)
+        pairs[0::2], pairs[1::2] = deltas, tfs
+        postings, num_bytes = varint_encode(pairs)
+        bytes_per_term = np.bincount(term_ids, weights=num_bytes[0::2] + num_bytes[1::2], minlength=len(terms))
+        term_offsets = np.concatenate(([0], np.cumsum(bytes_per_term))).astype(np.int64)
+        doc_freqs = np.bincount(term_ids, minlength=len(terms)).astype(np.int32)
+
+        name, base_dir = new_base_dir(index_dir)
+        with open(os.path.join(base_dir, "terms.txt"), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(terms))
+        term_offsets.tofile(os.path.join(base_dir, "term_offsets.i64"))
+        doc_freqs.tofile(os.path.join(base_dir, "doc_freqs.i32"))
+        postings.tofile(os.path.join(base_dir, "postings.u8"))
+        ids.tofile(os.path.join(base_dir, "ids.i64"))
+        np.asarray(doc_lens, dtype=np.int32).tofile(os.path.join(base_dir, "doc_lens.i32"))
+        with open(os.path.join(base_dir, "meta.json"), 'w') as f:
+            json.dump({
+                "rows": len(ids),
+                "terms": len(terms),
+                "avgdl": float(np.mean(doc_lens)) if doc_lens else 0.0,
+                "k1": k1,
+                "b": b
+            }, f)
+
+        switch_current(index_dir, name)
+        return len(terms)
+
+    @staticmethod
+    def write_from_store(index_dir, store):
+        """
+        Rebuild the index from the live chunks of a DocumentStore.
+        """
+        ids = store.live_ids()
+        return LexicalIndex.write(index_dir, ids, (store.get(int(chunk_id))[0] for chunk_id in ids))
+
+
+def main():
+    from retriever import DOCS_FILE, LEXICAL_INDEX_DIR
+
+    parser = argparse.ArgumentParser(description="Build the BM25 index from the chunk store.")
+    parser.add_argument("--build", action="store_true", required=True)
+    parser.add_argument("--docs", default=DOCS_FILE, help="Chunk store directory")
+    parser.add_argument("--output", default=LEXICAL_INDEX_DIR, help="Lexical index directory")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    num_terms = LexicalIndex.write_from_store(args.output, DocumentStore(args.docs))
+    print(f"Lexical index with {num_terms} terms written to {args.output} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# src/load_test.py
+#python src/load_test.py --url http://localhost:8000 --concurrency 1 4 16 --requests 64
+
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+import numpy as np
+
+from benchmark_batch import SAMPLE_QUESTIONS
+from generator import DEFAULT_PROFILE, GENERATION_PROFILES
+
+
+async def wait_until_ready(session, url, timeout):
+    """
+    Poll /ready until the server can answer questions.
+    """
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        try:
+            async with session.get(f"{url}/ready") as response:
+                if response.status == 200:
+                    return
+                if response.status == 500:
+                    raise RuntimeError(f"Server failed to load: {await response.text()}")
+        except aiohttp.ClientConnectionError:
+            pass
+        await asyncio.sleep(1)
+    raise TimeoutError(f"Server at {url} not ready after {timeout}s")
+
+
+async def run_level(session, url, endpoint, payloads, concurrency, num_requests):
+    """
+    Send num_requests requests with 'concurrency' clients in flight.
+    Returns (latencies in seconds, error count, elapsed seconds).
+    """
+    requests = iter(itertools.islice(itertools.cycle(payloads), num_requests))
+    latencies, errors = [], 0
+
+    async def client():
+        nonlocal errors
+        for payload in requests:
+            start = time.perf_counter()
+            try:
+                async with session.post(f"{url}/{endpoint}", json=payload) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+async def run(args):
+    payloads = [{"question": question, "top_k": args.top_k} for question in SAMPLE_QUESTIONS]
+    if args.endpoint == "answer":
+        for payload in payloads:
+            payload["profile"] = args.profile
+            if args.timeout is not None:
+                payload["timeout"] = args.timeout
+
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        await wait_until_ready(session, args.url, args.ready_timeout)
+        print(f"POST /{args.endpoint}, {args.requests} requests per level")
+        for concurrency in args.concurrency:
+            latencies, errors, elapsed = await run_level(session, args.url, args.endpoint, payloads, concurrency, args.requests)
+            if latencies:
+                p50, p95, p99 = (1000 * np.percentile(latencies, q) for q in (50, 95, 99))
+                print(f"concurrency {concurrency:>3}: {len(latencies) / elapsed:.2f} req/s, "
+                      f"p50 {p50:.0f} ms, p95 {p95:.0f} ms, p99 {p99:.0f} ms, {errors} errors")
+            else:
+                print(f"concurrency {concurrency:>3}: every request failed ({errors} errors)")
+
+        async with session.get(f"{args.url}/health") as response:
+            batchers = (await response.json())["batchers"]
+        for name, stats in batchers.items():
+            print(f"{name} batcher: {stats['batches']} batches, mean size {stats['mean_batch_size']:.1f}")
+
+
+def main():
+    """
+    Drive the HTTP service with concurrent clients and report throughput and latency percentiles.
+    """
+    parser = argparse.ArgumentParser(description="Load generator for src/server.py.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", choices=("answer", "retrieve"), default="answer")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="Concurrent clients, one run per value")
+    parser.add_argument("--requests", type=int, default=64, help="Requests sent per concurrency level")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--profile", choices=list(GENERATION_PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--timeout", type=float, default=None, help="Per-request decoding deadline in seconds")
+    parser.add_argument("--ready-timeout", type=float, default=600, help="Seconds to wait for /ready")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
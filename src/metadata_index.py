@@ -0,0 +1,83 @@
+# src/metadata_index.py
+
+import numpy as np
+
+# Filter keys accepted by Retriever.retrieve; values within a key are ORed, keys are ANDed
+FILTER_FIELDS = ("case_outcome", "case_ids")
+
+
+class MetadataIndex:
+    def __init__(
+            self,
+            store,
+            outcomes : dict
+        ):
+        """
+        Per-attribute index over the chunks of one DocumentStore generation, built once so that
+        a filter resolves to a boolean mask indexed by chunk ID without scanning the chunks:
+        one precomputed mask per case_outcome value, and the chunk IDs grouped by case for
+        case-ID sets. Deleted chunks are never selected.
+        outcomes maps case_id to case_outcome, as returned by CaseStore.all_outcomes().
+        """
+        self.size = store.max_id() + 1
+        ids = np.asarray(store.ids)
+        doc_ids = np.asarray(store.doc_ids)
+
+        self.live = np.zeros(self.size, dtype=bool)
+        self.live[ids] = True
+        if store.deleted:
+            self.live[np.fromiter(store.deleted, dtype=np.int64)] = False
+
+        # case_outcome -> mask of the live chunks of the cases with that outcome
+        cases, case_of_chunk = np.unique(doc_ids, return_inverse=True)
+        case_outcomes = np.array([outcomes.get(int(case_id)) for case_id in cases], dtype=object)
+        self.outcome_masks = {}
+        for value in set(case_outcomes.tolist()) - {None}:
+            mask = np.zeros(self.size, dtype=bool)
+            mask[ids[(case_outcomes == value)[case_of_chunk]]] = True
+            self.outcome_masks[value] = mask & self.live
+
+        # Chunk IDs ordered by case, so the chunks of a case are one searchsorted slice
+        order = np.argsort(doc_ids, kind='stable')
+        self.ids_by_case = ids[order]
+        self.sorted_cases = doc_ids[order]
+
+    def outcome_values(self):
+        return sorted(self.outcome_masks)
+
+    def case_mask(self, case_ids):
+        """
+        Mask of the live chunks of the given cases.
+        """
+        case_ids = np.asarray(list(case_ids), dtype=np.int64)
+        starts = np.searchsorted(self.sorted_cases, case_ids, side='left')
+        ends = np.searchsorted(self.sorted_cases, case_ids, side='right')
+        mask = np.zeros(self.size, dtype=bool)
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            mask[self.ids_by_case[start:end]] = True
+        return mask & self.live
+
+    def resolve(self, filters : dict):
+        """
+        Resolve filters such as {"case_outcome": ["cited", "followed"], "case_ids": {12, 40}}
+        to a boolean mask indexed by chunk ID. A single value may be given instead of a list.
+        """
+        assert isinstance(filters, dict), "Filters must be a dict"
+        assert all(field in FILTER_FIELDS for field in filters), f"Filter fields must be among {FILTER_FIELDS}"
+
+        mask = self.live.copy()
+        if "case_outcome" in filters:
+            values = filters["case_outcome"]
+            if isinstance(values, str):
+                values = [values]
+            selected = np.zeros(self.size, dtype=bool)
+            for value in values:
+                if value in self.outcome_masks:
+                    selected |= self.outcome_masks[value]
+            mask &= selected
+        if "case_ids" in filters:
+            case_ids = filters["case_ids"]
+            if isinstance(case_ids, (int, np.integer)):
+                case_ids = [case_ids]
+            mask &= self.case_mask(case_ids)
+        return mask
@@ -0,0 +1,261 @@
+# src/prefork.py
+#python src/prefork.py --workers 4 --port 8000
+
+import argparse
+import gc
+import os
+import select
+import signal
+import socket
+import time
+import traceback
+
+from aiohttp import web
+
+from case_store import CaseStore
+from inference_backend import INFERENCE_BACKENDS
+from rag_system import RAGSystem
+from server import RAGServer, SERVER_PARAMS
+
+PREFORK_PARAMS = {
+    "workers": 4,
+    # Intra-op threads of each worker's torch and FAISS calls; workers x threads should not exceed the cores
+    "threads_per_worker": 1,
+    # Seconds start() waits for every worker to warm up
+    "ready_timeout": 600,
+    "stop_timeout": 30
+}
+# ONNX Runtime sessions start their thread pools when created, so they cannot be inherited by a fork
+FORK_SAFE_BACKENDS = ("torch", "int8")
+
+
+def memory_usage(pid="self"):
+    """
+    Memory of a process in MB, from /proc/<pid>/smaps_rollup: rss, pss (shared pages split
+    evenly among the processes mapping them) and uss (pages private to the process).
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup", 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "uss": fields["Private_Clean"] + fields["Private_Dirty"]
+    }
+
+
+class PreforkServer:
+    def __init__(
+            self,
+            server_params : dict = SERVER_PARAMS,
+            prefork_params : dict = PREFORK_PARAMS,
+            rag_kwargs : dict = None
+        ):
+        """
+        Load RAGSystem once in this process, then fork workers that serve the HTTP app
+        on one shared listening socket. The model weights are inherited copy-on-write and
+        the FAISS index, chunk store and BM25 arrays are memory-mapped files, so each worker
+        only adds its activations, caches and the Python objects it writes to.
+        The parent runs no inference before forking: the OpenMP thread pools of torch and
+        FAISS do not survive a fork once started, so each worker warms up on its own.
+        """
+        self.server_params = dict(SERVER_PARAMS, **server_params)
+        self.params = dict(PREFORK_PARAMS, **prefork_params)
+        self.rag_kwargs = dict(rag_kwargs or {})
+        backends = dict(INFERENCE_BACKENDS, **self.rag_kwargs.get("backends", {}))
+        assert all(backend in FORK_SAFE_BACKENDS for backend in backends.values()), f"Pre-fork workers need backends among {FORK_SAFE_BACKENDS}"
+        assert self.params["workers"] > 0, "Need at least one worker"
+
+        self.rag = None
+        self.sock = None
+        # Worker pid -> worker number
+        self.workers = {}
+        self.stopping = False
+
+    def load(self):
+        """
+        Load the models and indexes that the workers will share.
+        """
+        # Fast tokenizers refuse to use their thread pool after a fork
+        os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+        rag = RAGSystem(**self.rag_kwargs)
+        if not rag.retrieval_only:
+            # Loads the generator and its tokenizer
+            rag.packer
+        # SQLite connections must not cross a fork; every worker opens its own
+        rag.cases.close()
+
+        # Move everything loaded so far out of the garbage collector's reach, so collections
+        # in the workers do not write to these objects and un-share their pages
+        gc.collect()
+        gc.freeze()
+        self.rag = rag
+
+    def bind(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((self.server_params["host"], self.server_params["port"]))
+        self.sock.listen(socket.SOMAXCONN)
+
+    def _configure_threads(self):
+        import faiss
+        import torch
+
+        threads = self.params["threads_per_worker"]
+        torch.set_num_threads(threads)
+        faiss.omp_set_num_threads(threads)
+
+    def _run_worker(self, number, ready_fd):
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        self._configure_threads()
+        self.rag.cases = CaseStore(self.rag.cases.db_path)
+        self.rag.warm_up()
+        if ready_fd is not None:
+            os.write(ready_fd, f"{number}\n".encode())
+            os.close(ready_fd)
+
+        server = RAGServer(self.server_params, rag_factory=lambda: self.rag, warm_up=False)
+        web.run_app(server.make_app(), sock=self.sock, print=None)
+
+    def _spawn(self, number, ready_fd=None, close_fd=None):
+        """
+        Fork worker 'number'. It writes a line to ready_fd once warmed up.
+        """
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = number
+            return pid
+
+        status = 0
+        try:
+            if close_fd is not None:
+                os.close(close_fd)
+            self._run_worker(number, ready_fd)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _wait_ready(self, ready_fd, count):
+        deadline = time.monotonic() + self.params["ready_timeout"]
+        ready = 0
+        while ready < count:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{count - ready} workers not ready after {self.params['ready_timeout']}s")
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                raise RuntimeError(f"Worker {self.workers.pop(pid, '?')} exited with status {status} while starting")
+            readable, _, _ = select.select([ready_fd], [], [], 1.0)
+            if readable:
+                ready += os.read(ready_fd, 4096).count(b"\n")
+
+    def start(self):
+        """
+        Load, bind and fork the workers. Returns their pids once every worker has warmed up.
+        """
+        self.load()
+        self.bind()
+        ready_r, ready_w = os.pipe()
+        try:
+            for number in range(self.params["workers"]):
+                self._spawn(number, ready_w, close_fd=ready_r)
+            os.close(ready_w)
+            self._wait_ready(ready_r, self.params["workers"])
+        except BaseException:
+            self.stop()
+            raise
+        finally:
+            os.close(ready_r)
+        return list(self.workers)
+
+    def supervise(self):
+        """
+        Wait on the workers, forking a replacement for any that exits until stop() is called.
+        """
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            number = self.workers.pop(pid, None)
+            if number is not None and not self.stopping:
+                print(f"Worker {number} (pid {pid}) exited with status {status}; restarting it")
+                self._spawn(number)
+
+    def stop(self):
+        """
+        Ask every worker to shut down gracefully, killing those still running after stop_timeout.
+        """
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.params["stop_timeout"]
+        while self.workers and time.monotonic() < deadline:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                self.workers.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        for pid in list(self.workers):
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.workers.pop(pid)
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve RAGSystem from pre-forked workers sharing one copy of the models.")
+    parser.add_argument("--host", default=SERVER_PARAMS["host"])
+    parser.add_argument("--port", type=int, default=SERVER_PARAMS["port"])
+    parser.add_argument("--workers", type=int, default=PREFORK_PARAMS["workers"])
+    parser.add_argument("--threads-per-worker", type=int, default=PREFORK_PARAMS["threads_per_worker"], help="torch and FAISS threads of each worker")
+    parser.add_argument("--retrieval-only", action="store_true", help="Serve /retrieve only, without loading the generator")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the retrieval and answer cache")
+    args = parser.parse_args()
+
+    rag_kwargs = {"retrieval_only": args.retrieval_only}
+    if args.no_cache:
+        rag_kwargs["cache_params"] = None
+    server = PreforkServer(
+        {"host": args.host, "port": args.port},
+        {"workers": args.workers, "threads_per_worker": args.threads_per_worker},
+        rag_kwargs
+    )
+
+    # SIGTERM stops the workers like Ctrl-C does
+    def shutdown(signum, frame):
+        server.stopping = True
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, shutdown)
+
+    start = time.perf_counter()
+    try:
+        pids = server.start()
+        print(f"{len(pids)} workers serving on {args.host}:{args.port} after {time.perf_counter() - start:.1f}s")
+        parent = memory_usage()
+        print(f"parent: RSS {parent['rss']:.0f} MB")
+        for pid in pids:
+            usage = memory_usage(pid)
+            print(f"worker {pid}: RSS {usage['rss']:.0f} MB, PSS {usage['pss']:.0f} MB, unique {usage['uss']:.0f} MB")
+        server.supervise()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
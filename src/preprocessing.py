@@ -0,0 +1,297 @@
+# src/preprocessing.py
+#python src/preprocessing.py --workers 1 2 4 --limit 2000
+
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_MAX_LENGTH = 512
+CLEAN_BATCH_SIZE = 64
+# words: CHUNK_MAX_LENGTH-word chunks; tokens: chunks sized to the embedding model's input limit
+CHUNKING_MODES = ("tokens", "words")
+CHUNK_PARAMS = {
+    # all-MiniLM-L6-v2 truncates its input at 256 word pieces, [CLS] and [SEP] included
+    "max_tokens": 256,
+    # Word pieces shared by consecutive chunks of a case
+    "overlap": 32,
+    # Texts tokenized per call of the fast tokenizer
+    "batch_size": 64
+}
+
+NON_LETTERS = re.compile(r'[^a-z\s]')
+
+
+def download_nltk_data():
+    """
+    Download the NLTK data needed by clean_text.
+    """
+    import nltk
+
+    nltk.download('stopwords', quiet=True)
+    nltk.download('wordnet', quiet=True)
+
+
+class TextCleaner:
+    def __init__(self):
+        """
+        Build the stopword set and lemmatizer once, and memoize the output of every token seen.
+        """
+        # NLTK is loaded with the first cleaner, not with the module
+        from nltk.corpus import stopwords
+        from nltk.stem import WordNetLemmatizer
+
+        self.stop_words = set(stopwords.words('english'))
+        self.lemmatizer = WordNetLemmatizer()
+        # Maps a raw token to its lemma, or to None for a stopword
+        self.token_cache = {}
+
+    def _token(self, word):
+        if word in self.stop_words:
+            lemma = None
+        else:
+            lemma = self.lemmatizer.lemmatize(word)
+        self.token_cache[word] = lemma
+        return lemma
+
+    def clean(self, text):
+        """
+        Clean the input text by:
+        - Lowercasing
+        - Removing special characters and digits
+        - Removing stopwords
+        - Lemmatizing
+        """
+        # Lowercase, remove special characters and digits, tokenize
+        tokens = NON_LETTERS.sub('', text.lower()).split()
+
+        # Remove stopwords and lemmatize, looking each distinct token up only once
+        cache = self.token_cache
+        lemmas = []
+        for word in tokens:
+            lemma = cache[word] if word in cache else self._token(word)
+            if lemma is not None:
+                lemmas.append(lemma)
+
+        # Join back to string
+        return ' '.join(lemmas)
+
+    def clean_many(self, texts):
+        return [self.clean(str(text)) for text in texts]
+
+
+_cleaner = None
+
+
+def _get_cleaner():
+    global _cleaner
+    if _cleaner is None:
+        _cleaner = TextCleaner()
+    return _cleaner
+
+
+def _clean_batch(texts):
+    """
+    Worker entry point: clean a batch with the process-wide cleaner.
+    """
+    return _get_cleaner().clean_many(texts)
+
+
+def clean_text(text):
+    """
+    Clean the input text with the process-wide TextCleaner.
+    """
+    return _get_cleaner().clean(text)
+
+
+class ParallelCleaner:
+    def __init__(
+            self,
+            workers : int = os.cpu_count(),
+            batch_size : int = CLEAN_BATCH_SIZE
+        ):
+        """
+        Clean documents across a pool of processes, each keeping its own token cache.
+        With a single worker documents are cleaned in-process.
+        """
+        assert isinstance(workers, int) and workers > 0, "workers must be a positive integer"
+        assert isinstance(batch_size, int) and batch_size > 0, "batch_size must be a positive integer"
+
+        self.workers = workers
+        self.batch_size = batch_size
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_get_cleaner) if workers > 1 else None
+
+    def clean_many(self, texts):
+        """
+        Clean the texts, returning them in input order.
+        """
+        texts = [str(text) for text in texts]
+        if self.executor is None:
+            return _clean_batch(texts)
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        cleaned = []
+        for batch in self.executor.map(_clean_batch, batches):
+            cleaned.extend(batch)
+        return cleaned
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def prepare_cases(df):
+    """
+    Drop cases without text and normalize the column types, as done in testing.py.
+    """
+    df = df.dropna(subset=['case_text']).copy()
+    df['case_id'] = df['case_id'].astype(str).str.replace('Case', '').astype(int)
+    df['case_outcome'] = df['case_outcome'].astype(str)
+    df['case_title'] = df['case_title'].astype(str)
+    df['case_text'] = df['case_text'].astype(str)
+    return df
+
+
+def preprocess_texts(df, cleaner=None):
+    """
+    Apply text cleaning to 'case_title' and 'case_text'.
+    """
+    if cleaner is None:
+        cleaner = _get_cleaner()
+    df['cleaned_title'] = cleaner.clean_many(df['case_title'])
+    df['cleaned_text'] = cleaner.clean_many(df['case_text'])
+    return df
+
+
+def split_into_chunks(text, max_length=CHUNK_MAX_LENGTH):
+    """
+    Split text into chunks of maximum 'max_length' words.
+    """
+    words = text.split()
+    chunks = [' '.join(words[i:i + max_length]) for i in range(0, len(words), max_length)]
+    return chunks
+
+
+class TokenChunker:
+    def __init__(
+            self,
+            model_name : str,
+            max_tokens : int = CHUNK_PARAMS["max_tokens"],
+            overlap : int = CHUNK_PARAMS["overlap"],
+            batch_size : int = CHUNK_PARAMS["batch_size"]
+        ):
+        """
+        Split texts into chunks of at most max_tokens word pieces of the embedding model,
+        special tokens included, so the encoder sees every chunk whole. Consecutive chunks
+        share about 'overlap' word pieces, and chunks start and end on word boundaries.
+        Texts are tokenized in batches with the model's fast (Rust) tokenizer.
+        """
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+        assert self.tokenizer.is_fast, f"{model_name} has no fast tokenizer"
+        self.window = max_tokens - self.tokenizer.num_special_tokens_to_add()
+        assert self.window > 0, "max_tokens must leave room for the special tokens"
+        assert 0 <= overlap < self.window, "overlap must be smaller than the chunk"
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.batch_size = batch_size
+
+    def _window_end(self, word_ids, start):
+        """
+        End of the window starting at 'start', moved back so it does not cut a word in two
+        unless the word alone fills the window.
+        """
+        num_tokens = len(word_ids)
+        end = min(start + self.window, num_tokens)
+        boundary = end
+        while boundary > start and boundary < num_tokens and word_ids[boundary] == word_ids[boundary - 1]:
+            boundary -= 1
+        return boundary if boundary > start else end
+
+    def windows(self, word_ids):
+        """
+        (start, end) token ranges of the chunks of one text, given the word of every token.
+        """
+        num_tokens = len(word_ids)
+        windows = []
+        start = 0
+        while start < num_tokens:
+            end = self._window_end(word_ids, start)
+            windows.append((start, end))
+            if end == num_tokens:
+                break
+
+            # Step back by the overlap to the start of a word; without room for the overlap
+            # the next chunk starts where this one ends
+            next_start = max(end - self.overlap, start + 1)
+            while next_start > start + 1 and word_ids[next_start] == word_ids[next_start - 1]:
+                next_start -= 1
+            if word_ids[next_start] == word_ids[next_start - 1] or self._window_end(word_ids, next_start) <= end:
+                next_start = end
+            start = next_start
+        return windows
+
+    def split_many(self, texts):
+        """
+        Chunk every text. Returns (chunks, lengths): one list of chunk strings per text and
+        one list with the number of word pieces the encoder sees for each chunk.
+        """
+        special = self.tokenizer.num_special_tokens_to_add()
+        all_chunks, all_lengths = [], []
+        for first in range(0, len(texts), self.batch_size):
+            batch = [str(text) for text in texts[first:first + self.batch_size]]
+            encoded = self.tokenizer(
+                batch,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+                verbose=False
+            )
+            for i, text in enumerate(batch):
+                offsets = encoded["offset_mapping"][i]
+                chunks, lengths = [], []
+                for start, end in self.windows(encoded.word_ids(i)):
+                    chunks.append(text[offsets[start][0]:offsets[end - 1][1]])
+                    lengths.append(end - start + special)
+                all_chunks.append(chunks)
+                all_lengths.append(lengths)
+        return all_chunks, all_lengths
+
+
+def main():
+    """
+    Clean the case texts of the preprocessed CSV with several worker counts,
+    checking the output against its 'cleaned_text' column.
+    """
+    import pandas as pd
+    from retriever import PREPROCESSED_CSV_FILE
+
+    parser = argparse.ArgumentParser(description="Check and time the text cleaning stage.")
+    parser.add_argument("--csv", default=PREPROCESSED_CSV_FILE, help="Preprocessed CSV with case_text and cleaned_text")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N cases")
+    args = parser.parse_args()
+
+    download_nltk_data()
+    df = pd.read_csv(args.csv, nrows=args.limit)
+    texts = df['case_text'].astype(str).tolist()
+    expected = df['cleaned_text'].fillna('').astype(str).tolist()
+
+    for workers in args.workers:
+        cleaner = ParallelCleaner(workers=workers)
+        start = time.perf_counter()
+        cleaned = cleaner.clean_many(texts)
+        elapsed = time.perf_counter() - start
+        cleaner.close()
+
+        mismatches = sum(a != b for a, b in zip(cleaned, expected))
+        print(f"{workers} workers: {len(texts)} cases in {elapsed:.1f}s "
+              f"({len(texts) / elapsed:.1f} cases/s), {mismatches} mismatches")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,64 +4,435 @@ from retriever import Retriever
 from retriever import (
     DATA_DIR,
     INDEX_FILE,
-    DOCS_FILE
+    DOCS_FILE,
+    CASES_DB_FILE
 )
 import os
-from generator import Generator
-import pandas as pd
+import threading
+import time
 
-PREPROCESSED_CSV_FILE = os.path.join(DATA_DIR, "preprocessed_dataframe.csv") 
+import numpy as np
+
+from ann_index import SEARCH_PARAMS
+from case_store import CaseStore
+from result_cache import ResultCache, RESULT_CACHE_PARAMS
+from generator import AnswerStream, Generator, GENERATOR_BATCH_SIZE, GENERATION_PROFILES, DEFAULT_PROFILE, ENCODER_CACHE_PARAMS
+from context_packer import ContextPacker, CONTEXT_PARAMS
+from sentence_index import SENTENCE_INDEX_DIR, SENTENCE_PARAMS, SentenceIndex
+from inference_backend import INFERENCE_BACKENDS
+from instrumentation import tracer
+
+WARM_UP_QUESTION = "When are indemnity costs awarded instead of party and party costs?"
+# chunks: the retrieved chunks; cases: the sentences of the retrieved cases closest to the question
+CONTEXT_MODES = ("chunks", "cases")
 
 class RAGSystem:
     def __init__(
             self, 
             index_path : str = INDEX_FILE,
             docs_path : str = DOCS_FILE,
-            preprocessed_csv_path : str = PREPROCESSED_CSV_FILE
+            cases_path : str = CASES_DB_FILE,
+            search_params : dict = SEARCH_PARAMS,
+            cache_params : dict = RESULT_CACHE_PARAMS,
+            encoder_cache_params : dict = ENCODER_CACHE_PARAMS,
+            context_params : dict = CONTEXT_PARAMS,
+            context_mode : str = "chunks",
+            sentences_path : str = SENTENCE_INDEX_DIR,
+            backends : dict = INFERENCE_BACKENDS,
+            retrieval_mode : str = "dense",
+            retrieval_only : bool = False,
+            shards=None,
+            retriever : Retriever = None,
+            generator : Generator = None
         ):
         """
         Initialize the RAG system by loading the retriever and generator components.
+        Pass cache_params=None to disable the retrieval and answer cache, and
+        encoder_cache_params=None to disable the generator's cache of encoder states.
+        context_params configures the token budget and duplicate filtering of the context.
+        context_mode 'cases' builds the context from the full retrieved cases: their sentences
+        most similar to the question, from the sentence index at sentences_path, up to the budget.
+        backends picks the inference backend of the 'retriever' and 'generator' models.
+        retrieval_mode is 'dense', 'lexical' (BM25) or 'hybrid' (both, rank-fused).
+        shards is a shard directory or a list of 'host:port' shard servers to search instead of the index.
+        The generator is loaded on first use. With retrieval_only it is never loaded,
+        for tools that only need search results; the answer methods then fail.
+        A ready retriever or generator is used as is instead of being loaded.
         """
-        assert isinstance(preprocessed_csv_path, str), "Preprocessed CSV path must be a string"
-        assert os.path.exists(preprocessed_csv_path), f"Preprocessed CSV file not found at {preprocessed_csv_path}"
+        assert isinstance(cases_path, str), "Cases path must be a string"
+        assert os.path.exists(cases_path), f"Case store not found at {cases_path}; build it with src/case_store.py"
+        assert not (retrieval_only and generator is not None), "A retrieval-only RAGSystem takes no generator"
+        assert context_mode in CONTEXT_MODES, f"Context mode must be one of {CONTEXT_MODES}"
 
-        self.retriever = Retriever(index_path=index_path, docs_path=docs_path)
-        self.generator = Generator()
+        backends = dict(INFERENCE_BACKENDS, **backends)
+        if retriever is None:
+            retriever = Retriever(index_path=index_path, docs_path=docs_path, search_params=search_params, backend=backends["retriever"], mode=retrieval_mode, shards=shards)
+        self.retriever = retriever
+        self.retrieval_only = retrieval_only
+        self.generator_backend = backends["generator"]
+        self.encoder_cache_params = encoder_cache_params
+        self.context_params = dict(CONTEXT_PARAMS, **context_params)
+        self.context_mode = context_mode
+        self.sentences_path = sentences_path
+        self._sentences = None
+        self._generator = generator
+        self._packer = None
+        self._generator_lock = threading.Lock()
         
-        # Load the preprocessed dataframe to map case IDs to original data
-        self.df = pd.read_csv(preprocessed_csv_path)
+        # Open the case store used to map case IDs to original data
+        self.cases = CaseStore(cases_path)
+
+        self.cache = ResultCache(**dict(RESULT_CACHE_PARAMS, **cache_params)) if cache_params is not None else None
+
+    @property
+    def generator(self):
+        """
+        The Generator, loaded on first use.
+        """
+        if self._generator is None:
+            assert not self.retrieval_only, "This RAGSystem is retrieval-only; create it with retrieval_only=False to generate answers"
+            # Server threads may ask for it at the same time; load it once
+            with self._generator_lock:
+                if self._generator is None:
+                    self._generator = Generator(backend=self.generator_backend, encoder_cache_params=self.encoder_cache_params)
+        return self._generator
+
+    @property
+    def packer(self):
+        """
+        The ContextPacker, built on the generator's tokenizer on first use.
+        """
+        if self._packer is None:
+            self._packer = ContextPacker(self.generator.tokenizer, **self.context_params)
+        return self._packer
     
+    @property
+    def sentences(self):
+        """
+        The SentenceIndex of full-case context, opened on first use.
+        """
+        if self._sentences is None:
+            self._sentences = SentenceIndex(self.sentences_path)
+        return self._sentences
+
     def get_context_from_chunks(
             self,
-            doc_ids
+            question,
+            chunk_ids,
+            chunks,
+            doc_ids,
+            query_embedding=None
         ):
         """
-        Retrieve the full case texts corresponding to the provided case IDs.
+        Build the context from the full cases of the retrieved chunks: rank the sentences
+        of those cases by similarity to the question and pack the best ones into the token
+        budget, joined in case order then text order. Scoring reads the precomputed
+        embeddings of at most SENTENCE_PARAMS["rows_per_case"] sentences per case, in
+        windows around the positions of the retrieved chunks within their case, so its
+        cost stays bounded by cases x rows_per_case however long the cases are; the text
+        decoded, tokenized and deduplicated is bounded by the candidate count.
+        Cases missing from the sentence index, e.g. added since it was built, take part
+        through their retrieved chunks, embedded and ranked with the sentences.
+        Returns a PackedContext whose chunk_ids are ("sentence", row) and ("chunk", chunk ID) pairs.
         """
-        # Get the unique case IDs
-        unique_case_ids = list(set(doc_ids))
-        
-        # Fetch the corresponding cleaned titles and texts
-        cases = self.df[self.df['case_id'].isin(unique_case_ids)]
-        context_list = cases['cleaned_text'].tolist()
-        
-        # Combine the contexts
-        combined_context = ' '.join(context_list)
-        return combined_context
+        # Get the unique case IDs, in retrieval order
+        unique_case_ids = list(dict.fromkeys(doc_ids))
+        case_rank = {case_id: rank for rank, case_id in enumerate(unique_case_ids)}
+        if query_embedding is None:
+            query_embedding = self.retriever.encode([question])[0]
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        # (score, ID, text, case ID, order key) of every candidate
+        indexed = self.sentences.indexed_cases(unique_case_ids)
+        # Relative positions of the retrieved chunks in their cases pick the sentences to score
+        anchors = {}
+        store = getattr(self.retriever, "store", None)
+        if store is not None:
+            for chunk_id, case_id in zip(chunk_ids, doc_ids):
+                position = store.position_in_case(chunk_id)
+                if position is not None:
+                    anchors.setdefault(case_id, []).append(position)
+        rows, sentences, case_ids, scores = self.sentences.rank(
+            query, unique_case_ids, SENTENCE_PARAMS["candidates"], anchors, SENTENCE_PARAMS["rows_per_case"]
+        )
+        candidates = [
+            (score, ("sentence", row), sentence, case_id, (case_rank[case_id], row))
+            for row, sentence, case_id, score in zip(rows, sentences, case_ids, scores)
+        ]
+
+        missing = [position for position, case_id in enumerate(doc_ids) if case_id not in indexed]
+        if missing:
+            tracer.count("context_unindexed_chunks", len(missing))
+            embeddings = np.asarray(self.retriever.encode([chunks[p] for p in missing]), dtype=np.float32)
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            candidates += [
+                (float(score), ("chunk", chunk_ids[p]), chunks[p], doc_ids[p], (case_rank[doc_ids[p]], p))
+                for p, score in zip(missing, embeddings @ query)
+            ]
+
+        candidates.sort(key=lambda candidate: -candidate[0])
+        _, ids, texts, owners, order_keys = zip(*candidates) if candidates else ((), (), (), (), ())
+        return self.packer.pack(question, list(texts), list(ids), list(owners), list(order_keys))
+
+    def pack_context(
+            self,
+            question,
+            chunk_ids,
+            chunks,
+            doc_ids,
+            query_embedding=None
+        ):
+        """
+        PackedContext of the retrieved chunks, or of their cases in 'cases' context mode.
+        When none of the cases is in the sentence index, the chunks are packed as in 'chunks' mode.
+        """
+        if self.context_mode == "cases" and self.sentences.indexed_cases(list(dict.fromkeys(doc_ids))):
+            return self.get_context_from_chunks(question, chunk_ids, chunks, doc_ids, query_embedding)
+        return self.packer.pack(question, chunks, chunk_ids, doc_ids)
     
-    def answer_question(self, question, top_k=5):
+    def retrieve(self, question, top_k=5):
+        """
+        Retrieve the top_k chunks for a question through the retrieval cache.
+        Returns (cache key, chunk IDs, chunks, case IDs).
+        """
+        # Pick up a new index generation published by the updater
+        self.retriever.reload_if_changed()
+
+        if self.cache is None:
+            chunk_ids, chunks, doc_ids = self.retriever.retrieve_batch([question], top_k=top_k, return_ids=True)[0]
+            return question, chunk_ids, chunks, doc_ids
+
+        self.cache.set_generation(self.retriever.generation)
+        cached = self.cache.get_retrieval(question, top_k)
+        if cached is not None:
+            tracer.count("retrieval_cache_hits")
+            return cached
+
+        query_embedding = None
+        if self.cache.semantic_threshold is not None:
+            query_embedding = self.retriever.encode([question])[0]
+            cached = self.cache.get_similar_retrieval(query_embedding, top_k)
+            if cached is not None:
+                tracer.count("retrieval_cache_hits")
+                return cached
+
+        chunk_ids, chunks, doc_ids = self.retriever.retrieve_batch(
+            [question],
+            top_k=top_k,
+            query_embeddings=None if query_embedding is None else query_embedding[None, :],
+            return_ids=True
+        )[0]
+        key = self.cache.put_retrieval(question, top_k, chunk_ids, chunks, doc_ids, query_embedding)
+        return key, chunk_ids, chunks, doc_ids
+
+    def retrieve_many(self, questions, top_k=5):
+        """
+        Retrieve the top_k chunks of several questions through the retrieval cache,
+        searching every miss in one batched encoder pass and FAISS call.
+        Returns one (cache key, chunk IDs, chunks, case IDs) tuple per question.
+        """
+        with tracer.trace("retrieve_many", questions=len(questions), top_k=top_k):
+            self.retriever.reload_if_changed()
+            if self.cache is not None:
+                self.cache.set_generation(self.retriever.generation)
+
+            results = [None] * len(questions)
+            if self.cache is not None:
+                results = [self.cache.get_retrieval(question, top_k) for question in questions]
+            misses = [i for i, result in enumerate(results) if result is None]
+            tracer.count("retrieval_cache_hits", len(questions) - len(misses))
+            if not misses:
+                return results
+
+            miss_questions = [questions[i] for i in misses]
+            query_embeddings = None
+            if self.cache is not None and self.cache.semantic_threshold is not None:
+                query_embeddings = self.retriever.encode(miss_questions)
+            found = self.retriever.retrieve_batch(miss_questions, top_k=top_k, query_embeddings=query_embeddings, return_ids=True)
+            for position, i in enumerate(misses):
+                chunk_ids, chunks, doc_ids = found[position]
+                key = questions[i]
+                if self.cache is not None:
+                    query_embedding = None if query_embeddings is None else query_embeddings[position]
+                    key = self.cache.put_retrieval(questions[i], top_k, chunk_ids, chunks, doc_ids, query_embedding)
+                results[i] = (key, chunk_ids, chunks, doc_ids)
+            return results
+
+    def answer_retrieved(
+            self,
+            questions : list,
+            retrievals : list,
+            batch_size : int = GENERATOR_BATCH_SIZE,
+            profile : str = DEFAULT_PROFILE,
+            deadline : float = None
+        ):
+        """
+        Answer questions whose chunks were already retrieved with retrieve_many,
+        generating the answers missing from the answer cache in padded mini-batches.
+        deadline is a time.perf_counter() timestamp. Answers are returned in input order.
+        """
+        with tracer.trace("answer_retrieved", questions=len(questions), profile=profile):
+            answers = [None] * len(questions)
+            if self.cache is not None:
+                answers = [self.cache.get_answer(key, chunk_ids, variant=profile) for key, chunk_ids, _, _ in retrievals]
+            misses = [i for i, answer in enumerate(answers) if answer is None]
+            tracer.count("answer_cache_hits", len(questions) - len(misses))
+            if not misses:
+                return answers
+
+            with tracer.span("pack_context"):
+                # Full-case contexts rank sentences against every question, embedded in one pass
+                query_embeddings = [None] * len(misses)
+                if self.context_mode == "cases":
+                    query_embeddings = self.retriever.encode([questions[i] for i in misses])
+                contexts = [
+                    self.pack_context(questions[i], retrievals[i][1], retrievals[i][2], retrievals[i][3], query_embedding).text
+                    for i, query_embedding in zip(misses, query_embeddings)
+                ]
+            generated, timed_out = self.generator.generate_answers(
+                [questions[i] for i in misses],
+                contexts,
+                batch_size=batch_size,
+                profile=profile,
+                deadline=deadline,
+                return_timed_out=True
+            )
+            for i, answer, cut_short in zip(misses, generated, timed_out):
+                answers[i] = answer
+                if self.cache is not None and not cut_short:
+                    key, chunk_ids, _, _ = retrievals[i]
+                    self.cache.put_answer(key, chunk_ids, answer, variant=profile)
+            return answers
+
+    def build_context(self, question, top_k=5):
+        """
+        Retrieve the top_k chunks and pack them, or the best sentences of their cases in
+        'cases' context mode, into the generator's token budget.
+        Returns (cache key, retrieved chunk IDs, PackedContext); the PackedContext
+        lists the chunks that made it into the context.
+        """
+        key, chunk_ids, retrieved_chunks, retrieved_doc_ids = self.retrieve(question, top_k=top_k)
+        packed = self.pack_context(question, chunk_ids, retrieved_chunks, retrieved_doc_ids)
+        return key, chunk_ids, packed
+
+    def answer_question(self, question, top_k=5, profile=DEFAULT_PROFILE, timeout=None):
         """
         Generate an answer to the question using retrieved context.
+        profile selects the decoding settings ('fast', 'balanced' or 'quality').
+        With a timeout in seconds, counted from the call, decoding stops when time runs
+        out and the best hypothesis so far is returned.
+        With instrumentation enabled, the request is traced with a span per stage.
         """
-        # Retrieve relevant chunks and their case IDs
-        retrieved_chunks, retrieved_doc_ids = self.retriever.retrieve(question, top_k=top_k)
-        
-        # For simplicity, combine the retrieved chunks as context
-        context = ' '.join(retrieved_chunks)
-        
-        # Alternatively, retrieve full case texts if needed
-        # context = self.get_context_from_chunks(retrieved_doc_ids)
-        
-        # Generate the answer
-        answer = self.generator.generate_answer(question, context)
-        return answer
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+
+        with tracer.trace("answer_question", top_k=top_k, profile=profile):
+            # Retrieve relevant chunks and their case IDs
+            with tracer.span("retrieve"):
+                key, chunk_ids, retrieved_chunks, retrieved_doc_ids = self.retrieve(question, top_k=top_k)
+
+            if self.cache is not None:
+                answer = self.cache.get_answer(key, chunk_ids, variant=profile)
+                if answer is not None:
+                    tracer.count("answer_cache_hits")
+                    return answer
+            
+            # Pack the retrieved chunks, best first, or the best sentences of their cases
+            # into the generator's input budget
+            with tracer.span("pack_context"):
+                context = self.pack_context(question, chunk_ids, retrieved_chunks, retrieved_doc_ids).text
+            
+            # Generate the answer
+            answer, timed_out = self.generator.generate_answer(
+                question,
+                context,
+                profile=profile,
+                deadline=deadline,
+                return_timed_out=True
+            )
+
+            # Answers cut short by the deadline are not cached
+            if self.cache is not None and not timed_out:
+                self.cache.put_answer(key, chunk_ids, answer, variant=profile)
+            return answer
+
+    def answer_question_stream(self, question, top_k=5, timeout=None, profile=DEFAULT_PROFILE):
+        """
+        Answer the question, streaming the text as it is generated, decoded greedily with
+        the length and repetition limits of the profile.
+        Returns an AnswerStream; iterate it for text pieces, then read its
+        time_to_first_token and total_time (seconds, including retrieval).
+        With a timeout in seconds the stream ends when time runs out.
+        """
+        assert profile in GENERATION_PROFILES, f"Profile must be one of {tuple(GENERATION_PROFILES)}"
+        start = time.perf_counter()
+        deadline = start + timeout if timeout is not None else None
+
+        def pieces():
+            with tracer.span("retrieve"):
+                key, chunk_ids, retrieved_chunks, retrieved_doc_ids = self.retrieve(question, top_k=top_k)
+
+            if self.cache is not None:
+                answer = self.cache.get_answer(key, chunk_ids, variant=f"stream-{profile}")
+                if answer is not None:
+                    yield answer
+                    return
+
+            with tracer.span("pack_context"):
+                context = self.pack_context(question, chunk_ids, retrieved_chunks, retrieved_doc_ids).text
+            text = ""
+            for piece in self.generator.generate_answer_stream(question, context, deadline=deadline, profile=profile):
+                text += piece
+                yield piece
+            # Streamed answers are greedy; keep them apart from beam-search answers in the cache
+            timed_out = deadline is not None and time.perf_counter() >= deadline
+            if self.cache is not None and not timed_out:
+                self.cache.put_answer(key, chunk_ids, text.strip(), variant=f"stream-{profile}")
+
+        return AnswerStream(tracer.trace_iter("answer_question_stream", pieces(), top_k=top_k, profile=profile), start=start)
+
+    def answer_questions(
+            self,
+            questions : list,
+            top_k : int = 5,
+            batch_size : int = GENERATOR_BATCH_SIZE,
+            profile : str = DEFAULT_PROFILE,
+            timeout : float = None
+        ):
+        """
+        Answer several questions at once: one batched retrieval, then generation in
+        padded mini-batches of batch_size. Answers are returned in input order.
+        profile and timeout work as in answer_question, for the whole batch.
+        """
+        assert isinstance(questions, list), "Questions must be a list"
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+
+        with tracer.trace("answer_questions", questions=len(questions), profile=profile):
+            retrievals = self.retrieve_many(questions, top_k=top_k)
+            return self.answer_retrieved(questions, retrievals, batch_size=batch_size, profile=profile, deadline=deadline)
+
+    def warm_up(
+            self,
+            question : str = WARM_UP_QUESTION
+        ):
+        """
+        Run a dummy question through retrieval and generation (retrieval alone if
+        retrieval-only) so that model loading and first-call initialization are paid
+        before real traffic. Returns the elapsed seconds.
+        """
+        start = time.perf_counter()
+        if self.retrieval_only:
+            self.retrieve(question, top_k=1)
+        else:
+            self.answer_question(question, top_k=1)
+        return time.perf_counter() - start
+
+    def cache_stats(self):
+        """
+        Hit, miss and eviction counters of the retrieval and answer caches, and of the
+        generator's encoder cache once the generator is loaded.
+        """
+        stats = self.cache.stats() if self.cache is not None else {}
+        if self._generator is not None and self._generator.encoder_cache is not None:
+            stats["encoder"] = self._generator.encoder_cache.stats()
+        return stats
@@ -0,0 +1,177 @@
+# src/result_cache.py
+
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+RESULT_CACHE_PARAMS = {
+    "max_entries": 1024,
+    "ttl_seconds": 3600,
+    # Cosine similarity above which a new query reuses a cached one; None disables semantic hits
+    "semantic_threshold": None
+}
+
+
+def normalize_query(query):
+    """
+    Lowercase, trim punctuation at the ends and collapse whitespace.
+    """
+    return re.sub(r'\s+', ' ', query.lower()).strip(' ?!.,;:')
+
+
+class LRUCache:
+    def __init__(
+            self,
+            max_entries : int = RESULT_CACHE_PARAMS["max_entries"],
+            ttl_seconds : float = RESULT_CACHE_PARAMS["ttl_seconds"]
+        ):
+        """
+        Thread-safe LRU cache whose entries also expire after ttl_seconds.
+        """
+        assert isinstance(max_entries, int) and max_entries > 0, "max_entries must be a positive integer"
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, stored_at):
+        return self.ttl_seconds is not None and time.monotonic() - stored_at > self.ttl_seconds
+
+    def get(self, key, count : bool = True):
+        """
+        Return the cached value, or None on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry[1]):
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += count
+                return None
+            self.entries.move_to_end(key)
+            self.hits += count
+            return entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def items(self):
+        """
+        Snapshot of the live (key, value) pairs.
+        """
+        with self.lock:
+            return [(key, value) for key, (value, stored_at) in self.entries.items() if not self._expired(stored_at)]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+class ResultCache:
+    def __init__(
+            self,
+            max_entries : int = RESULT_CACHE_PARAMS["max_entries"],
+            ttl_seconds : float = RESULT_CACHE_PARAMS["ttl_seconds"],
+            semantic_threshold : float = RESULT_CACHE_PARAMS["semantic_threshold"]
+        ):
+        """
+        Two-level cache for RAGSystem.
+        Retrieval results are keyed by (normalized query, top_k); answers by
+        (normalized query, retrieved chunk IDs). Both levels are cleared when the
+        index generation changes.
+        """
+        self.retrievals = LRUCache(max_entries, ttl_seconds)
+        self.answers = LRUCache(max_entries, ttl_seconds)
+        self.semantic_threshold = semantic_threshold
+        self.semantic_hits = 0
+        self.generation = None
+
+    def set_generation(self, generation):
+        """
+        Drop every entry if the index generation changed.
+        """
+        if generation != self.generation:
+            self.retrievals.clear()
+            self.answers.clear()
+            self.generation = generation
+
+    def get_retrieval(self, query, top_k):
+        """
+        Exact lookup of a retrieval result: (normalized query, chunk IDs, chunks, doc IDs) or None.
+        """
+        key = normalize_query(query)
+        result = self.retrievals.get((key, top_k))
+        return None if result is None else (key,) + result[:3]
+
+    def get_similar_retrieval(self, query_embedding, top_k):
+        """
+        Look for a cached query with the same top_k whose embedding is within the
+        similarity threshold. Returns the same tuple as get_retrieval, or None.
+        """
+        if self.semantic_threshold is None:
+            return None
+        candidates = [
+            (key, value) for key, value in self.retrievals.items()
+            if key[1] == top_k and value[3] is not None
+        ]
+        if not candidates:
+            return None
+
+        embeddings = np.stack([value[3] for _, value in candidates])
+        query = query_embedding / (np.linalg.norm(query_embedding) or 1.0)
+        similarities = embeddings @ query / np.maximum(np.linalg.norm(embeddings, axis=1), 1e-12)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.semantic_threshold:
+            return None
+
+        key, _ = candidates[best]
+        result = self.retrievals.get(key, count=False)
+        if result is None:
+            return None
+        self.semantic_hits += 1
+        return (key[0],) + result[:3]
+
+    def put_retrieval(self, query, top_k, chunk_ids, chunks, doc_ids, query_embedding=None):
+        key = normalize_query(query)
+        self.retrievals.put((key, top_k), (tuple(chunk_ids), chunks, doc_ids, query_embedding))
+        return key
+
+    def get_answer(self, normalized_query, chunk_ids, variant=None):
+        """
+        Cached answer, or None. 'variant' separates answers decoded differently.
+        """
+        return self.answers.get((normalized_query, tuple(chunk_ids), variant))
+
+    def put_answer(self, normalized_query, chunk_ids, answer, variant=None):
+        self.answers.put((normalized_query, tuple(chunk_ids), variant), answer)
+
+    def stats(self):
+        return {
+            "generation": self.generation,
+            "retrieval": self.retrievals.stats(),
+            "answer": self.answers.stats(),
+            "semantic_hits": self.semantic_hits
+        }
@@ -1,64 +1,318 @@
 # src/retriever.py
 
 import os
-import faiss
-import pickle
-from sentence_transformers import SentenceTransformer
+import threading
+
+from ann_index import SEARCH_PARAMS, read_index, search_filtered, set_search_params
+from inference_backend import INFERENCE_BACKENDS, MODELS_DIR, load_sentence_model
+from index_store import DocumentStore, manifest_path_for, read_manifest
+from instrumentation import tracer
+from lexical_index import LexicalIndex
+from metadata_index import MetadataIndex
+from sharded_index import SHARD_PARAMS, ShardedIndex
 
 
 DATA_DIR = os.path.join("data", "legal_documents")
 INDEX_FILE = os.path.join(DATA_DIR, "faiss_index.index")
-DOCS_FILE = os.path.join(DATA_DIR, "documents.pkl")
+DOCS_FILE = os.path.join(DATA_DIR, "documents")
+PREPROCESSED_CSV_FILE = os.path.join(DATA_DIR, "preprocessed_dataframe.csv")
+CASES_DB_FILE = os.path.join(DATA_DIR, "cases.sqlite")
+LEXICAL_INDEX_DIR = os.path.join(DATA_DIR, "bm25")
+SHARDS_DIR = os.path.join(DATA_DIR, "shards")
 MODEL_NAME_RETRIEVER = 'sentence-transformers/all-MiniLM-L6-v2'
+RETRIEVER_BATCH_SIZE = 64
+# dense: FAISS over MiniLM embeddings; lexical: BM25 only, no encoder pass; hybrid: both, fused
+RETRIEVAL_MODES = ("dense", "lexical", "hybrid")
+FUSION_PARAMS = {
+    # Reciprocal rank fusion constant: a result at rank r scores 1 / (rrf_k + r)
+    "rrf_k": 60,
+    # Candidates taken from each ranking before fusion, at least top_k
+    "candidates": 50
+}
+FILTER_PARAMS = {
+    # Filtered HNSW or flat searches short of top_k hits are redone by brute force over the
+    # selected vectors when there are at most this many
+    "exact_fallback_max": 50000
+}
+
+
+def reciprocal_rank_fusion(rankings, top_k, rrf_k=FUSION_PARAMS["rrf_k"]):
+    """
+    Fuse ranked ID lists by summing 1 / (rrf_k + rank) over the lists each ID appears in.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            if chunk_id < 0:
+                continue
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:top_k]
 
 class Retriever:
     def __init__(
-            self, 
-            index_path : str = INDEX_FILE, 
-            docs_path : str = DOCS_FILE, 
-            model_name : str = MODEL_NAME_RETRIEVER
+            self,
+            index_path : str = INDEX_FILE,
+            docs_path : str = DOCS_FILE,
+            model_name : str = MODEL_NAME_RETRIEVER,
+            search_params : dict = SEARCH_PARAMS,
+            mmap_index : bool = True,
+            backend : str = INFERENCE_BACKENDS["retriever"],
+            models_dir : str = MODELS_DIR,
+            lexical_path : str = LEXICAL_INDEX_DIR,
+            mode : str = "dense",
+            shards=None,
+            shard_params : dict = SHARD_PARAMS,
+            cases_path : str = CASES_DB_FILE,
+            filter_params : dict = FILTER_PARAMS,
+            model=None
         ):
         """
         Initialize the Retriever by loading the FAISS index, document chunks, and the embedding model.
+        search_params sets 'nprobe' for IVF indexes and 'ef_search' for HNSW indexes.
+        With mmap_index the index is opened with memory-mapped IO where FAISS supports it,
+        so worker processes share its pages.
+        backend selects how queries are embedded: 'torch', 'int8', 'onnx' or 'onnx-int8'.
+        mode is the default of retrieve_batch: 'dense', 'lexical' (BM25 index at lexical_path)
+        or 'hybrid' (both, fused by reciprocal rank).
+        shards replaces the index and chunk store with shards: a directory written by
+        src/sharded_index.py --split, searched by threads in this process, or a list of
+        'host:port' shard servers. Queries then fan out to every shard and the per-shard
+        top-k lists are merged; shard_params sets the timeout and partial-failure policy.
+        cases_path is the case store read, on the first filtered query of each generation,
+        to index chunks by case_outcome for the filters of retrieve_batch.
+        A preloaded model (anything with SentenceTransformer's encode) replaces model_name and backend.
         """
         assert isinstance(index_path, str), "Index path must be a string"
         assert isinstance(docs_path, str), "Docs path must be a string"
         assert isinstance(model_name, str), "Model name must be a string"
-        
-        assert os.path.exists(index_path), f"Index file not found at {index_path}"
-        assert os.path.exists(docs_path), f"Docs file not found at {docs_path}"
-        
-        # Load FAISS index
-        self.index = faiss.read_index(index_path)
-        
-        # Load document chunks and their corresponding case IDs
-        with open(docs_path, 'rb') as f:
-            data = pickle.load(f)
-            self.chunks = data['chunks']
-            self.doc_ids = data['doc_ids']
-        
+
+        assert mode in RETRIEVAL_MODES, f"Mode must be one of {RETRIEVAL_MODES}"
+        if shards is None:
+            assert os.path.exists(index_path), f"Index file not found at {index_path}"
+            assert os.path.exists(docs_path), f"Docs file not found at {docs_path}"
+        else:
+            assert mode == "dense", "Sharded retrieval supports the dense mode only"
+        if mode != "dense":
+            assert os.path.isdir(lexical_path), f"Lexical index not found at {lexical_path}; build it with src/lexical_index.py"
+
+        self.index_path = index_path
+        self.docs_path = docs_path
+        self.search_params = dict(SEARCH_PARAMS, **search_params)
+        self.mmap_index = mmap_index
+        self.lexical_path = lexical_path
+        self.mode = mode
+        self.cases_path = cases_path
+        self.filter_params = dict(FILTER_PARAMS, **filter_params)
+        # (generation, MetadataIndex), built on the first filtered query
+        self._metadata = None
+        self._metadata_lock = threading.Lock()
+
+        if shards is None:
+            # Load FAISS index and the document chunks keyed by their stable IDs
+            self.shards = None
+            self._load_generation()
+        else:
+            if isinstance(shards, str):
+                self.shards = ShardedIndex.open(shards, shard_params, self.search_params, mmap_index)
+            else:
+                self.shards = ShardedIndex.connect(shards, shard_params)
+            self.index, self.lexical, self.store = None, None, None
+            self.generation = self.shards.generation
+
         # Load embedding model
-        self.model = SentenceTransformer(model_name)
-    
+        self.backend = backend
+        self.model = model if model is not None else load_sentence_model(model_name, backend, models_dir)
+
+    def _manifest_stamp(self):
+        """
+        Cheap fingerprint of the manifest file used to detect a new index generation.
+        """
+        try:
+            stat = os.stat(manifest_path_for(self.index_path))
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load_generation(self):
+        """
+        Load the FAISS index, the lexical index if there is one, and the document store
+        for the current generation.
+        """
+        stamp = self._manifest_stamp()
+        generation = read_manifest(self.index_path)["generation"]
+        index = read_index(self.index_path, self.mmap_index)
+        set_search_params(index, **self.search_params)
+        store = DocumentStore(self.docs_path)
+        lexical = LexicalIndex(self.lexical_path) if os.path.isdir(self.lexical_path) else None
+
+        # Swap all attributes together so concurrent readers see one generation
+        self.index, self.lexical, self.store, self.generation, self._stamp = index, lexical, store, generation, stamp
+
+    def reload_if_changed(self):
+        """
+        Load a new index generation if an update was published since the last load.
+        Returns True when a reload happened.
+        """
+        if self.shards is not None:
+            changed = self.shards.reload_if_changed()
+            self.generation = self.shards.generation
+            return changed
+        if self._manifest_stamp() == self._stamp:
+            return False
+        self._load_generation()
+        return True
+
+    def metadata(self):
+        """
+        The MetadataIndex of the current generation, built on first use.
+        """
+        with self._metadata_lock:
+            store, generation = self.store, self.generation
+            if self._metadata is None or self._metadata[0] != generation:
+                # case_store imports this module's paths
+                from case_store import CaseStore
+                cases = CaseStore(self.cases_path)
+                try:
+                    outcomes = cases.all_outcomes()
+                finally:
+                    cases.close()
+                self._metadata = (generation, MetadataIndex(store, outcomes))
+            return self._metadata[1]
+
+    def _lookup(self, store, ids, top_k):
+        """
+        Map one row of FAISS labels to chunks and case IDs, skipping deleted chunks.
+        """
+        retrieved_ids, retrieved_chunks, retrieved_doc_ids = [], [], []
+        for chunk_id in ids:
+            entry = store.get(int(chunk_id))
+            if entry is None:
+                continue
+            retrieved_ids.append(int(chunk_id))
+            retrieved_chunks.append(entry[0])
+            retrieved_doc_ids.append(entry[1])
+            if len(retrieved_chunks) == top_k:
+                break
+        return retrieved_ids, retrieved_chunks, retrieved_doc_ids
+
     def retrieve(
             self,
             query : str,
-            top_k : int = 5
+            top_k : int = 5,
+            filters : dict = None
         ):
         """
-        Retrieve the top_k most relevant document chunks for a given query.
+        Retrieve the top_k most relevant document chunks for a given query,
+        among the chunks matching filters if given (see retrieve_batch).
         """
         assert isinstance(query, str), "Query must be a string"
         assert isinstance(top_k, int), "top_k must be an integer"
 
-        # Generate embedding for the query
-        query_embedding = self.model.encode([query], convert_to_numpy=True)
-        
-        # Perform similarity search using FAISS
-        _, indices = self.index.search(query_embedding, top_k)
-        
+        return self.retrieve_batch([query], top_k=top_k, filters=filters)[0]
+
+    def encode(
+            self,
+            queries : list,
+            batch_size : int = RETRIEVER_BATCH_SIZE
+        ):
+        """
+        Embed the queries in one encoder pass.
+        """
+        with tracer.span("encode"):
+            return self.model.encode(queries, batch_size=batch_size, convert_to_numpy=True)
+
+    def retrieve_batch(
+            self,
+            queries : list,
+            top_k : int = 5,
+            batch_size : int = RETRIEVER_BATCH_SIZE,
+            query_embeddings=None,
+            return_ids : bool = False,
+            mode : str = None,
+            filters : dict = None
+        ):
+        """
+        Retrieve the top_k chunks for every query, embedding all queries in one encoder
+        pass and searching them with one FAISS call.
+        Returns one (chunks, doc_ids) pair per query, in input order, or
+        (chunk_ids, chunks, doc_ids) triples with return_ids.
+        Precomputed query_embeddings skip the encoder pass.
+        mode overrides the Retriever's default: 'dense', 'lexical' or 'hybrid'.
+        filters restricts the results to chunks of some cases, e.g.
+        {"case_outcome": ["cited", "followed"], "case_ids": [12, 40]}: values of one key
+        are ORed, keys are ANDed. They are resolved to a chunk ID bitmap that FAISS and BM25
+        apply while searching, so top_k hits come back whenever that many chunks match.
+        """
+        assert isinstance(queries, list), "Queries must be a list"
+        assert all(isinstance(query, str) for query in queries), "Queries must be strings"
+        assert isinstance(top_k, int), "top_k must be an integer"
+        mode = mode or self.mode
+        assert mode in RETRIEVAL_MODES, f"Mode must be one of {RETRIEVAL_MODES}"
+
+        if not queries:
+            return []
+
+        if self.shards is not None:
+            assert mode == "dense", "Sharded retrieval supports the dense mode only"
+            assert not filters, "Sharded retrieval does not support filters"
+            if query_embeddings is None:
+                query_embeddings = self.encode(queries, batch_size=batch_size)
+            # Every shard skips its own deleted chunks and returns the texts of its hits
+            with tracer.span("search"):
+                results = self.shards.search(query_embeddings, top_k)
+            if return_ids:
+                return results
+            return [(retrieved_chunks, retrieved_doc_ids) for _, retrieved_chunks, retrieved_doc_ids in results]
+
+        index, lexical, store = self.index, self.lexical, self.store
+        assert mode == "dense" or lexical is not None, f"Mode '{mode}' needs the lexical index at {self.lexical_path}"
+
+        id_mask = None
+        if filters:
+            with tracer.span("filter"):
+                id_mask = self.metadata().resolve(filters)
+
+        # Over-fetch to skip chunks deleted since the last compaction; filter masks exclude them
+        over_fetch = len(store.deleted) if id_mask is None else 0
+        search_k = top_k + over_fetch
+        if mode == "hybrid":
+            search_k = max(search_k, FUSION_PARAMS["candidates"] + over_fetch)
+
+        dense_ids = None
+        if mode != "lexical":
+            # Generate embeddings for all queries
+            if query_embeddings is None:
+                query_embeddings = self.encode(queries, batch_size=batch_size)
+
+            # Perform similarity search using FAISS
+            with tracer.span("search"):
+                if id_mask is None:
+                    _, dense_ids = index.search(query_embeddings, min(search_k, index.ntotal))
+                else:
+                    _, dense_ids = search_filtered(
+                        index, query_embeddings, min(search_k, index.ntotal), id_mask,
+                        self.filter_params["exact_fallback_max"]
+                    )
+
+        lexical_ids = None
+        if mode != "dense":
+            # BM25 needs no encoder pass
+            with tracer.span("lexical_search"):
+                lexical_ids = [lexical.search(query, search_k, id_mask)[0] for query in queries]
+
+        if mode == "dense":
+            ids = dense_ids
+        elif mode == "lexical":
+            ids = lexical_ids
+        else:
+            ids = [
+                reciprocal_rank_fusion([dense_row, lexical_row], search_k)
+                for dense_row, lexical_row in zip(dense_ids, lexical_ids)
+            ]
+
         # Retrieve the corresponding document chunks and case IDs
-        retrieved_chunks = [self.chunks[idx] for idx in indices[0]]
-        retrieved_doc_ids = [self.doc_ids[idx] for idx in indices[0]]
-        
-        return retrieved_chunks, retrieved_doc_ids
+        with tracer.span("lookup"):
+            results = [self._lookup(store, row, top_k) for row in ids]
+        if return_ids:
+            return results
+        return [(retrieved_chunks, retrieved_doc_ids) for _, retrieved_chunks, retrieved_doc_ids in results]
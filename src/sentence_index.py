@@ -0,0 +1,274 @@
+# src/sentence_index.py
+#python src/sentence_index.py --cases data/legal_documents/cases.sqlite
+
+import argparse
+import json
+import mmap
+import os
+import re
+import time
+
+import numpy as np
+
+from case_store import CaseStore
+from embedding_cache import CachedEmbedder, EMBEDDING_CACHE_DIR
+from index_store import current_base_dir, new_base_dir, switch_current
+from inference_backend import BACKENDS
+from retriever import CASES_DB_FILE, DATA_DIR, MODEL_NAME_RETRIEVER
+
+SENTENCE_INDEX_DIR = os.path.join(DATA_DIR, "sentences")
+SENTENCE_PARAMS = {
+    # Longer sentences are split, so a single one never takes most of the context budget
+    "max_words": 64,
+    # Shorter fragments (citations, headings) are merged into the next sentence
+    "min_words": 4,
+    # Best sentences of the retrieved cases handed to the context packer, a few times what
+    # fits in the generator's input so near-duplicates can be skipped
+    "candidates": 64,
+    # Sentences scored per case at most: windows around the retrieved chunks of longer cases
+    "rows_per_case": 512,
+    # Cases split and embedded per step of the build
+    "cases_per_batch": 256
+}
+
+SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+')
+
+
+def split_sentences(
+        text : str,
+        max_words : int = SENTENCE_PARAMS["max_words"],
+        min_words : int = SENTENCE_PARAMS["min_words"]
+    ):
+    """
+    Split a case text into sentences of min_words to max_words words.
+    """
+    sentences, pending = [], []
+    for part in SENTENCE_END.split(text):
+        pending.extend(part.split())
+        if len(pending) < min_words:
+            continue
+        for first in range(0, len(pending), max_words):
+            sentences.append(' '.join(pending[first:first + max_words]))
+        pending = []
+    if pending:
+        if sentences and len(sentences[-1].split()) + len(pending) <= max_words:
+            sentences[-1] += ' ' + ' '.join(pending)
+        else:
+            sentences.append(' '.join(pending))
+    return sentences
+
+
+class SentenceIndex:
+    def __init__(
+            self,
+            index_dir : str = SENTENCE_INDEX_DIR
+        ):
+        """
+        Open the sentence index written by SentenceIndex.build: the sentences of every case
+        with their normalized embeddings, in memory-mapped arrays. The sentences of a case
+        are one contiguous range of rows, so ranking them for a query reads only the rows
+        of the retrieved cases.
+        """
+        assert os.path.isdir(index_dir), f"Sentence index not found at {index_dir}; build it with src/sentence_index.py"
+        self.base_dir = current_base_dir(index_dir)
+        with open(self._path("meta.json"), 'r') as f:
+            meta = json.load(f)
+        self.model_name, self.rows, self.dim = meta["model_name"], meta["rows"], meta["dim"]
+
+        # Case IDs in increasing order; the sentences of case_ids[i] are rows case_starts[i]:case_starts[i + 1]
+        self.case_ids = np.fromfile(self._path("case_ids.i64"), dtype=np.int64)
+        self.case_starts = np.fromfile(self._path("case_starts.i64"), dtype=np.int64)
+        self.offsets = np.memmap(self._path("offsets.i64"), dtype=np.int64, mode='r', shape=(self.rows + 1,)) \
+            if self.rows else np.zeros(1, dtype=np.int64)
+        self.embeddings = np.memmap(self._path("embeddings.f32"), dtype=np.float32, mode='r', shape=(self.rows, self.dim)) \
+            if self.rows else np.zeros((0, self.dim), dtype=np.float32)
+        with open(self._path("sentences.bin"), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self.blob = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+
+    def _path(self, name):
+        return os.path.join(self.base_dir, name)
+
+    def __len__(self):
+        return self.rows
+
+    def sentence(self, row):
+        return self.blob[int(self.offsets[row]):int(self.offsets[row + 1])].decode('utf-8')
+
+    def rows_of_cases(self, case_ids):
+        """
+        Sentence rows of each case, one array per case ID; empty for cases not indexed.
+        """
+        case_ids = np.asarray(list(case_ids), dtype=np.int64)
+        positions = np.searchsorted(self.case_ids, case_ids)
+        rows = []
+        for case_id, position in zip(case_ids.tolist(), positions.tolist()):
+            if position < len(self.case_ids) and self.case_ids[position] == case_id:
+                rows.append(np.arange(self.case_starts[position], self.case_starts[position + 1]))
+            else:
+                rows.append(np.zeros(0, dtype=np.int64))
+        return rows
+
+    def indexed_cases(self, case_ids):
+        """
+        The given case IDs that have sentences in the index.
+        """
+        return {case_id for case_id, rows in zip(case_ids, self.rows_of_cases(case_ids)) if len(rows)}
+
+    def candidate_rows(
+            self,
+            case_ids,
+            anchors : dict = None,
+            rows_per_case : int = SENTENCE_PARAMS["rows_per_case"]
+        ):
+        """
+        Sentence rows to score for each case, at most rows_per_case of them. Longer cases
+        keep equal windows centred on their anchors, the relative positions in [0, 1] of
+        their retrieved chunks, or evenly spaced rows when they have none.
+        """
+        anchors = anchors or {}
+        selected = []
+        for case_id, rows in zip(case_ids, self.rows_of_cases(case_ids)):
+            if len(rows) <= rows_per_case:
+                selected.append(rows)
+                continue
+            positions = sorted(set(anchors.get(case_id, ())))
+            if not positions:
+                picks = np.linspace(0, len(rows) - 1, rows_per_case).astype(np.int64)
+            else:
+                window = max(1, rows_per_case // len(positions))
+                starts = np.clip(np.round(np.asarray(positions) * (len(rows) - 1)).astype(np.int64) - window // 2,
+                                 0, len(rows) - window)
+                picks = np.unique(np.concatenate([np.arange(start, start + window) for start in starts]))[:rows_per_case]
+            selected.append(rows[picks])
+        return selected
+
+    def rank(
+            self,
+            query_embedding,
+            case_ids,
+            limit : int = SENTENCE_PARAMS["candidates"],
+            anchors : dict = None,
+            rows_per_case : int = SENTENCE_PARAMS["rows_per_case"]
+        ):
+        """
+        The 'limit' sentences of the given cases most similar to the query, best first.
+        At most rows_per_case sentences of each case are scored, picked by candidate_rows,
+        so the cost is bounded by the number of cases whatever their length; only the
+        'limit' best are decoded.
+        Returns (rows, sentences, case IDs of the sentences, scores).
+        """
+        case_ids = list(dict.fromkeys(int(case_id) for case_id in case_ids))
+        case_rows = self.candidate_rows(case_ids, anchors, rows_per_case)
+        rows = np.concatenate(case_rows) if case_rows else np.zeros(0, dtype=np.int64)
+        if not len(rows):
+            return [], [], [], []
+        owners = np.repeat(np.asarray(case_ids, dtype=np.int64), [len(r) for r in case_rows])
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self.embeddings[rows] @ query
+        if len(scores) > limit:
+            best = np.argpartition(-scores, limit)[:limit]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return (
+            rows[best].tolist(),
+            [self.sentence(row) for row in rows[best]],
+            owners[best].tolist(),
+            scores[best].tolist()
+        )
+
+    @staticmethod
+    def build(
+            cases_path : str = CASES_DB_FILE,
+            index_dir : str = SENTENCE_INDEX_DIR,
+            model_name : str = MODEL_NAME_RETRIEVER,
+            backend : str = "torch",
+            cache_dir : str = EMBEDDING_CACHE_DIR,
+            use_cache : bool = True,
+            batch_size : int = 64,
+            sentence_params : dict = SENTENCE_PARAMS
+        ):
+        """
+        Split the case_text of every case into sentences, embed them with the retriever
+        model and write a new base directory, then atomically point index_dir at it.
+        Embeddings are written as they are computed, so memory stays bounded by one batch of cases.
+        Returns (cases, sentences).
+        """
+        params = dict(SENTENCE_PARAMS, **sentence_params)
+        embedder = CachedEmbedder(model_name, cache_dir, batch_size, use_cache, backend)
+        cases = CaseStore(cases_path)
+
+        name, base_dir = new_base_dir(index_dir)
+
+        case_ids, case_starts, offsets = [], [0], [0]
+        dim = None
+        with open(os.path.join(base_dir, "sentences.bin"), 'wb') as text_out, \
+                open(os.path.join(base_dir, "embeddings.f32"), 'wb') as vectors_out:
+            for batch in cases.iter_column("case_text", params["cases_per_batch"]):
+                sentences = []
+                for case_id, text in batch:
+                    case_sentences = split_sentences(text or "", params["max_words"], params["min_words"])
+                    case_ids.append(int(case_id))
+                    case_starts.append(case_starts[-1] + len(case_sentences))
+                    sentences.extend(case_sentences)
+                if not sentences:
+                    continue
+
+                embeddings = embedder.embed(sentences)
+                embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+                dim = embeddings.shape[1]
+                vectors_out.write(np.ascontiguousarray(embeddings, dtype=np.float32).tobytes())
+                for sentence in sentences:
+                    data = sentence.encode('utf-8')
+                    text_out.write(data)
+                    offsets.append(offsets[-1] + len(data))
+        cases.close()
+
+        np.asarray(case_ids, dtype=np.int64).tofile(os.path.join(base_dir, "case_ids.i64"))
+        np.asarray(case_starts, dtype=np.int64).tofile(os.path.join(base_dir, "case_starts.i64"))
+        np.asarray(offsets, dtype=np.int64).tofile(os.path.join(base_dir, "offsets.i64"))
+        with open(os.path.join(base_dir, "meta.json"), 'w') as f:
+            json.dump({
+                "model_name": model_name,
+                "rows": len(offsets) - 1,
+                "dim": dim or embedder.dimension(),
+                "cases": len(case_ids),
+                "sentence_params": params
+            }, f)
+
+        switch_current(index_dir, name)
+        print(embedder.report())
+        return len(case_ids), len(offsets) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the sentence index used for extractive full-case context.")
+    parser.add_argument("--cases", default=CASES_DB_FILE, help="Case store to read case texts from")
+    parser.add_argument("--output", default=SENTENCE_INDEX_DIR, help="Output sentence index directory")
+    parser.add_argument("--model", default=MODEL_NAME_RETRIEVER, help="Sentence embedding model; must be the retriever's")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-words", type=int, default=SENTENCE_PARAMS["max_words"])
+    parser.add_argument("--min-words", type=int, default=SENTENCE_PARAMS["min_words"])
+    parser.add_argument("--no-cache", action="store_true", help="Embed every sentence without the embedding cache")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    num_cases, num_sentences = SentenceIndex.build(
+        args.cases,
+        args.output,
+        model_name=args.model,
+        backend=args.backend,
+        use_cache=not args.no_cache,
+        batch_size=args.batch_size,
+        sentence_params={"max_words": args.max_words, "min_words": args.min_words}
+    )
+    print(f"{num_sentences} sentences of {num_cases} cases indexed in {args.output} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
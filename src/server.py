@@ -0,0 +1,373 @@
+# src/server.py
+#python src/server.py --port 8000 --workers 2
+
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from generator import DEFAULT_PROFILE, ENCODER_CACHE_PARAMS, GENERATION_PROFILES
+from instrumentation import LogSink, ProfileSink, PrometheusSink, tracer
+from rag_system import CONTEXT_MODES, RAGSystem
+
+SERVER_PARAMS = {
+    "host": "0.0.0.0",
+    "port": 8000,
+    # Threads running model calls; retrieval and generation batches run side by side
+    "workers": 2,
+    "retrieval_batch_size": 32,
+    "retrieval_max_wait_ms": 5,
+    "generation_batch_size": 8,
+    "generation_max_wait_ms": 20,
+    "top_k": 5,
+    "max_top_k": 50
+}
+
+
+class MicroBatcher:
+    def __init__(
+            self,
+            name : str,
+            process_batch,
+            executor,
+            max_batch_size : int,
+            max_wait_ms : float
+        ):
+        """
+        Queue items from concurrent requests and hand them to process_batch in batches.
+        A batch is sent when it holds max_batch_size items or when its first item has
+        waited max_wait_ms. process_batch is a blocking function taking a list of items
+        and returning one result per item; it runs in the executor, one batch at a time,
+        so requests arriving meanwhile form the next batch.
+        """
+        assert isinstance(max_batch_size, int) and max_batch_size > 0, "max_batch_size must be a positive integer"
+
+        self.name = name
+        self.process_batch = process_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.task = None
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, item):
+        """
+        Queue one item and wait for its result.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Requests whose client went away are not processed
+        return [(item, future) for item, future in batch if not future.cancelled()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_batch, [item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+
+            self.busy_seconds += time.perf_counter() - start
+            self.batches += 1
+            self.items += len(batch)
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "busy_seconds": self.busy_seconds
+        }
+
+
+class RAGServer:
+    def __init__(
+            self,
+            server_params : dict = SERVER_PARAMS,
+            rag_factory=RAGSystem,
+            metrics_sink : PrometheusSink = None,
+            warm_up : bool = True
+        ):
+        """
+        HTTP front end for RAGSystem. The system is loaded in the background at startup,
+        so /health answers at once and /ready reports when questions can be served.
+        With a metrics_sink, GET /metrics serves its Prometheus text.
+        warm_up=False skips RAGSystem.warm_up, for systems the factory returns already warm.
+        """
+        self.params = dict(SERVER_PARAMS, **server_params)
+        self.rag_factory = rag_factory
+        self.warm_up = warm_up
+        self.metrics_sink = metrics_sink
+        self.rag = None
+        self.load_error = None
+        self.started = time.monotonic()
+
+        self.executor = ThreadPoolExecutor(max_workers=self.params["workers"], thread_name_prefix="rag")
+        self.retrieval = MicroBatcher(
+            "retrieval",
+            self._retrieve_batch,
+            self.executor,
+            self.params["retrieval_batch_size"],
+            self.params["retrieval_max_wait_ms"]
+        )
+        self.generation = MicroBatcher(
+            "generation",
+            self._generate_batch,
+            self.executor,
+            self.params["generation_batch_size"],
+            self.params["generation_max_wait_ms"]
+        )
+
+    def _load(self):
+        rag = self.rag_factory()
+        if self.warm_up:
+            rag.warm_up()
+        return rag
+
+    async def _load_in_background(self):
+        try:
+            self.rag = await asyncio.get_running_loop().run_in_executor(self.executor, self._load)
+        except Exception as e:
+            self.load_error = repr(e)
+
+    def _retrieve_batch(self, items):
+        """
+        items: (question, top_k) pairs. Questions sharing a top_k are retrieved together.
+        """
+        results = [None] * len(items)
+        for top_k in {top_k for _, top_k in items}:
+            positions = [i for i, (_, k) in enumerate(items) if k == top_k]
+            found = self.rag.retrieve_many([items[i][0] for i in positions], top_k=top_k)
+            for i, result in zip(positions, found):
+                results[i] = result
+        return results
+
+    def _generate_batch(self, items):
+        """
+        items: (question, retrieval, profile, deadline) tuples. Requests with the same
+        profile are decoded together and stop at the earliest deadline among them.
+        """
+        results = [None] * len(items)
+        for profile in {item[2] for item in items}:
+            positions = [i for i, item in enumerate(items) if item[2] == profile]
+            deadlines = [items[i][3] for i in positions if items[i][3] is not None]
+            answers = self.rag.answer_retrieved(
+                [items[i][0] for i in positions],
+                [items[i][1] for i in positions],
+                batch_size=len(positions),
+                profile=profile,
+                deadline=min(deadlines) if deadlines else None
+            )
+            for i, answer in zip(positions, answers):
+                results[i] = answer
+        return results
+
+    async def _read_request(self, request):
+        """
+        Validate a question request. Returns (question, top_k, body); raises HTTPBadRequest,
+        or HTTPServiceUnavailable while the system is loading.
+        """
+        if self.rag is None:
+            raise web.HTTPServiceUnavailable(text="RAG system is still loading")
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="Body must be JSON")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="Body must be a JSON object")
+
+        question = body.get("question")
+        top_k = body.get("top_k", self.params["top_k"])
+        if not isinstance(question, str) or not question.strip():
+            raise web.HTTPBadRequest(text="'question' must be a non-empty string")
+        # JSON true and false are ints to isinstance
+        if isinstance(top_k, bool) or not isinstance(top_k, int) or not 0 < top_k <= self.params["max_top_k"]:
+            raise web.HTTPBadRequest(text=f"'top_k' must be an integer between 1 and {self.params['max_top_k']}")
+        return question, top_k, body
+
+    async def health(self, request):
+        return web.json_response({
+            "status": "ok",
+            "uptime_seconds": time.monotonic() - self.started,
+            "ready": self.rag is not None,
+            "load_error": self.load_error,
+            "batchers": {"retrieval": self.retrieval.stats(), "generation": self.generation.stats()},
+            "cache": self.rag.cache_stats() if self.rag is not None else {}
+        })
+
+    async def ready(self, request):
+        if self.rag is None:
+            status = 500 if self.load_error else 503
+            return web.json_response({"ready": False, "load_error": self.load_error}, status=status)
+        return web.json_response({"ready": True, "generation": self.rag.retriever.generation})
+
+    async def metrics(self, request):
+        if self.metrics_sink is None:
+            raise web.HTTPNotFound(text="Metrics are disabled; start the server with --metrics")
+        return web.Response(text=self.metrics_sink.render(), content_type="text/plain", charset="utf-8")
+
+    async def retrieve(self, request):
+        question, top_k, _ = await self._read_request(request)
+
+        start = time.perf_counter()
+        _, chunk_ids, chunks, doc_ids = await self.retrieval.submit((question, top_k))
+        return web.json_response({
+            "chunk_ids": chunk_ids,
+            "case_ids": doc_ids,
+            "chunks": chunks,
+            "retrieval_ms": 1000 * (time.perf_counter() - start)
+        })
+
+    async def answer(self, request):
+        start = time.perf_counter()
+        question, top_k, body = await self._read_request(request)
+        if self.rag.retrieval_only:
+            raise web.HTTPNotFound(text="The server runs retrieval-only; use /retrieve")
+
+        profile = body.get("profile", DEFAULT_PROFILE)
+        timeout = body.get("timeout")
+        if profile not in GENERATION_PROFILES:
+            raise web.HTTPBadRequest(text=f"'profile' must be one of {tuple(GENERATION_PROFILES)}")
+        if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+            raise web.HTTPBadRequest(text="'timeout' must be a positive number of seconds")
+        deadline = start + timeout if timeout is not None else None
+
+        retrieval = await self.retrieval.submit((question, top_k))
+        retrieved = time.perf_counter()
+        answer = await self.generation.submit((question, retrieval, profile, deadline))
+        done = time.perf_counter()
+
+        return web.json_response({
+            "answer": answer,
+            "chunk_ids": retrieval[1],
+            "case_ids": retrieval[3],
+            "profile": profile,
+            "retrieval_ms": 1000 * (retrieved - start),
+            "generation_ms": 1000 * (done - retrieved),
+            "total_ms": 1000 * (done - start)
+        })
+
+    async def on_startup(self, app):
+        self.retrieval.start()
+        self.generation.start()
+        app["loader"] = asyncio.get_running_loop().create_task(self._load_in_background())
+
+    async def on_cleanup(self, app):
+        app["loader"].cancel()
+        await self.retrieval.stop()
+        await self.generation.stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def make_app(self):
+        app = web.Application()
+        app.add_routes([
+            web.get("/health", self.health),
+            web.get("/ready", self.ready),
+            web.get("/metrics", self.metrics),
+            web.post("/retrieve", self.retrieve),
+            web.post("/answer", self.answer)
+        ])
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve RAGSystem over HTTP with micro-batched retrieval and generation.")
+    parser.add_argument("--host", default=SERVER_PARAMS["host"])
+    parser.add_argument("--port", type=int, default=SERVER_PARAMS["port"])
+    parser.add_argument("--workers", type=int, default=SERVER_PARAMS["workers"], help="Threads running model calls")
+    parser.add_argument("--retrieval-batch-size", type=int, default=SERVER_PARAMS["retrieval_batch_size"])
+    parser.add_argument("--retrieval-max-wait-ms", type=float, default=SERVER_PARAMS["retrieval_max_wait_ms"])
+    parser.add_argument("--generation-batch-size", type=int, default=SERVER_PARAMS["generation_batch_size"])
+    parser.add_argument("--generation-max-wait-ms", type=float, default=SERVER_PARAMS["generation_max_wait_ms"])
+    parser.add_argument("--no-cache", action="store_true", help="Disable the retrieval and answer cache, e.g. for load tests")
+    parser.add_argument("--encoder-cache-mb", type=int, default=ENCODER_CACHE_PARAMS["max_bytes"] // 2**20, help="Memory for cached encoder states of repeated prompts; 0 disables it")
+    parser.add_argument("--context-mode", choices=CONTEXT_MODES, default="chunks", help="Answer from the retrieved chunks, or from the best sentences of their cases")
+    parser.add_argument("--retrieval-only", action="store_true", help="Serve /retrieve only, without loading the generator")
+    parser.add_argument("--shards", nargs="+", default=None, help="Shard directory, or host:port addresses of shard servers")
+    parser.add_argument("--metrics", action="store_true", help="Trace requests and serve stage timings and token counters at /metrics")
+    parser.add_argument("--trace-log", action="store_true", help="Log stage timings and token counts of every request")
+    parser.add_argument("--slow-ms", type=float, default=None, help="Log only requests slower than this, and profile them with --profile-dir")
+    parser.add_argument("--profile-dir", default=None, help="Write cProfile stats of slow sampled requests to this directory")
+    parser.add_argument("--profile-every", type=int, default=10, help="Profile one request out of this many")
+    args = parser.parse_args()
+
+    # Instrumentation stays off, at no cost, unless a sink is asked for
+    sinks = []
+    metrics_sink = PrometheusSink() if args.metrics else None
+    if metrics_sink is not None:
+        sinks.append(metrics_sink)
+    if args.trace_log or args.slow_ms is not None:
+        logging.basicConfig(level=logging.INFO)
+        sinks.append(LogSink(slow_ms=args.slow_ms))
+    if args.profile_dir is not None:
+        sinks.append(ProfileSink(args.profile_dir, slow_ms=args.slow_ms or 1000.0, sample_every=args.profile_every))
+    tracer.configure(sinks=sinks)
+
+    rag_kwargs = {"retrieval_only": args.retrieval_only, "context_mode": args.context_mode}
+    if args.shards:
+        rag_kwargs["shards"] = args.shards[0] if len(args.shards) == 1 and os.path.isdir(args.shards[0]) else args.shards
+    if args.no_cache:
+        rag_kwargs["cache_params"] = None
+    rag_kwargs["encoder_cache_params"] = {"max_bytes": args.encoder_cache_mb * 2**20} if args.encoder_cache_mb > 0 else None
+    server = RAGServer({
+        "host": args.host,
+        "port": args.port,
+        "workers": args.workers,
+        "retrieval_batch_size": args.retrieval_batch_size,
+        "retrieval_max_wait_ms": args.retrieval_max_wait_ms,
+        "generation_batch_size": args.generation_batch_size,
+        "generation_max_wait_ms": args.generation_max_wait_ms
+    }, rag_factory=functools.partial(RAGSystem, **rag_kwargs), metrics_sink=metrics_sink)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
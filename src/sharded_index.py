@@ -0,0 +1,578 @@
+# src/sharded_index.py
+#python src/sharded_index.py --split 4
+#python src/sharded_index.py --serve-all data/legal_documents/shards --base-port 9001
+
+import argparse
+import heapq
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+from ann_index import SEARCH_PARAMS, create_index, read_index, set_search_params, supports_remove
+from index_store import DocumentStore, manifest_path_for, read_manifest, write_manifest
+from instrumentation import tracer
+
+SHARDS_FILE_NAME = "shards.json"
+SHARD_INDEX_FILE_NAME = "faiss_index.index"
+SHARD_DOCS_DIR_NAME = "documents"
+SHARD_SERVER_PORT = 9001
+SHARD_PARAMS = {
+    # Seconds to wait for the shards; a shard that takes longer counts as failed for the query
+    "timeout": 2.0,
+    # Merge the results of the shards that answered instead of failing the query
+    "allow_partial": True,
+    # Fewest shards that must answer for a partial result; None means one
+    "min_shards": None,
+    # Threads searching each shard. A search that misses the timeout keeps its thread until
+    # it returns; a shard whose threads are all taken is skipped, so a slow shard never
+    # holds the threads of the others
+    "threads_per_shard": 2
+}
+
+
+logger = logging.getLogger("rag.search")
+
+
+class ShardError(RuntimeError):
+    pass
+
+
+class ShardResults(list):
+    """
+    Merged results of a sharded search, one per query; 'missing' maps the number of every
+    shard left out of the merge to the reason.
+    """
+    def __init__(self, results, missing=None):
+        super().__init__(results)
+        self.missing = dict(missing or {})
+
+    @property
+    def partial(self):
+        return bool(self.missing)
+
+
+def case_boundaries(doc_ids, num_shards):
+    """
+    Case IDs at which shards 1..num_shards-1 start, splitting the chunks into case ID
+    ranges of similar size without splitting a case across shards.
+    """
+    cases, counts = np.unique(np.asarray(doc_ids, dtype=np.int64), return_counts=True)
+    cumulative = np.cumsum(counts)
+    targets = cumulative[-1] * np.arange(1, num_shards) / num_shards if len(cases) else []
+    positions = np.minimum(np.searchsorted(cumulative, targets, side='right'), max(len(cases) - 1, 0))
+    return cases[positions] if len(cases) else np.zeros(0, dtype=np.int64)
+
+
+def shard_of(doc_ids, boundaries):
+    return np.searchsorted(boundaries, np.asarray(doc_ids, dtype=np.int64), side='right')
+
+
+def subset_index(index, keep_ids, index_params):
+    """
+    Copy of an index holding only the vectors whose IDs are in keep_ids.
+    Indexes that support removal keep their training; HNSW graphs are rebuilt.
+    """
+    import faiss
+
+    keep_ids = np.ascontiguousarray(keep_ids, dtype=np.int64)
+    if supports_remove(index):
+        shard = faiss.clone_index(index)
+        keep = faiss.IDSelectorBatch(len(keep_ids), faiss.swig_ptr(keep_ids))
+        shard.remove_ids(faiss.IDSelectorNot(keep))
+        return shard
+
+    vectors = np.vstack([index.reconstruct(int(chunk_id)) for chunk_id in keep_ids]) \
+        if len(keep_ids) else np.zeros((0, index.d), dtype=np.float32)
+    shard = create_index(index.d, len(keep_ids), index_params)
+    if len(keep_ids):
+        shard.add_with_ids(vectors, keep_ids)
+    return shard
+
+
+def split_index(
+        index_path : str,
+        docs_path : str,
+        shards_dir : str,
+        num_shards : int
+    ):
+    """
+    Split an index and its chunk store into num_shards shards by case ID range.
+    Every shard directory holds a FAISS index with its manifest and a chunk store;
+    shards.json records the case ID boundaries. Returns the chunk count of each shard.
+    """
+    import faiss
+
+    assert isinstance(num_shards, int) and num_shards > 0, "num_shards must be a positive integer"
+
+    manifest = read_manifest(index_path)
+    index_params = manifest.get("index_params", {"index_type": "flat"})
+    # The full index is read into memory; removal needs a writable copy
+    index = faiss.read_index(index_path)
+    store = DocumentStore(docs_path)
+
+    live_ids = store.live_ids()
+    rows = np.searchsorted(store.ids, live_ids)
+    doc_ids = np.asarray(store.doc_ids[rows])
+    boundaries = case_boundaries(doc_ids, num_shards)
+    assignment = shard_of(doc_ids, boundaries)
+
+    shards = []
+    for number in range(num_shards):
+        name = f"shard-{number}"
+        shard_dir = os.path.join(shards_dir, name)
+        os.makedirs(shard_dir, exist_ok=True)
+        shard_rows = rows[assignment == number]
+        shard_ids = live_ids[assignment == number]
+
+        DocumentStore.write(
+            os.path.join(shard_dir, SHARD_DOCS_DIR_NAME),
+            shard_ids,
+            (store.chunk(row) for row in shard_rows.tolist()),
+            doc_ids[assignment == number]
+        )
+        shard_index_path = os.path.join(shard_dir, SHARD_INDEX_FILE_NAME)
+        faiss.write_index(subset_index(index, shard_ids, index_params), shard_index_path)
+        # Bump past any earlier split so running shards reload
+        write_manifest(shard_index_path, dict(manifest, generation=read_manifest(shard_index_path)["generation"] + 1))
+
+        shards.append({
+            "name": name,
+            "chunks": len(shard_ids),
+            "first_case_id": int(boundaries[number - 1]) if number > 0 else None
+        })
+
+    tmp_path = os.path.join(shards_dir, SHARDS_FILE_NAME + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({"key": "case_id", "boundaries": boundaries.tolist(), "shards": shards}, f, indent=2)
+    os.replace(tmp_path, os.path.join(shards_dir, SHARDS_FILE_NAME))
+    return [shard["chunks"] for shard in shards]
+
+
+def merge_results(results, top_k):
+    """
+    Merge per-shard (chunk IDs, distances, chunks, case IDs) lists into the global top_k.
+    Distances are L2, so smaller is better.
+    Returns (chunk IDs, chunks, case IDs).
+    """
+    best = heapq.nsmallest(
+        top_k,
+        (entry for ids, distances, chunks, doc_ids in results for entry in zip(distances, ids, chunks, doc_ids)),
+        key=lambda entry: entry[0]
+    )
+    return [entry[1] for entry in best], [entry[2] for entry in best], [entry[3] for entry in best]
+
+
+class Shard:
+    def __init__(
+            self,
+            shard_dir : str,
+            search_params : dict = SEARCH_PARAMS,
+            mmap_index : bool = True
+        ):
+        """
+        One shard searched in this process: a FAISS index and the chunk store of its cases.
+        """
+        assert os.path.isdir(shard_dir), f"Shard not found at {shard_dir}"
+
+        self.shard_dir = shard_dir
+        self.index_path = os.path.join(shard_dir, SHARD_INDEX_FILE_NAME)
+        self.docs_path = os.path.join(shard_dir, SHARD_DOCS_DIR_NAME)
+        self.search_params = dict(SEARCH_PARAMS, **search_params)
+        self.mmap_index = mmap_index
+        self._load_generation()
+
+    def _manifest_stamp(self):
+        try:
+            stat = os.stat(manifest_path_for(self.index_path))
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load_generation(self):
+        stamp = self._manifest_stamp()
+        generation = read_manifest(self.index_path)["generation"]
+        index = read_index(self.index_path, self.mmap_index)
+        set_search_params(index, **self.search_params)
+        store = DocumentStore(self.docs_path)
+        self.index, self.store, self.generation, self._stamp = index, store, generation, stamp
+
+    def reload_if_changed(self):
+        if self._manifest_stamp() == self._stamp:
+            return False
+        self._load_generation()
+        return True
+
+    def search(self, query_embeddings, top_k):
+        """
+        Search the shard. Returns per query (chunk IDs, distances, chunks, case IDs)
+        of its top_k live chunks, best first, as plain Python values.
+        """
+        index, store = self.index, self.store
+        # Over-fetch to skip chunks deleted since the last compaction
+        k = min(top_k + len(store.deleted), index.ntotal)
+        if k == 0:
+            return [([], [], [], []) for _ in range(len(query_embeddings))]
+
+        distances, ids = index.search(query_embeddings, k)
+        results = []
+        for row_distances, row_ids in zip(distances.tolist(), ids.tolist()):
+            found = ([], [], [], [])
+            for distance, chunk_id in zip(row_distances, row_ids):
+                entry = None if chunk_id < 0 else store.get(chunk_id)
+                if entry is None:
+                    continue
+                for values, value in zip(found, (chunk_id, distance) + entry):
+                    values.append(value)
+                if len(found[0]) == top_k:
+                    break
+            results.append(found)
+        return results
+
+    def close(self):
+        self.store.close()
+
+
+def _recv_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        part = sock.recv(size - len(data))
+        if not part:
+            raise ConnectionError("Shard connection closed")
+        data += part
+    return bytes(data)
+
+
+def send_frame(sock, data):
+    sock.sendall(struct.pack(">I", len(data)) + data)
+
+
+def recv_frame(sock):
+    size, = struct.unpack(">I", _recv_exact(sock, 4))
+    return _recv_exact(sock, size)
+
+
+class _ShardRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        """
+        Serve requests on one connection until the client closes it. A request is a JSON
+        header frame followed by a frame of float32 query embeddings; the response is JSON.
+        """
+        sock = self.request
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        shard = self.server.shard
+        while True:
+            try:
+                header = json.loads(recv_frame(sock))
+                data = recv_frame(sock)
+            except ConnectionError:
+                return
+            try:
+                queries = np.frombuffer(data, dtype=np.float32).reshape(header["rows"], header["dim"])
+                shard.reload_if_changed()
+                response = {"generation": shard.generation, "results": shard.search(queries, header["top_k"])}
+            except Exception as e:
+                response = {"error": repr(e)}
+            send_frame(sock, json.dumps(response).encode('utf-8'))
+
+
+class ShardServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, shard, host="127.0.0.1", port=SHARD_SERVER_PORT):
+        """
+        Serve one Shard over TCP, one thread per client connection.
+        """
+        self.shard = shard
+        super().__init__((host, port), _ShardRequestHandler)
+
+
+class RemoteShard:
+    def __init__(
+            self,
+            address : str,
+            timeout : float = SHARD_PARAMS["timeout"]
+        ):
+        """
+        Client of a ShardServer at 'host:port'. Idle connections are kept for reuse.
+        """
+        host, port = address.rsplit(":", 1)
+        self.address = (host, int(port))
+        self.timeout = timeout
+        self.generation = 0
+        self.connections = queue.SimpleQueue()
+
+    def _request(self, sock, query_embeddings, top_k):
+        header = {"top_k": top_k, "rows": query_embeddings.shape[0], "dim": query_embeddings.shape[1]}
+        send_frame(sock, json.dumps(header).encode('utf-8'))
+        send_frame(sock, query_embeddings.tobytes())
+        return json.loads(recv_frame(sock))
+
+    def search(self, query_embeddings, top_k):
+        try:
+            sock, pooled = self.connections.get_nowait(), True
+        except queue.Empty:
+            sock, pooled = None, False
+
+        try:
+            try:
+                if sock is None:
+                    sock = socket.create_connection(self.address, timeout=self.timeout)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                response = self._request(sock, query_embeddings, top_k)
+            except socket.timeout:
+                raise
+            except OSError:
+                if not pooled:
+                    raise
+                # The server closed an idle connection, e.g. on restart; retry on a new one
+                sock.close()
+                sock = socket.create_connection(self.address, timeout=self.timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                response = self._request(sock, query_embeddings, top_k)
+        except BaseException:
+            if sock is not None:
+                sock.close()
+            raise
+
+        self.connections.put(sock)
+        if "error" in response:
+            raise ShardError(f"Shard at {self.address[0]}:{self.address[1]}: {response['error']}")
+        self.generation = response["generation"]
+        return [tuple(result) for result in response["results"]]
+
+    def reload_if_changed(self):
+        # Shard servers pick up new generations themselves
+        return False
+
+    def close(self):
+        while True:
+            try:
+                self.connections.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ShardedIndex:
+    def __init__(
+            self,
+            shards : list,
+            shard_params : dict = SHARD_PARAMS
+        ):
+        """
+        Scatter-gather search over shards (Shard or RemoteShard). Queries fan out to every
+        shard from a thread pool and the per-shard top-k lists are merged into a global top-k.
+        """
+        assert shards, "Need at least one shard"
+
+        self.shards = shards
+        self.params = dict(SHARD_PARAMS, **shard_params)
+        self.executors = [
+            ThreadPoolExecutor(max_workers=self.params["threads_per_shard"], thread_name_prefix=f"shard{number}")
+            for number in range(len(shards))
+        ]
+        self.in_flight = [0] * len(shards)
+        self.lock = threading.Lock()
+        self.failures = [0] * len(shards)
+        self.timeouts = [0] * len(shards)
+        self.partial_results = 0
+
+    @classmethod
+    def open(
+            cls,
+            shards_dir : str,
+            shard_params : dict = SHARD_PARAMS,
+            search_params : dict = SEARCH_PARAMS,
+            mmap_index : bool = True
+        ):
+        """
+        Search the shards written by split_index with threads in this process.
+        """
+        with open(os.path.join(shards_dir, SHARDS_FILE_NAME), 'r') as f:
+            layout = json.load(f)
+        return cls([Shard(os.path.join(shards_dir, shard["name"]), search_params, mmap_index) for shard in layout["shards"]], shard_params)
+
+    @classmethod
+    def connect(
+            cls,
+            addresses : list,
+            shard_params : dict = SHARD_PARAMS
+        ):
+        """
+        Search shard servers at 'host:port' addresses.
+        """
+        params = dict(SHARD_PARAMS, **shard_params)
+        return cls([RemoteShard(address, params["timeout"]) for address in addresses], params)
+
+    @property
+    def generation(self):
+        """
+        Sum of the shard generations; it grows whenever any shard moves to a new generation.
+        """
+        return sum(shard.generation for shard in self.shards)
+
+    def reload_if_changed(self):
+        return any([shard.reload_if_changed() for shard in self.shards])
+
+    def _submit(self, number, query_embeddings, top_k):
+        """
+        Search one shard on its own threads, or return None when they are all taken.
+        """
+        with self.lock:
+            if self.in_flight[number] >= self.params["threads_per_shard"]:
+                return None
+            self.in_flight[number] += 1
+        future = self.executors[number].submit(self.shards[number].search, query_embeddings, top_k)
+        future.add_done_callback(lambda _: self._release(number))
+        return future
+
+    def _release(self, number):
+        with self.lock:
+            self.in_flight[number] -= 1
+
+    def search(self, query_embeddings, top_k):
+        """
+        Search every shard and merge their results. Returns a ShardResults list with one
+        (chunk IDs, chunks, case IDs) triple per query. Shards that fail, miss the timeout
+        or are still busy with late searches are left out, and listed in its 'missing',
+        when allow_partial is set and at least min_shards answered; otherwise ShardError is raised.
+        """
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        missing, futures = {}, {}
+        for number in range(len(self.shards)):
+            future = self._submit(number, query_embeddings, top_k)
+            if future is None:
+                self.timeouts[number] += 1
+                missing[number] = "busy with searches that timed out"
+            else:
+                futures[future] = number
+        done, not_done = wait(futures, timeout=self.params["timeout"])
+
+        answered = []
+        for future in not_done:
+            future.cancel()
+            number = futures[future]
+            self.timeouts[number] += 1
+            missing[number] = f"timed out after {self.params['timeout']}s"
+        for future in done:
+            number = futures[future]
+            try:
+                answered.append(future.result())
+            except Exception as e:
+                self.failures[number] += 1
+                missing[number] = repr(e)
+
+        if missing:
+            errors = "; ".join(f"shard {number}: {reason}" for number, reason in sorted(missing.items()))
+            tracer.count("shard_failures", len(missing))
+            if not self.params["allow_partial"] or len(answered) < (self.params["min_shards"] or 1):
+                raise ShardError(errors)
+            self.partial_results += 1
+            logger.warning("Partial result from %d of %d shards: %s", len(answered), len(self.shards), errors)
+        merged = [merge_results([results[q] for results in answered], top_k) for q in range(len(query_embeddings))]
+        return ShardResults(merged, missing)
+
+    def stats(self):
+        return {
+            "shards": len(self.shards),
+            "failures": list(self.failures),
+            "timeouts": list(self.timeouts),
+            "in_flight": list(self.in_flight),
+            "partial_results": self.partial_results
+        }
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        for shard in self.shards:
+            shard.close()
+
+
+def start_shard_servers(
+        shards_dir : str,
+        base_port : int = SHARD_SERVER_PORT,
+        host : str = "127.0.0.1",
+        timeout : float = 120
+    ):
+    """
+    Start one local shard server process per shard on consecutive ports and wait until
+    each accepts connections. Returns (processes, 'host:port' addresses).
+    """
+    with open(os.path.join(shards_dir, SHARDS_FILE_NAME), 'r') as f:
+        layout = json.load(f)
+
+    processes, addresses = [], []
+    for number, shard in enumerate(layout["shards"]):
+        port = base_port + number
+        processes.append(subprocess.Popen([
+            sys.executable, os.path.abspath(__file__),
+            "--serve", os.path.join(shards_dir, shard["name"]),
+            "--host", host,
+            "--port", str(port)
+        ]))
+        addresses.append(f"{host}:{port}")
+
+    deadline = time.monotonic() + timeout
+    for process, address in zip(processes, addresses):
+        host_name, port = address.rsplit(":", 1)
+        while True:
+            try:
+                socket.create_connection((host_name, int(port)), timeout=1).close()
+                break
+            except OSError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    for other in processes:
+                        other.kill()
+                    raise RuntimeError(f"Shard server at {address} did not start")
+                time.sleep(0.2)
+    return processes, addresses
+
+
+def main():
+    from retriever import DOCS_FILE, INDEX_FILE, SHARDS_DIR
+
+    parser = argparse.ArgumentParser(description="Split the index into shards, or serve shards over TCP.")
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--split", type=int, metavar="NUM_SHARDS", help="Split the index by case ID range")
+    action.add_argument("--serve", metavar="SHARD_DIR", help="Serve one shard")
+    action.add_argument("--serve-all", metavar="SHARDS_DIR", help="Serve every shard, one local process each")
+    parser.add_argument("--index", default=INDEX_FILE)
+    parser.add_argument("--docs", default=DOCS_FILE)
+    parser.add_argument("--output", default=SHARDS_DIR, help="Shards directory written by --split")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=SHARD_SERVER_PORT)
+    parser.add_argument("--base-port", type=int, default=SHARD_SERVER_PORT, help="Port of the first shard with --serve-all")
+    args = parser.parse_args()
+
+    if args.split is not None:
+        start = time.perf_counter()
+        counts = split_index(args.index, args.docs, args.output, args.split)
+        print(f"{args.split} shards written to {args.output} in {time.perf_counter() - start:.1f}s, chunks per shard: {counts}")
+    elif args.serve is not None:
+        server = ShardServer(Shard(args.serve), args.host, args.port)
+        print(f"Serving {args.serve} on {args.host}:{args.port}")
+        server.serve_forever()
+    else:
+        processes, addresses = start_shard_servers(args.serve_all, args.base_port, args.host)
+        print(f"Shard servers: {' '.join(addresses)}")
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+
+
+if __name__ == "__main__":
+    main()
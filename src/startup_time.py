@@ -0,0 +1,82 @@
+# src/startup_time.py
+#python src/startup_time.py --mode both
+
+import argparse
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Dependencies that should only be imported when first used
+HEAVY_MODULES = ("torch", "transformers", "sentence_transformers", "faiss", "pandas", "nltk")
+STARTUP_QUESTION = "When are indemnity costs awarded instead of party and party costs?"
+
+
+def loaded_heavy_modules():
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def measure_startup(retrieval_only, question, top_k):
+    """
+    Time importing rag_system, constructing RAGSystem and the first search (and the first
+    answer unless retrieval-only). Runs in a fresh process so nothing is imported yet.
+    """
+    start = time.perf_counter()
+    import rag_system
+    imported = time.perf_counter()
+    at_import = loaded_heavy_modules()
+
+    rag = rag_system.RAGSystem(cache_params=None, retrieval_only=retrieval_only)
+    constructed = time.perf_counter()
+    at_construction = loaded_heavy_modules()
+
+    rag.retrieve(question, top_k=top_k)
+    searched = time.perf_counter()
+
+    result = {
+        "import": imported - start,
+        "construct": constructed - imported,
+        "first_search": searched - constructed,
+        "time_to_first_search": searched - start,
+        "first_answer": None,
+        "modules_at_import": at_import,
+        "modules_at_construction": at_construction
+    }
+    if not retrieval_only:
+        rag.answer_question(question, top_k=top_k)
+        result["first_answer"] = time.perf_counter() - searched
+    result["modules_at_end"] = loaded_heavy_modules()
+    return result
+
+
+def in_fresh_process(function, *args):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, *args).result()
+
+
+def main():
+    """
+    Report import time and time to first search of RAGSystem, retrieval-only and full.
+    """
+    parser = argparse.ArgumentParser(description="Measure the startup cost of RAGSystem.")
+    parser.add_argument("--mode", choices=("retrieval-only", "full", "both"), default="both")
+    parser.add_argument("--question", default=STARTUP_QUESTION)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    modes = ["retrieval-only", "full"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        result = in_fresh_process(measure_startup, mode == "retrieval-only", args.question, args.top_k)
+        print(f"\n{mode}")
+        print(f"  import rag_system:    {result['import']:.2f}s, loaded {', '.join(result['modules_at_import']) or 'no heavy modules'}")
+        print(f"  construct RAGSystem:  {result['construct']:.2f}s, loaded {', '.join(result['modules_at_construction']) or 'no heavy modules'}")
+        print(f"  first search:         {result['first_search']:.2f}s")
+        print(f"  time to first search: {result['time_to_first_search']:.2f}s")
+        if result["first_answer"] is not None:
+            print(f"  first answer:         {result['first_answer']:.2f}s (generator loaded on demand)")
+        print(f"  loaded at the end:    {', '.join(result['modules_at_end']) or 'no heavy modules'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,6 @@
 import os
 import sys
 from rag_system import RAGSystem
-import pandas as pd
 
 def load_rag_system(
 ):
@@ -33,8 +32,8 @@ def test_rag(rag, question, top_k=5):
         # Optionally, retrieve the documents for display
         retrieved_chunks, retrieved_doc_ids = rag.retriever.retrieve(question, top_k=top_k)
         
-        # Fetch the case titles from the dataframe
-        case_titles = rag.df.set_index('case_id').loc[retrieved_doc_ids]['case_title'].tolist()
+        # Fetch the case titles from the case store
+        case_titles = rag.cases.get_titles(retrieved_doc_ids)
         
         print(f"Generated Answer:\n{answer}\n")
         print(f"Retrieved Documents:")
@@ -0,0 +1,311 @@
+# src/update_index.py
+#python src/update_index.py add --csv new_judgments.csv
+#python src/update_index.py delete --case-ids 101 102
+#python src/update_index.py compact
+
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from ann_index import create_index, supports_remove
+from case_store import CaseStore
+from embedding_cache import CachedEmbedder, EMBEDDING_CACHE_DIR
+from inference_backend import BACKENDS
+from index_store import DocumentStore, read_manifest, write_manifest
+from lexical_index import LexicalIndex
+from preprocessing import (
+    CHUNK_MAX_LENGTH,
+    TokenChunker,
+    download_nltk_data,
+    prepare_cases,
+    preprocess_texts,
+    split_into_chunks
+)
+from retriever import (
+    INDEX_FILE,
+    DOCS_FILE,
+    PREPROCESSED_CSV_FILE,
+    CASES_DB_FILE,
+    LEXICAL_INDEX_DIR,
+    MODEL_NAME_RETRIEVER
+)
+
+UPDATE_PARAMS = {
+    "chunk_max_length": CHUNK_MAX_LENGTH,
+    "batch_size": 64
+}
+
+
+class IndexUpdater:
+    def __init__(
+            self,
+            index_path : str = INDEX_FILE,
+            docs_path : str = DOCS_FILE,
+            preprocessed_csv_path : str = PREPROCESSED_CSV_FILE,
+            cases_path : str = CASES_DB_FILE,
+            model_name : str = MODEL_NAME_RETRIEVER,
+            chunk_max_length : int = UPDATE_PARAMS["chunk_max_length"],
+            batch_size : int = UPDATE_PARAMS["batch_size"],
+            cache_dir : str = EMBEDDING_CACHE_DIR,
+            use_cache : bool = True,
+            backend : str = "torch",
+            lexical_path : str = LEXICAL_INDEX_DIR
+        ):
+        """
+        Initialize the updater that adds, replaces and deletes cases in an existing index.
+        Only one updater may run against an index at a time.
+        New cases are chunked like the build did, as recorded in the manifest; indexes built
+        before chunk_params were recorded use chunk_max_length-word chunks.
+        The BM25 index at lexical_path is rebuilt on compaction; until then, added chunks
+        are found by dense search only and deleted ones are skipped at lookup.
+        Adds and deletes are staged, then made visible by publish(): the FAISS index is
+        written once, then the chunk store commits, then the manifest, so Retrievers never
+        reload a half-updated generation.
+        """
+        assert isinstance(index_path, str), "Index path must be a string"
+        assert isinstance(docs_path, str), "Docs path must be a string"
+        assert os.path.exists(index_path), f"Index file not found at {index_path}"
+        assert os.path.exists(docs_path), f"Docs file not found at {docs_path}"
+
+        self.index_path = index_path
+        self.docs_path = docs_path
+        self.preprocessed_csv_path = preprocessed_csv_path
+        self.cases = CaseStore(cases_path, read_only=False)
+        self.chunk_max_length = chunk_max_length
+        self.lexical_path = lexical_path
+
+        self.index = self._load_index()
+        self.store = DocumentStore(docs_path)
+        self.manifest = read_manifest(index_path)
+        # The store commits before the manifest, so IDs of a committed add are never reused
+        self.manifest["next_id"] = max(self.manifest.get("next_id") or 0, self.store.max_id() + 1)
+        self.index_changed = False
+        self._drop_uncommitted()
+        self.embedder = CachedEmbedder(model_name, cache_dir, batch_size, use_cache, backend)
+        chunk_params = self.manifest.get("chunk_params", {"chunking": "words"})
+        if chunk_params["chunking"] == "tokens":
+            self.chunker = TokenChunker(model_name, chunk_params["max_tokens"], chunk_params["overlap"])
+        else:
+            self.chunker = None
+            self.chunk_max_length = chunk_params.get("max_length", chunk_max_length)
+
+    def _load_index(self):
+        """
+        Load the FAISS index, wrapping a positional index so its rows keep their numbers as IDs.
+        """
+        index = faiss.read_index(self.index_path)
+        if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexIVF)):
+            return index
+        vectors = index.reconstruct_n(0, index.ntotal)
+        id_index = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+        id_index.add_with_ids(vectors, np.arange(index.ntotal, dtype=np.int64))
+        return id_index
+
+    def _write_index(self):
+        tmp_path = self.index_path + '.tmp'
+        faiss.write_index(self.index, tmp_path)
+        os.replace(tmp_path, self.index_path)
+
+    def _drop_uncommitted(self):
+        """
+        Remove vectors whose chunks never reached the store: an update interrupted between
+        the index write and the store commit leaves them past the store's last ID.
+        """
+        first_id = self.manifest["next_id"]
+        if supports_remove(self.index):
+            removed = self.index.remove_ids(faiss.IDSelectorRange(first_id, np.iinfo(np.int64).max))
+        elif (faiss.vector_to_array(self.index.id_map) >= first_id).any():
+            removed = self._rebuild_without_deleted()
+        else:
+            removed = 0
+        if removed:
+            self.index_changed = True
+            print(f"Dropped {removed} vectors of an interrupted update")
+
+    def publish(self):
+        """
+        Write the FAISS index if it changed, commit the staged adds and deletes of the chunk
+        store, then bump the generation so running Retrievers reload. The manifest is
+        written last, once the index and the store are committed.
+        """
+        if self.index_changed:
+            self._write_index()
+            self.index_changed = False
+        self.store.commit()
+        self.manifest["generation"] += 1
+        write_manifest(self.index_path, self.manifest)
+
+    def delete_cases(
+            self,
+            case_ids,
+            publish : bool = True
+        ):
+        """
+        Mark every chunk of the given cases as deleted. Rows stay in FAISS until compact() runs.
+        Returns the number of chunks deleted.
+        """
+        case_ids = [int(case_id) for case_id in case_ids]
+        chunk_ids = self.store.ids_for_cases(case_ids)
+        self.store.delete(chunk_ids, case_ids, commit=False)
+        self.cases.delete(case_ids)
+        if publish:
+            self.publish()
+        return len(chunk_ids)
+
+    def add_cases(
+            self,
+            df,
+            publish : bool = True
+        ):
+        """
+        Add the cases of a raw CSV slice, replacing the chunks of any case ID that is already indexed.
+        With publish=False the change is staged until a later publish(), so several slices
+        share one write of the FAISS index.
+        Returns the number of chunks added.
+        """
+        download_nltk_data()
+        df = preprocess_texts(prepare_cases(df))
+
+        # Replace: existing chunks of these cases are deleted first
+        self.delete_cases(df['case_id'].tolist(), publish=False)
+
+        chunks, doc_ids, lengths = [], [], None
+        if self.chunker is None:
+            for case_id, text in zip(df['case_id'], df['cleaned_text']):
+                case_chunks = split_into_chunks(text, self.chunk_max_length)
+                chunks.extend(case_chunks)
+                doc_ids.extend([int(case_id)] * len(case_chunks))
+        else:
+            lengths = []
+            case_chunks, case_lengths = self.chunker.split_many(df['cleaned_text'].tolist())
+            for case_id, chunks_of_case, lengths_of_case in zip(df['case_id'], case_chunks, case_lengths):
+                chunks.extend(chunks_of_case)
+                lengths.extend(lengths_of_case)
+                doc_ids.extend([int(case_id)] * len(chunks_of_case))
+
+        first_id = self.manifest["next_id"]
+        chunk_ids = list(range(first_id, first_id + len(chunks)))
+        if chunks:
+            embeddings = self.embedder.embed(chunks, lengths)
+            self.index.add_with_ids(embeddings, np.array(chunk_ids, dtype=np.int64))
+            self.index_changed = True
+        self.store.add(chunk_ids, chunks, doc_ids, df['case_id'].tolist(), commit=False)
+        self.manifest["next_id"] = first_id + len(chunks)
+
+        self.cases.upsert(df)
+
+        # Append the new cases to the preprocessed CSV; stale rows are dropped on compaction
+        if os.path.exists(self.preprocessed_csv_path):
+            df.to_csv(self.preprocessed_csv_path, mode='a', header=False, index=False)
+
+        if publish:
+            self.publish()
+        return len(chunks)
+
+    def _rebuild_without_deleted(self):
+        """
+        Rebuild an index that cannot remove vectors (HNSW) from its live vectors.
+        Returns the number of vectors dropped.
+        """
+        live_ids = self.store.live_ids()
+        vectors = np.vstack([self.index.reconstruct(int(chunk_id)) for chunk_id in live_ids]) \
+            if len(live_ids) else np.zeros((0, self.index.d), dtype=np.float32)
+
+        index = create_index(self.index.d, len(live_ids), self.manifest.get("index_params", {"index_type": "hnsw"}))
+        if len(live_ids):
+            index.add_with_ids(vectors, live_ids)
+        removed = self.index.ntotal - index.ntotal
+        self.index = index
+        return removed
+
+    def compact(self):
+        """
+        Physically remove deleted chunks from the FAISS index, the chunk store and the preprocessed CSV,
+        and rebuild the BM25 index over the live chunks.
+        Returns the number of rows removed from the index.
+        """
+        deleted_ids = np.array(sorted(self.store.deleted), dtype=np.int64)
+        deleted_case_ids = set(self.store.deleted_case_ids)
+
+        removed = 0
+        if len(deleted_ids):
+            if supports_remove(self.index):
+                removed = self.index.remove_ids(faiss.IDSelectorBatch(deleted_ids))
+            else:
+                removed = self._rebuild_without_deleted()
+            self.index_changed = True
+        # The index is written before the store switches, as in publish()
+        if self.index_changed:
+            self._write_index()
+            self.index_changed = False
+        self.store.compact()
+        if os.path.isdir(self.lexical_path):
+            LexicalIndex.write_from_store(self.lexical_path, self.store)
+
+        # Keep the latest row of each case and drop deleted cases
+        if os.path.exists(self.preprocessed_csv_path):
+            df = pd.read_csv(self.preprocessed_csv_path)
+            df = df.drop_duplicates(subset='case_id', keep='last')
+            df = df[~df['case_id'].isin(deleted_case_ids)]
+            tmp_path = self.preprocessed_csv_path + '.tmp'
+            df.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, self.preprocessed_csv_path)
+
+        self.publish()
+        return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add, replace or delete cases in the FAISS index without a full rebuild.")
+    parser.add_argument("--index", default=INDEX_FILE, help="FAISS index path")
+    parser.add_argument("--docs", default=DOCS_FILE, help="Chunk store directory")
+    parser.add_argument("--preprocessed-csv", default=PREPROCESSED_CSV_FILE, help="Preprocessed CSV path")
+    parser.add_argument("--cases", default=CASES_DB_FILE, help="Case store path")
+    parser.add_argument("--model", default=MODEL_NAME_RETRIEVER, help="Sentence embedding model")
+    parser.add_argument("--cache-dir", default=EMBEDDING_CACHE_DIR, help="Embedding cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="Embed every chunk without the embedding cache")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="Inference backend of the embedding model")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Add or replace the cases of raw CSVs")
+    add_parser.add_argument("--csv", nargs="+", required=True, help="CSVs with the legal_text_classification.csv columns")
+
+    delete_parser = subparsers.add_parser("delete", help="Delete cases by case_id")
+    delete_parser.add_argument("--case-ids", nargs="+", required=True)
+
+    subparsers.add_parser("compact", help="Remove deleted rows from the index and documents")
+    args = parser.parse_args()
+
+    updater = IndexUpdater(
+        index_path=args.index,
+        docs_path=args.docs,
+        preprocessed_csv_path=args.preprocessed_csv,
+        cases_path=args.cases,
+        model_name=args.model,
+        cache_dir=args.cache_dir,
+        use_cache=not args.no_cache,
+        backend=args.backend
+    )
+
+    start = time.perf_counter()
+    if args.command == "add":
+        count = sum(updater.add_cases(pd.read_csv(path), publish=False) for path in args.csv)
+        updater.publish()
+        print(f"Added {count} chunks")
+        if updater.embedder.cache is not None:
+            print(updater.embedder.cache.report())
+    elif args.command == "delete":
+        count = updater.delete_cases([case_id.replace('Case', '') for case_id in args.case_ids])
+        print(f"Deleted {count} chunks")
+    else:
+        count = updater.compact()
+        print(f"Compacted {count} deleted rows")
+    print(f"Generation {updater.manifest['generation']} published in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# src/test_chunker.py
+
+import os
+import sys
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from preprocessing import TokenChunker
+from retriever import MODEL_NAME_RETRIEVER
+
+def make_chunker(window, overlap):
+    """
+    A TokenChunker with the given window, without loading a tokenizer.
+    """
+    chunker = TokenChunker.__new__(TokenChunker)
+    chunker.window, chunker.overlap = window, overlap
+    return chunker
+
+def check_windows(chunker, word_ids):
+    """
+    Windows cover every token in order, fit the window, make progress, overlap from the
+    start of a word, and end on a word boundary unless a single word fills the window.
+    """
+    windows = chunker.windows(word_ids)
+    num_tokens = len(word_ids)
+    if not num_tokens:
+        assert windows == [], "An empty text produced chunks"
+        return windows
+    assert windows[0][0] == 0 and windows[-1][1] == num_tokens, f"Windows {windows} do not cover the text"
+    for (start, end), (next_start, next_end) in zip(windows, windows[1:]):
+        assert start < next_start <= end < next_end, f"Windows {windows} skip tokens or make no progress"
+        # The overlap is rounded back to the start of a word, or dropped
+        overlap_word = word_ids[max(end - chunker.overlap, start + 1)]
+        assert next_start == end or word_ids[next_start] == overlap_word != word_ids[next_start - 1], \
+            f"Windows {windows} do not overlap by about {chunker.overlap} tokens from a word start"
+    for start, end in windows:
+        assert 0 < end - start <= chunker.window, f"Window {(start, end)} does not fit {chunker.window} tokens"
+        word_fills_window = word_ids[start] == word_ids[end - 1]
+        if end < num_tokens and not word_fills_window:
+            assert word_ids[end] != word_ids[end - 1], f"Window {(start, end)} cuts a word in two"
+    return windows
+
+def main():
+    """
+    Check TokenChunker.windows on synthetic word maps, including words longer than the
+    window, then chunk real text with the retriever's tokenizer.
+    """
+    # Word of every token: words of 1 to 3 tokens, and one word of 12 tokens
+    lengths = [1, 2, 1, 3, 1, 1, 2, 12, 1, 2, 3, 1, 1, 1, 2]
+    word_ids = [word for word, length in enumerate(lengths) for _ in range(length)]
+    for window, overlap in ((8, 0), (8, 3), (5, 4), (16, 6), (64, 10)):
+        windows = check_windows(make_chunker(window, overlap), word_ids)
+        print(f"window {window}, overlap {overlap}: {windows}")
+    check_windows(make_chunker(8, 3), [])
+    check_windows(make_chunker(8, 3), [0] * 30)
+
+    chunker = TokenChunker(MODEL_NAME_RETRIEVER, max_tokens=32, overlap=8)
+    texts = ["The applicant filed further affidavit material in support of the application. " * 20, "Short text.", ""]
+    chunks, chunk_lengths = chunker.split_many(texts)
+    assert len(chunks) == 3 and chunks[2] == [] and chunks[1] == ["Short text."], f"Unexpected chunks {chunks[1:]}"
+    for chunk, length in zip(chunks[0], chunk_lengths[0]):
+        assert length <= 32 and len(chunker.tokenizer(chunk)['input_ids']) == length, f"Chunk of {length} tokens: {chunk}"
+    print(f"{len(chunks[0])} chunks of at most 32 tokens")
+    print("Chunker tests pass")
+
+if __name__ == "__main__":
+    main()
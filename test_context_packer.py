@@ -0,0 +1,54 @@
+# src/test_context_packer.py
+
+import os
+import sys
+
+from transformers import AutoTokenizer
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from context_packer import ContextPacker
+from generator import MODEL_NAME_GENERATOR
+
+QUESTION = "When are indemnity costs awarded instead of party and party costs?"
+CHUNKS = [
+    "A departure from normal practice to award indemnity costs requires some special or unusual feature in the case.",
+    "A departure from normal practice to award indemnity costs requires some special or unusual feature in the case. Costs.",
+    "Ordinarily costs follow the event and are awarded on a party and party basis.",
+    "A departure from normal practice to award indemnity costs requires some special or unusual feature in the case.",
+    "Indemnity costs may be awarded where a party has acted unreasonably in refusing an offer of compromise. " * 4
+]
+
+def main():
+    """
+    Check that packed contexts stay within the token budget, skip exact and near
+    duplicates, cut the last chunk only when enough budget remains, and follow order_keys.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME_GENERATOR)
+    count = lambda text: len(tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    packer = ContextPacker(tokenizer, max_context_tokens=1000)
+    packed = packer.pack(QUESTION, CHUNKS, [10, 11, 12, 13, 14], [1, 1, 2, 1, 3])
+    assert packed.chunk_ids == [10, 12, 14], f"Duplicates were not skipped: {packed.chunk_ids}"
+    assert packed.doc_ids == [1, 2, 3] and packed.dropped_ids == [11, 13]
+    print(f"dedup: kept {packed.chunk_ids}, dropped {packed.dropped_ids}")
+
+    # A budget that fits the first chunk and part of the second
+    first = count(CHUNKS[0])
+    for budget, cut_expected in ((first + 40, True), (first + 10, False)):
+        packed = ContextPacker(tokenizer, max_context_tokens=budget, min_partial_tokens=32).pack(QUESTION, [CHUNKS[0], CHUNKS[4]])
+        assert packed.token_count <= budget and count(packed.text) <= budget + 1, f"Budget {budget} exceeded: {packed.token_count}"
+        assert packed.chunk_ids == ([0, 1] if cut_expected else [0]), f"Budget {budget}: unexpected chunks {packed.chunk_ids}"
+        print(f"budget {budget}: {packed.token_count} tokens, chunks {packed.chunk_ids}")
+    assert packer.budget(QUESTION) <= 1000
+
+    # Chunks are chosen in rank order but joined in key order
+    packed = packer.pack(QUESTION, [CHUNKS[2], CHUNKS[0]], ["b", "a"], order_keys=[(1, 5), (0, 9)])
+    assert packed.chunk_ids == ["a", "b"] and packed.text.startswith(CHUNKS[0]), f"order_keys were ignored: {packed.chunk_ids}"
+    packed = ContextPacker(tokenizer, max_context_tokens=first).pack(QUESTION, [CHUNKS[0], CHUNKS[2]], order_keys=[(1,), (0,)])
+    assert packed.chunk_ids == [0], "order_keys changed which chunks fit the budget"
+    print("Context packer tests pass")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# src/test_embedding_cache.py
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from embedding_cache import CachedEmbedder, EmbeddingCache, chunk_digest
+
+CHUNKS = [
+    "Ordinarily costs follow the event and are awarded on a party and party basis.",
+    "The test for apparent bias is whether a fair-minded lay observer might reasonably apprehend bias.",
+    "A patent gives its owner the exclusive right to exploit an invention."
+]
+
+def test_cache(cache_dir):
+    """
+    Hits and misses are counted per digest, rows survive reopening, and rows appended
+    without a committed row count are discarded.
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((3, 8)).astype(np.float32)
+    digests = [chunk_digest(chunk) for chunk in CHUNKS]
+
+    cache = EmbeddingCache(cache_dir, "test-model")
+    assert cache.lookup(digests).tolist() == [-1, -1, -1] and cache.misses == 3, "An empty cache reported hits"
+    cache.add(digests[:2], vectors[:2])
+    rows = cache.lookup(digests)
+    assert rows.tolist() == [0, 1, -1] and cache.hits == 2, f"Unexpected rows {rows}"
+    assert np.array_equal(cache.vectors()[rows[:2]], vectors[:2]), "Cached vectors differ from the added ones"
+
+    # An append interrupted before its row count was committed
+    with open(cache.vectors_path, 'ab') as f:
+        f.write(vectors[2].tobytes())
+    with open(cache.keys_path, 'ab') as f:
+        f.write(digests[2])
+
+    reopened = EmbeddingCache(cache_dir, "test-model")
+    assert reopened.rows == 2 and reopened.lookup(digests).tolist() == [0, 1, -1], "Uncommitted rows were kept"
+    assert os.path.getsize(reopened.vectors_path) == 2 * 8 * 4, "Uncommitted bytes were not truncated"
+    assert np.array_equal(reopened.vectors(), vectors[:2]), "Reopened vectors differ"
+
+    other = EmbeddingCache(cache_dir, "other-model")
+    assert other.rows == 0 and other.dir != reopened.dir, "Caches of different models must not share rows"
+    print(f"cache: {reopened.report()}")
+
+def test_embedder(cache_dir):
+    """
+    Embeddings read from the cache equal freshly encoded ones, and repeated or duplicate
+    chunks are encoded once.
+    """
+    uncached = CachedEmbedder(use_cache=False).embed(CHUNKS)
+    embedder = CachedEmbedder(cache_dir=cache_dir)
+    first = embedder.embed(CHUNKS[:2] + CHUNKS[:1])
+    assert embedder.cache.rows == 2, "A duplicate chunk was encoded twice"
+    second = embedder.embed(CHUNKS)
+    assert embedder.cache.rows == 3 and embedder.cache.hits == 2, f"Unexpected cache state: {embedder.cache.report()}"
+
+    assert np.allclose(first, uncached[[0, 1, 0]], atol=1e-5), "Embeddings computed through the cache differ"
+    assert np.allclose(second, uncached, atol=1e-5), "Embeddings read from the cache differ"
+    assert np.array_equal(CachedEmbedder(cache_dir=cache_dir).embed(CHUNKS), second), "A reopened cache returned other vectors"
+    print(f"embedder: {embedder.cache.report()}")
+
+def main():
+    """
+    Run the embedding cache tests in a temporary directory.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        test_cache(os.path.join(root, "cache"))
+        test_embedder(os.path.join(root, "embedder"))
+    print("Embedding cache tests pass")
+
+if __name__ == "__main__":
+    main()
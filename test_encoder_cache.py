@@ -0,0 +1,70 @@
+# src/test_encoder_cache.py
+
+import os
+import sys
+import time
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from generator import Generator
+
+QUESTIONS = [
+    "When are indemnity costs awarded instead of party and party costs in court proceedings?",
+    "What criteria are used to assess apparent bias in judicial decisions?",
+    "How does intellectual property law protect inventions?"
+]
+CONTEXTS = [
+    "Ordinarily that discretion will be exercised so that costs follow the event and are awarded on a party and party basis. "
+    "A departure from normal practice to award indemnity costs requires some special or unusual feature in the case.",
+    "The test for apparent bias is whether a fair-minded lay observer might reasonably apprehend that the judge might not "
+    "bring an impartial and unprejudiced mind to the resolution of the question the judge is required to decide.",
+    "A patent gives its owner the exclusive right to exploit an invention for the term of the patent, in exchange for "
+    "disclosing the invention to the public."
+]
+
+# Prompts of very different lengths, so batches pad the short ones heavily
+MIXED_CONTEXTS = [CONTEXTS[0] * 8, CONTEXTS[1], CONTEXTS[2] * 3]
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    """
+    Answers generated with the encoder cache must equal uncached answers for every
+    generation profile, for single prompts and for mixed-length batches; repeated
+    prompts should be faster.
+    """
+    uncached = Generator(encoder_cache_params=None)
+    cached = Generator(model=uncached.model, tokenizer=uncached.tokenizer)
+
+    for profile in ("fast", "balanced", "quality"):
+        for question, context in zip(QUESTIONS, CONTEXTS):
+            expected, uncached_time = timed(uncached.generate_answer, question, context, profile=profile)
+            first, miss_time = timed(cached.generate_answer, question, context, profile=profile)
+            second, hit_time = timed(cached.generate_answer, question, context, profile=profile)
+            assert first == expected, f"{profile}: answer computed through the cache differs from uncached generation"
+            assert second == expected, f"{profile}: answer from cached encoder states differs from uncached generation"
+        print(f"{profile}: uncached {uncached_time * 1000:.0f} ms, miss {miss_time * 1000:.0f} ms, hit {hit_time * 1000:.0f} ms")
+
+    # Mixed-length batches, and mini-batches of one prompt that reuse the cache
+    for profile in ("fast", "balanced", "quality"):
+        expected = uncached.generate_answers(QUESTIONS, MIXED_CONTEXTS, profile=profile)
+        batch_first = cached.generate_answers(QUESTIONS, MIXED_CONTEXTS, profile=profile)
+        batch_second = cached.generate_answers(QUESTIONS, MIXED_CONTEXTS, profile=profile)
+        assert batch_first == expected, f"{profile}: batched answers differ from uncached generation"
+        assert batch_second == expected, f"{profile}: repeated batched answers differ from uncached generation"
+        singles = cached.generate_answers(QUESTIONS, MIXED_CONTEXTS, batch_size=1, profile=profile)
+        assert singles == uncached.generate_answers(QUESTIONS, MIXED_CONTEXTS, batch_size=1, profile=profile), \
+            f"{profile}: answers of one-prompt mini-batches differ from uncached generation"
+        print(f"{profile}: mixed batch of {len(QUESTIONS)} prompts equal to uncached generation")
+
+    stats = cached.encoder_cache.stats()
+    assert stats["hits"] > 0 and stats["bytes"] <= stats["max_bytes"], f"Unexpected cache stats {stats}"
+    print(f"encoder cache: {stats}")
+    print("Encoder cache tests pass")
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,8 @@
 
 import os
 import sys
-from src.generator import Generator
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from generator import Generator
 import torch
 
 def load_generator():
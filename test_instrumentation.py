@@ -0,0 +1,70 @@
+# src/test_instrumentation.py
+
+import contextvars
+import os
+import sys
+import threading
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from instrumentation import Sink, tracer
+
+class CollectSink(Sink):
+    def __init__(self):
+        self.traces = []
+
+    def on_trace(self, trace):
+        self.traces.append(trace)
+
+def generate():
+    with tracer.span("generate"):
+        pass
+
+def stream():
+    """
+    A streamed answer: spans in the iterator and in a worker thread it starts.
+    """
+    with tracer.span("retrieve"):
+        pass
+    yield "first "
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(generate,))
+    worker.start()
+    worker.join()
+    tracer.count("output_tokens", 2)
+    yield "second"
+
+def main():
+    """
+    Check that a traced iterator collects the spans of its steps and of the threads they
+    start, while the caller's context stays outside the trace between steps.
+    """
+    sink = CollectSink()
+    tracer.configure(sinks=[sink])
+    try:
+        pieces = []
+        for piece in tracer.trace_iter("answer_question_stream", stream(), top_k=5):
+            with tracer.span("caller"):
+                pieces.append(piece)
+        assert pieces == ["first ", "second"]
+        assert len(sink.traces) == 1, f"Expected one trace, got {len(sink.traces)}"
+        trace = sink.traces[0]
+        assert [name for name, _, _ in trace.spans] == ["retrieve", "generate"], f"Unexpected spans {trace.spans}"
+        assert trace.counters == {"output_tokens": 2} and trace.attributes == {"top_k": 5}
+
+        # An iterator closed early still finishes its trace
+        iterator = tracer.trace_iter("answer_question_stream", stream())
+        next(iterator)
+        iterator.close()
+        assert len(sink.traces) == 2 and sink.traces[1].duration is not None, "A closed stream left its trace open"
+        print(sink.traces[0].summary())
+    finally:
+        tracer.configure(enabled=False)
+
+    # Disabled, the iterator is returned as is
+    iterator = iter([1])
+    assert tracer.trace_iter("answer_question_stream", iterator) is iterator
+    print("Instrumentation tests pass")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# src/test_lexical_index.py
+
+import os
+import sys
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from lexical_index import BM25_PARAMS, LexicalIndex, varint_decode, varint_encode
+
+VOCABULARY = ["costs", "indemnity", "party", "bias", "judge", "patent", "invention", "appeal", "court", "order"]
+
+def bm25(chunks, terms, k1=BM25_PARAMS["k1"], b=BM25_PARAMS["b"]):
+    """
+    Brute-force BM25 score of every chunk for the query terms.
+    """
+    docs = [Counter(chunk.split()) for chunk in chunks]
+    lengths = [len(chunk.split()) for chunk in chunks]
+    avgdl = sum(lengths) / len(lengths)
+    scores = np.zeros(len(chunks))
+    for term in set(terms):
+        df = sum(term in doc for doc in docs)
+        if not df:
+            continue
+        idf = np.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+        for row, doc in enumerate(docs):
+            tf = doc[term]
+            scores[row] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[row] / avgdl))
+    return scores
+
+def test_varint():
+    """
+    Values of every encoded length round-trip, and small values take one byte.
+    """
+    rng = np.random.default_rng(0)
+    values = np.concatenate((
+        [0, 1, 127, 128, 16383, 16384, (1 << 35) - 1, 1 << 35, (1 << 42) - 1],
+        rng.integers(0, 1 << 40, 1000)
+    )).astype(np.int64)
+    data, num_bytes = varint_encode(values)
+    assert np.array_equal(varint_decode(data), values), "Varint round trip changed values"
+    assert num_bytes[:4].tolist() == [1, 1, 1, 2] and len(data) == num_bytes.sum(), f"Unexpected lengths {num_bytes[:4]}"
+    assert len(varint_decode(varint_encode([])[0])) == 0, "Empty input did not round-trip"
+    print(f"varint: {len(values)} values in {len(data)} bytes")
+
+def test_bm25(index_dir):
+    """
+    Scores of the index equal brute-force BM25, and id_mask removes rows before the top_k cut.
+    """
+    rng = np.random.default_rng(1)
+    chunks = [' '.join(rng.choice(VOCABULARY, rng.integers(3, 40))) for _ in range(500)]
+    ids = np.arange(500, dtype=np.int64) * 3 + 7
+    LexicalIndex.write(index_dir, ids, chunks)
+    index = LexicalIndex(index_dir)
+
+    for terms in (["indemnity", "costs"], ["patent"], ["bias", "bias", "judge", "unknown"]):
+        expected = bm25(chunks, terms)
+        found, scores = index.search_terms(terms, top_k=20)
+        best = np.argsort(-expected, kind='stable')[:20]
+        assert np.allclose(scores, expected[best], rtol=1e-5), f"{terms}: scores differ from brute-force BM25"
+        assert np.allclose(expected[(found - 7) // 3], scores, rtol=1e-5), f"{terms}: IDs do not match their scores"
+
+        mask = np.zeros(ids.max() + 1, dtype=bool)
+        mask[ids[::2]] = True
+        filtered, filtered_scores = index.search_terms(terms, top_k=20, id_mask=mask)
+        even = np.flatnonzero(expected > 0)
+        even = even[even % 2 == 0]
+        assert len(filtered) == min(20, len(even)) and mask[filtered].all(), f"{terms}: id_mask was not applied before top_k"
+        assert np.allclose(filtered_scores, np.sort(expected[even])[::-1][:20], rtol=1e-5), f"{terms}: filtered scores differ"
+    assert len(index.search_terms(["unknown"])[0]) == 0, "A term outside the vocabulary matched"
+    print(f"bm25: {len(index)} chunks, {index.num_terms} terms")
+
+def main():
+    """
+    Run the lexical index tests.
+    """
+    test_varint()
+    with tempfile.TemporaryDirectory() as root:
+        test_bm25(os.path.join(root, "lexical"))
+    print("Lexical index tests pass")
+
+if __name__ == "__main__":
+    main()
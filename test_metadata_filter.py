@@ -0,0 +1,83 @@
+# src/test_metadata_filter.py
+
+import os
+import sys
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from ann_index import create_index, search_filtered, set_search_params, train_index
+from index_store import DocumentStore
+from metadata_index import MetadataIndex
+
+NUM_CHUNKS = 20000
+NUM_CASES = 2000
+DIM = 32
+TOP_K = 10
+OUTCOMES = ("cited", "followed", "applied", "referred to", "distinguished")
+
+def exact_filtered(vectors, mask, queries, k):
+    """
+    Brute-force top-k over the selected vectors.
+    """
+    selected = np.flatnonzero(mask)
+    _, rows = faiss.knn(queries, vectors[selected], k)
+    return [selected[row[row >= 0]].tolist() for row in rows]
+
+def main():
+    """
+    Check that filtered FAISS searches return the exact filtered top-k, for a broad filter
+    and for a filter selecting a handful of chunks, on flat, IVF and HNSW indexes.
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((NUM_CHUNKS, DIM)).astype(np.float32)
+    ids = np.arange(NUM_CHUNKS, dtype=np.int64)
+    doc_ids = np.sort(rng.integers(0, NUM_CASES, NUM_CHUNKS))
+    # Outcomes skewed like the corpus: "cited" is common, "distinguished" rare
+    outcomes = {case_id: str(rng.choice(OUTCOMES, p=[0.6, 0.2, 0.12, 0.07, 0.01])) for case_id in range(NUM_CASES)}
+    queries = rng.standard_normal((20, DIM)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as root:
+        docs_path = os.path.join(root, "documents")
+        DocumentStore.write(docs_path, ids, (f"chunk {i}" for i in ids), doc_ids)
+        metadata = MetadataIndex(DocumentStore(docs_path), outcomes)
+
+    filters = {
+        "cited or followed": {"case_outcome": ["cited", "followed"]},
+        "distinguished": {"case_outcome": "distinguished"},
+        "three cases": {"case_ids": [3, 500, 1999]},
+        "cited among three cases": {"case_outcome": "cited", "case_ids": [3, 500, 1999]}
+    }
+    for index_type in ("flat", "ivf", "hnsw"):
+        index = create_index(DIM, NUM_CHUNKS, {"index_type": index_type})
+        train_index(index, vectors)
+        index.add_with_ids(vectors, ids)
+        set_search_params(index, nprobe=4, ef_search=32)
+
+        start = time.perf_counter()
+        index.search(queries, TOP_K)
+        unfiltered = time.perf_counter() - start
+        for label, query_filters in filters.items():
+            mask = metadata.resolve(query_filters)
+            start = time.perf_counter()
+            _, found = search_filtered(index, queries, TOP_K, mask)
+            elapsed = time.perf_counter() - start
+
+            expected = exact_filtered(vectors, mask, queries, TOP_K)
+            for row, expected_row in zip(found, expected):
+                hits = row[row >= 0].tolist()
+                assert all(mask[hits]), f"{index_type}, {label}: a hit does not match the filter"
+                assert len(hits) == min(TOP_K, int(mask.sum())), f"{index_type}, {label}: expected {min(TOP_K, int(mask.sum()))} hits, got {len(hits)}"
+                if index_type == "flat":
+                    assert hits == expected_row, f"{label}: filtered flat search differs from brute force"
+            print(f"{index_type}, {label}: {int(mask.sum())} chunks selected, "
+                  f"{elapsed * 1000:.1f} ms against {unfiltered * 1000:.1f} ms unfiltered")
+    print("Metadata filter tests pass")
+
+if __name__ == "__main__":
+    main()
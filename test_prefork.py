@@ -0,0 +1,72 @@
+# src/test_prefork.py
+
+import json
+import os
+import sys
+import urllib.request
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from prefork import PreforkServer, memory_usage
+
+TEST_PORT = 8765
+NUM_WORKERS = 2
+
+def post(endpoint, payload):
+    """
+    POST a JSON payload to the pre-fork server and return the decoded response.
+    """
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{TEST_PORT}/{endpoint}",
+        data=json.dumps(payload).encode('utf-8'),
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+def report_memory(label, pids):
+    """
+    Print RSS, PSS and unique (private) memory of each worker.
+    """
+    print(f"\n{label}")
+    total_pss = 0
+    for pid in pids:
+        usage = memory_usage(pid)
+        total_pss += usage["pss"]
+        print(f"  worker {pid}: RSS {usage['rss']:.0f} MB, PSS {usage['pss']:.0f} MB, unique {usage['uss']:.0f} MB")
+    return total_pss
+
+def main():
+    """
+    Start pre-forked workers, send them questions and report how much memory each worker
+    holds on its own, against one full copy of the models in the parent.
+    """
+    server = PreforkServer({"host": "127.0.0.1", "port": TEST_PORT}, {"workers": NUM_WORKERS})
+    print(f"Loading the models and starting {NUM_WORKERS} workers...")
+    pids = server.start()
+    try:
+        parent = memory_usage()
+        print(f"Parent: RSS {parent['rss']:.0f} MB (one copy of the models and indexes)")
+        report_memory("After warm-up:", pids)
+
+        questions = [
+            "When are indemnity costs awarded instead of party and party costs in court proceedings?",
+            "What criteria are used to assess apparent bias in judicial decisions?",
+            "How does intellectual property law protect inventions?",
+            "What is the process for filing a lawsuit in civil court?"
+        ]
+        for question in questions * NUM_WORKERS:
+            answer = post("answer", {"question": question, "top_k": 5})["answer"]
+            assert isinstance(answer, str) and answer, "Expected a non-empty answer"
+
+        total_pss = report_memory(f"After {len(questions) * NUM_WORKERS} answers:", pids)
+        parent = memory_usage()
+        print(f"\nParent + workers PSS: {total_pss + parent['pss']:.0f} MB, "
+              f"against {(NUM_WORKERS + 1) * parent['rss']:.0f} MB for unshared copies")
+        print("Pre-fork test done")
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# src/test_result_cache.py
+
+import os
+import sys
+import time
+
+import numpy as np
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from result_cache import LRUCache, ResultCache, normalize_query
+
+def test_lru():
+    """
+    The least recently used entry is evicted first, and entries expire after the TTL.
+    """
+    cache = LRUCache(max_entries=2, ttl_seconds=None)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3, "The wrong entry was evicted"
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["hits"] == 3 and stats["misses"] == 1, f"Unexpected stats {stats}"
+
+    cache = LRUCache(max_entries=8, ttl_seconds=0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    assert cache.items() == [] and cache.get("a") is None, "An expired entry was returned"
+    assert cache.stats()["entries"] == 0, "An expired entry was kept after a lookup"
+    print("lru: eviction and expiry")
+
+def test_result_cache():
+    """
+    Queries differing in case and punctuation share an entry; a close embedding is a
+    semantic hit only above the threshold and for the same top_k; answers are keyed by
+    chunk IDs and variant; a new generation clears everything.
+    """
+    cache = ResultCache(max_entries=8, ttl_seconds=None, semantic_threshold=0.95)
+    cache.set_generation(1)
+    embedding = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    key = cache.put_retrieval("What are indemnity costs?", 5, [3, 1], ["chunk 3", "chunk 1"], [30, 10], embedding)
+    assert key == normalize_query("  what are INDEMNITY costs ") == "what are indemnity costs"
+
+    assert cache.get_retrieval("what are indemnity costs", 5) == (key, (3, 1), ["chunk 3", "chunk 1"], [30, 10])
+    assert cache.get_retrieval("what are indemnity costs", 3) is None, "top_k is part of the key"
+
+    close = np.array([0.99, 0.1, 0.0], dtype=np.float32)
+    far = np.array([0.7, 0.7, 0.0], dtype=np.float32)
+    assert cache.get_similar_retrieval(close, 5)[0] == key, "A close query embedding missed"
+    assert cache.get_similar_retrieval(close, 3) is None, "A semantic hit ignored top_k"
+    assert cache.get_similar_retrieval(far, 5) is None, "A query below the threshold hit"
+    assert cache.semantic_hits == 1
+
+    cache.put_answer(key, [3, 1], "Answer", variant="fast")
+    assert cache.get_answer(key, (3, 1), variant="fast") == "Answer"
+    assert cache.get_answer(key, (3, 1), variant="quality") is None, "Answers of another variant were shared"
+    assert cache.get_answer(key, (1, 3), variant="fast") is None, "Answers of other chunks were shared"
+
+    cache.set_generation(1)
+    assert cache.get_retrieval(key, 5) is not None, "The same generation cleared the cache"
+    cache.set_generation(2)
+    assert cache.get_retrieval(key, 5) is None and cache.get_answer(key, (3, 1), variant="fast") is None, \
+        "A new generation kept stale entries"
+    assert ResultCache(semantic_threshold=None).get_similar_retrieval(close, 5) is None
+    print(f"result cache: {cache.stats()}")
+
+def main():
+    """
+    Run the result cache tests.
+    """
+    test_lru()
+    test_result_cache()
+    print("Result cache tests pass")
+
+if __name__ == "__main__":
+    main()
@@ -17,11 +17,12 @@
 
 import sys
 import os
-import pickle
-import faiss
-from sentence_transformers import SentenceTransformer
-from src.retriever import Retriever
-import pandas as pd
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from retriever import Retriever
+from case_store import CaseStore
 
 def load_retriever():
     """
@@ -30,14 +31,7 @@ def load_retriever():
     retriever = Retriever()
     return retriever
 
-def load_preprocessed_dataframe(preprocessed_csv_path):
-    """
-    Load the preprocessed dataframe to map case IDs to original data.
-    """
-    df = pd.read_csv(preprocessed_csv_path)
-    return df
-
-def test_query(retriever, df, query, top_k=5):
+def test_query(retriever, cases, query, top_k=5):
     """
     Retrieve and display the top_k documents for a given query.
     """
@@ -47,11 +41,10 @@ def test_query(retriever, df, query, top_k=5):
     
     retrieved_chunks, retrieved_doc_ids = retriever.retrieve(query, top_k=top_k)
     
-    for i, (chunk, doc_id) in enumerate(zip(retrieved_chunks, retrieved_doc_ids), 1):
-        # Fetch the case title from the dataframe
-        case_title = df.loc[df['case_id'] == doc_id, 'case_title'].values
-        case_title = case_title[0] if len(case_title) > 0 else "N/A"
-        
+    # Fetch the case titles from the case store
+    case_titles = cases.get_titles(retrieved_doc_ids)
+
+    for i, (chunk, doc_id, case_title) in enumerate(zip(retrieved_chunks, retrieved_doc_ids, case_titles), 1):
         print(f"Result {i}:")
         print(f"Case ID: {doc_id}")
         print(f"Case Title: {case_title}")
@@ -62,18 +55,15 @@ def main():
     """
     Main function to execute the retriever tests.
     """
-    # Define paths
-    preprocessed_csv_path = 'data/legal_documents/preprocessed_dataframe.csv'
-       
     # Load Retriever
     print("Loading Retriever...")
     retriever = load_retriever()
     print("Retriever loaded successfully.")
     
-    # Load preprocessed dataframe
-    print("Loading preprocessed dataframe...")
-    df = load_preprocessed_dataframe(preprocessed_csv_path)
-    print("Dataframe loaded successfully.")
+    # Open the case store
+    print("Opening case store...")
+    cases = CaseStore()
+    print("Case store opened successfully.")
     
     # Define sample queries
     sample_queries = [
@@ -86,7 +76,7 @@ def main():
     
     # Test each query
     for query in sample_queries:
-        test_query(retriever, df, query, top_k=5)
+        test_query(retriever, cases, query, top_k=5)
 
 if __name__ == "__main__":
     main()
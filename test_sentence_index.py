@@ -0,0 +1,99 @@
+# src/test_sentence_index.py
+
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+from transformers import AutoTokenizer
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from case_store import CaseStore
+from context_packer import ContextPacker
+from embedding_cache import CachedEmbedder
+from generator import MODEL_NAME_GENERATOR
+from rag_system import RAGSystem
+from sentence_index import SentenceIndex
+
+QUESTION = "When are indemnity costs awarded instead of party and party costs?"
+RELEVANT = ("A departure from normal practice to award indemnity costs requires some special or unusual feature in the case. "
+            "Indemnity costs may be awarded where a party has acted unreasonably in refusing an offer of compromise.")
+FILLER = "The applicant filed further affidavit material in support of the application on the following day. "
+NEW_CASE = "Costs were ordered on an indemnity basis because the respondent unreasonably rejected an offer of compromise."
+
+def make_cases(root):
+    """
+    A case store with a short and a very long case, both holding the relevant sentences.
+    """
+    df = pd.DataFrame({
+        "case_id": [1, 2, 3],
+        "case_outcome": ["cited", "followed", "cited"],
+        "case_title": ["Short case", "Long case", "Unrelated case"],
+        "case_text": [FILLER * 5 + RELEVANT, FILLER * 2000 + RELEVANT + FILLER * 2000, FILLER * 50],
+        "cleaned_title": ["", "", ""],
+        "cleaned_text": ["", "", ""]
+    })
+    cases_path = os.path.join(root, "cases.sqlite")
+    store = CaseStore(cases_path, read_only=False)
+    store.upsert(df)
+    store.close()
+    return cases_path
+
+def main():
+    """
+    Build a sentence index, then check that the context of each case holds its relevant
+    sentences within the token budget while at most 512 sentences per case are scored,
+    and that a case missing from the index is packed from its retrieved chunks alongside
+    the sentences of indexed cases.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        cases_path = make_cases(root)
+        index_dir = os.path.join(root, "sentences")
+        num_cases, num_sentences = SentenceIndex.build(cases_path, index_dir, cache_dir=os.path.join(root, "cache"))
+        print(f"{num_sentences} sentences of {num_cases} cases indexed")
+
+        index = SentenceIndex(index_dir)
+        query = CachedEmbedder(use_cache=False).embed([QUESTION])[0]
+        packer = ContextPacker(AutoTokenizer.from_pretrained(MODEL_NAME_GENERATOR), max_context_tokens=256)
+
+        # The relevant sentences end case 1 and sit in the middle of case 2
+        anchors = {1: [1.0], 2: [0.5]}
+        for case_id in (1, 2):
+            scored = index.candidate_rows([case_id, 3], anchors, rows_per_case=512)
+            assert all(len(rows) <= 512 for rows in scored), f"Case {case_id}: more than 512 sentences scored per case"
+            start = time.perf_counter()
+            rows, sentences, case_ids, _ = index.rank(query, [case_id, 3], anchors=anchors, rows_per_case=512)
+            packed = packer.pack(QUESTION, sentences, rows, case_ids, [(case_ids[i], rows[i]) for i in range(len(rows))])
+            elapsed = time.perf_counter() - start
+
+            assert "indemnity costs" in packed.text, f"Case {case_id}: the relevant sentences were not selected"
+            assert packed.token_count <= 256, f"Case {case_id}: context exceeds the budget"
+            assert set(case_ids) <= {case_id, 3}, "Sentences of other cases were ranked"
+            print(f"case {case_id} ({len(index.rows_of_cases([case_id])[0])} sentences, {len(scored[0])} scored): "
+                  f"{packed.token_count} context tokens in {elapsed * 1000:.1f} ms")
+
+        # A case added after the index was built takes part through its retrieved chunks
+        embedder = CachedEmbedder(use_cache=False)
+        rag = RAGSystem(
+            cases_path=cases_path,
+            cache_params=None,
+            context_params={"max_context_tokens": 256},
+            context_mode="cases",
+            sentences_path=index_dir,
+            retriever=SimpleNamespace(encode=embedder.embed),
+            generator=SimpleNamespace(tokenizer=packer.tokenizer)
+        )
+        packed = rag.pack_context(QUESTION, [40, 41, 10], [NEW_CASE, FILLER, FILLER], [4, 4, 1])
+        assert ("chunk", 40) in packed.chunk_ids and NEW_CASE in packed.text, "The unindexed case was dropped from the context"
+        assert any(kind == "sentence" for kind, _ in packed.chunk_ids), "The indexed case was dropped from the context"
+        assert set(packed.doc_ids) == {1, 4} and packed.token_count <= 256, f"Unexpected mixed context {packed}"
+        assert packed.text.index(NEW_CASE) < packed.text.index("indemnity costs"), "Cases are not in retrieval order"
+        print(f"mixed cases: {len(packed.chunk_ids)} parts, {packed.token_count} context tokens")
+    print("Sentence index tests pass")
+
+if __name__ == "__main__":
+    main()
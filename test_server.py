@@ -0,0 +1,132 @@
+# src/test_server.py
+
+import asyncio
+import os
+import sys
+import threading
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestClient, TestServer
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from server import RAGServer
+
+QUESTION = "When are indemnity costs awarded instead of party and party costs?"
+NUM_CONCURRENT = 8
+
+class StubRAG:
+    """
+    Answers every question with its own text, recording the size of each batch.
+    """
+    def __init__(self):
+        self.retrieval_only = False
+        self.retriever = SimpleNamespace(generation=3)
+        self.retrieval_batches = []
+        self.generation_batches = []
+
+    def retrieve_many(self, questions, top_k=5):
+        self.retrieval_batches.append(len(questions))
+        return [(question, list(range(top_k)), ["chunk"] * top_k, [1] * top_k) for question in questions]
+
+    def answer_retrieved(self, questions, retrievals, batch_size=8, profile=None, deadline=None):
+        self.generation_batches.append(len(questions))
+        return [f"answer to {question}" for question in questions]
+
+    def cache_stats(self):
+        return {}
+
+async def check_bad_requests(client):
+    """
+    Invalid bodies and parameters are rejected with 400, JSON booleans included.
+    """
+    bad_bodies = {
+        "not JSON": b"question?",
+        "JSON list": b'["question"]',
+        "no question": b'{"top_k": 5}',
+        "empty question": b'{"question": " "}',
+        "boolean top_k": b'{"question": "q", "top_k": true}',
+        "zero top_k": b'{"question": "q", "top_k": 0}',
+        "top_k above the maximum": b'{"question": "q", "top_k": 51}',
+        "unknown profile": b'{"question": "q", "profile": "slowest"}',
+        "boolean timeout": b'{"question": "q", "timeout": true}',
+        "negative timeout": b'{"question": "q", "timeout": -1}'
+    }
+    for label, body in bad_bodies.items():
+        response = await client.post("/answer", data=body, headers={"Content-Type": "application/json"})
+        assert response.status == 400, f"{label}: expected 400, got {response.status}"
+    print(f"{len(bad_bodies)} invalid requests rejected with 400")
+
+async def check_server():
+    loaded = threading.Event()
+    rag = StubRAG()
+
+    def factory():
+        loaded.wait(10)
+        return rag
+
+    server = RAGServer(
+        {"workers": 2, "retrieval_max_wait_ms": 50, "generation_max_wait_ms": 50},
+        rag_factory=factory,
+        warm_up=False
+    )
+    async with TestClient(TestServer(server.make_app())) as client:
+        # Health answers while the system loads; readiness and questions wait for it
+        response = await client.get("/health")
+        assert response.status == 200 and not (await response.json())["ready"], "Health failed during loading"
+        assert (await client.get("/ready")).status == 503, "Ready before the system was loaded"
+        assert (await client.post("/answer", json={"question": QUESTION})).status == 503
+
+        loaded.set()
+        for _ in range(100):
+            if server.rag is not None:
+                break
+            await asyncio.sleep(0.05)
+        response = await client.get("/ready")
+        assert response.status == 200 and (await response.json()) == {"ready": True, "generation": 3}
+        print("health and readiness follow loading")
+
+        await check_bad_requests(client)
+
+        # Concurrent requests share retrieval and generation batches
+        questions = [f"{QUESTION} ({i})" for i in range(NUM_CONCURRENT)]
+        responses = await asyncio.gather(*(client.post("/answer", json={"question": q, "top_k": 3}) for q in questions))
+        answers = [(await response.json())["answer"] for response in responses]
+        assert all(response.status == 200 for response in responses)
+        assert answers == [f"answer to {question}" for question in questions], "Answers were mixed up between requests"
+        assert max(rag.retrieval_batches) > 1 and max(rag.generation_batches) > 1, \
+            f"Concurrent requests were not batched: {rag.retrieval_batches}, {rag.generation_batches}"
+        stats = (await (await client.get("/health")).json())["batchers"]
+        assert stats["generation"]["items"] == NUM_CONCURRENT and stats["generation"]["mean_batch_size"] > 1
+        print(f"{NUM_CONCURRENT} concurrent requests: retrieval batches {rag.retrieval_batches}, "
+              f"generation batches {rag.generation_batches}")
+
+async def check_load_error():
+    """
+    A system that fails to load makes /ready answer 500 with the error.
+    """
+    def factory():
+        raise RuntimeError("index missing")
+
+    server = RAGServer({}, rag_factory=factory, warm_up=False)
+    async with TestClient(TestServer(server.make_app())) as client:
+        for _ in range(100):
+            if server.load_error is not None:
+                break
+            await asyncio.sleep(0.05)
+        response = await client.get("/ready")
+        assert response.status == 500 and "index missing" in (await response.json())["load_error"]
+
+def main():
+    """
+    Serve a stub RAG system and check the 400 responses to invalid requests, the health
+    and readiness endpoints while loading, after loading and after a failed load, and
+    that concurrent requests are retrieved and answered in shared batches.
+    """
+    asyncio.run(check_server())
+    asyncio.run(check_load_error())
+    print("Server tests pass")
+
+if __name__ == "__main__":
+    main()
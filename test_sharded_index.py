@@ -0,0 +1,133 @@
+# src/test_sharded_index.py
+
+import os
+import sys
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from index_store import DocumentStore, write_manifest
+from sharded_index import ShardError, ShardedIndex, split_index, start_shard_servers
+
+NUM_CHUNKS = 2000
+NUM_CASES = 200
+DIM = 32
+NUM_SHARDS = 3
+TOP_K = 10
+BASE_PORT = 9301
+
+def build_corpus(root):
+    """
+    Write a small flat index and chunk store of random vectors, in the layout of build_index.py.
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((NUM_CHUNKS, DIM)).astype(np.float32)
+    ids = np.arange(NUM_CHUNKS, dtype=np.int64)
+    doc_ids = np.sort(rng.integers(0, NUM_CASES, NUM_CHUNKS))
+
+    index_path = os.path.join(root, "faiss_index.index")
+    docs_path = os.path.join(root, "documents")
+    index = faiss.IndexIDMap2(faiss.IndexFlatL2(DIM))
+    index.add_with_ids(vectors, ids)
+    faiss.write_index(index, index_path)
+    write_manifest(index_path, {"generation": 1, "next_id": NUM_CHUNKS, "index_params": {"index_type": "flat"}})
+    DocumentStore.write(docs_path, ids, (f"chunk {i}" for i in ids), doc_ids)
+    return index, index_path, docs_path
+
+def check_against_exact(label, sharded, index, queries):
+    """
+    The merged top-k must equal a search of the unsharded index.
+    """
+    _, expected = index.search(queries, TOP_K)
+    found = sharded.search(queries, TOP_K)
+    for row, (chunk_ids, chunks, _) in zip(expected.tolist(), found):
+        assert chunk_ids == row, f"{label}: merged top-k differs from the unsharded index"
+        assert chunks == [f"chunk {i}" for i in chunk_ids], f"{label}: wrong chunk texts"
+    print(f"{label}: {len(queries)} queries match the unsharded index")
+
+class SlowShard:
+    """
+    A shard whose searches take 'delay' seconds, like a stalled host.
+    """
+    def __init__(self, shard, delay):
+        self.shard, self.delay, self.generation = shard, delay, shard.generation
+
+    def search(self, query_embeddings, top_k):
+        time.sleep(self.delay)
+        return self.shard.search(query_embeddings, top_k)
+
+    def close(self):
+        self.shard.close()
+
+def check_slow_shard(shards_dir, queries):
+    """
+    A shard slower than the timeout is reported missing from every result, and the
+    threads it holds with late searches never delay the other shards.
+    """
+    sharded = ShardedIndex.open(shards_dir, {"timeout": 0.2, "threads_per_shard": 2})
+    sharded.shards[0] = SlowShard(sharded.shards[0], delay=1.0)
+    for attempt in range(5):
+        start = time.perf_counter()
+        results = sharded.search(queries[:1], TOP_K)
+        elapsed = time.perf_counter() - start
+        assert results.partial and list(results.missing) == [0], f"Attempt {attempt}: missing shards {results.missing}"
+        assert len(results[0][0]) == TOP_K and elapsed < 0.5, f"Attempt {attempt}: took {elapsed:.2f}s"
+    stats = sharded.stats()
+    assert stats["timeouts"][0] == 5 and stats["timeouts"][1:] == [0] * (NUM_SHARDS - 1), f"Unexpected stats {stats}"
+    print(f"slow shard: {results.missing}, stats {stats}")
+    sharded.close()
+
+def main():
+    """
+    Split a synthetic index into shards and check scatter-gather search with threads,
+    with a shard slower than the timeout, with local shard server processes, and with a failed shard.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        index, index_path, docs_path = build_corpus(root)
+        shards_dir = os.path.join(root, "shards")
+        counts = split_index(index_path, docs_path, shards_dir, NUM_SHARDS)
+        assert sum(counts) == NUM_CHUNKS, "Every chunk must land in exactly one shard"
+        print(f"Split {NUM_CHUNKS} chunks into shards of {counts}")
+
+        queries = np.random.default_rng(1).standard_normal((50, DIM)).astype(np.float32)
+
+        sharded = ShardedIndex.open(shards_dir)
+        check_against_exact("threads", sharded, index, queries)
+        assert not sharded.search(queries, TOP_K).partial, "A healthy search reported missing shards"
+        sharded.close()
+        check_slow_shard(shards_dir, queries)
+
+        processes, addresses = start_shard_servers(shards_dir, BASE_PORT)
+        try:
+            remote = ShardedIndex.connect(addresses, {"timeout": 5.0})
+            check_against_exact("shard servers", remote, index, queries)
+
+            # Stop one server: partial results by default, ShardError when partial results are refused
+            processes[0].terminate()
+            processes[0].wait()
+            partial = remote.search(queries[:1], TOP_K)
+            assert len(partial[0][0]) == TOP_K, "The remaining shards should still fill the top-k"
+            assert list(partial.missing) == [0], f"The stopped shard was not reported: {partial.missing}"
+            print(f"one shard down: partial result from {NUM_SHARDS - 1} shards, stats {remote.stats()}")
+
+            strict = ShardedIndex.connect(addresses, {"timeout": 5.0, "allow_partial": False})
+            try:
+                strict.search(queries[:1], TOP_K)
+                raise AssertionError("Expected ShardError with allow_partial=False")
+            except ShardError as e:
+                print(f"one shard down, allow_partial=False: ShardError ({e})")
+            remote.close()
+            strict.close()
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+    print("Sharded index tests pass")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# src/test_update_index.py
+
+import os
+import sys
+import tempfile
+
+import faiss
+import numpy as np
+import pandas as pd
+
+# The src modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from ann_index import create_index
+from case_store import CaseStore
+from embedding_cache import CachedEmbedder
+from index_store import DocumentStore, read_manifest, write_manifest
+from retriever import Retriever
+from update_index import IndexUpdater
+
+QUESTION = "When are indemnity costs awarded instead of party and party costs?"
+FILLER = "The applicant filed further affidavit material in support of the application on the following day. "
+CASES = pd.DataFrame({
+    "case_id": ["Case1", "Case2", "Case3"],
+    "case_outcome": ["cited", "followed", "applied"],
+    "case_title": ["First case", "Second case", "Indemnity costs case"],
+    "case_text": [
+        FILLER * 6,
+        "The test for apparent bias is whether a fair-minded lay observer might reasonably apprehend bias. " * 3,
+        "Indemnity costs are awarded instead of party and party costs where a party unreasonably refused an offer of compromise. " * 3
+    ]
+})
+
+def make_index(root):
+    """
+    An empty flat index, chunk store and case store, chunked by 20 words.
+    """
+    paths = {name: os.path.join(root, name) for name in ("index.faiss", "documents", "cases.sqlite", "lexical", "cache")}
+    dim = CachedEmbedder(use_cache=False).dimension()
+    faiss.write_index(create_index(dim, 0, {"index_type": "flat"}), paths["index.faiss"])
+    write_manifest(paths["index.faiss"], {"generation": 0, "next_id": None, "chunk_params": {"chunking": "words", "max_length": 20}})
+    DocumentStore.write(paths["documents"], [], [], [])
+    CaseStore(paths["cases.sqlite"], read_only=False).close()
+    return paths
+
+def retrieve(retriever, top_k):
+    chunk_ids, _, doc_ids = retriever.retrieve_batch([QUESTION], top_k=top_k, return_ids=True)[0]
+    return chunk_ids, doc_ids
+
+def main():
+    """
+    Add, replace, delete and compact cases, checking that chunk IDs stay stable, that
+    readers of an older generation keep working, that searches over-fetch to return
+    top_k live chunks while deleted ones are still in the index, and that staged changes
+    only show once published.
+    """
+    with tempfile.TemporaryDirectory() as root:
+        paths = make_index(root)
+        updater = IndexUpdater(
+            index_path=paths["index.faiss"],
+            docs_path=paths["documents"],
+            preprocessed_csv_path=os.path.join(root, "missing.csv"),
+            cases_path=paths["cases.sqlite"],
+            cache_dir=paths["cache"],
+            use_cache=False,
+            lexical_path=paths["lexical"]
+        )
+
+        count = updater.add_cases(CASES.iloc[:2])
+        manifest = read_manifest(paths["index.faiss"])
+        assert manifest["generation"] == 1 and manifest["next_id"] == count, f"Unexpected manifest {manifest}"
+        assert faiss.read_index(paths["index.faiss"]).ntotal == count, "The published index misses added chunks"
+        ids_of_case2 = updater.store.ids_for_cases([2])
+        positions = [updater.store.position_in_case(chunk_id) for chunk_id in ids_of_case2]
+        assert positions[0] == 0 and positions[-1] == 1 and positions == sorted(positions), f"Unexpected positions {positions}"
+        print(f"added 2 cases: {count} chunks, generation {manifest['generation']}")
+
+        retriever = Retriever(index_path=paths["index.faiss"], docs_path=paths["documents"],
+                              lexical_path=paths["lexical"], cases_path=paths["cases.sqlite"])
+        reader = DocumentStore(paths["documents"])
+        first_chunk = reader.get(ids_of_case2[0])
+
+        # A new case gets fresh IDs; stores opened before the add are not affected
+        added = updater.add_cases(CASES.iloc[2:])
+        assert updater.store.ids_for_cases([3]) == list(range(count, count + added)), "New chunks did not get the next IDs"
+        assert updater.store.ids_for_cases([2]) == ids_of_case2, "IDs of untouched cases changed"
+        assert reader.get(ids_of_case2[0]) == first_chunk, "A store opened before the add saw it change"
+        assert retriever.reload_if_changed(), "The new generation was not picked up"
+        _, doc_ids = retrieve(retriever, 1)
+        assert doc_ids == [3], f"The added case is not the best match: {doc_ids}"
+
+        # Replacing a case deletes its chunks and adds new ones after every existing ID
+        old_ids_of_case1 = updater.store.ids_for_cases([1])
+        replaced = updater.add_cases(CASES.iloc[:1])
+        new_ids_of_case1 = updater.store.ids_for_cases([1])
+        assert min(new_ids_of_case1) == count + added and len(new_ids_of_case1) == replaced, "Replaced chunks did not get the next IDs"
+        assert set(old_ids_of_case1) <= updater.store.deleted, "Old chunks of a replaced case are still live"
+
+        # Deleted chunks are still in FAISS: searches over-fetch to fill top_k with live chunks
+        updater.delete_cases([3])
+        assert retriever.reload_if_changed()
+        live = len(updater.store.live_ids())
+        chunk_ids, doc_ids = retrieve(retriever, live)
+        assert len(chunk_ids) == live and 3 not in doc_ids, f"Expected {live} live chunks without case 3, got {doc_ids}"
+        assert retriever.index.ntotal > live, "Deleted chunks should stay in the index until compaction"
+        print(f"deleted case 3: {live} live chunks of {retriever.index.ntotal} indexed")
+
+        removed = updater.compact()
+        assert retriever.reload_if_changed()
+        assert retriever.index.ntotal == live and removed == len(old_ids_of_case1) + added, f"Compaction removed {removed} rows"
+        assert not retriever.store.deleted and updater.store.ids_for_cases([2]) == ids_of_case2, "Compaction changed live IDs"
+        assert sorted(retrieve(retriever, live)[0]) == sorted(chunk_ids), "Compaction changed the search results"
+        assert read_manifest(paths["index.faiss"])["next_id"] == count + added + replaced, "Compaction reset next_id"
+        print(f"compacted {removed} rows, generation {read_manifest(paths['index.faiss'])['generation']}")
+
+        # A restarted updater derives next_id from the store, never reusing a committed ID
+        restarted = IndexUpdater(
+            index_path=paths["index.faiss"],
+            docs_path=paths["documents"],
+            cases_path=paths["cases.sqlite"],
+            use_cache=False,
+            lexical_path=paths["lexical"]
+        )
+        assert restarted.manifest["next_id"] > int(np.max(updater.store.live_ids())), "next_id would reuse an ID"
+
+        # Staged adds stay invisible until publish(); an update interrupted after the index
+        # write leaves vectors that the next updater drops
+        committed_rows = len(DocumentStore(paths["documents"]))
+        staged = restarted.add_cases(CASES.iloc[2:], publish=False)
+        assert len(DocumentStore(paths["documents"])) == committed_rows, "A staged add was visible to readers"
+        restarted._write_index()
+        recovered = IndexUpdater(
+            index_path=paths["index.faiss"],
+            docs_path=paths["documents"],
+            cases_path=paths["cases.sqlite"],
+            use_cache=False,
+            lexical_path=paths["lexical"]
+        )
+        assert recovered.index.ntotal == committed_rows and recovered.index_changed, "Vectors of the interrupted add were kept"
+        assert recovered.add_cases(CASES.iloc[2:]) == staged
+        assert len(DocumentStore(paths["documents"])) == committed_rows + staged, "The published add is missing"
+        assert faiss.read_index(paths["index.faiss"]).ntotal == committed_rows + staged
+        print(f"interrupted add of {staged} chunks recovered")
+    print("Update index tests pass")
+
+if __name__ == "__main__":
+    main()